@@ -0,0 +1,63 @@
+#Copyright 2025 Thales
+#
+# Redistribution and use in source and binary forms, with or 
+# without modification, are permitted provided that the following 
+# conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+# 
+# 3. Neither the name of the copyright holder nor the names of its 
+#    contributors may be used to endorse or promote products derived from 
+#    this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS 
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT 
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR 
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT 
+# HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, 
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED 
+# TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR 
+# PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF 
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING 
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS 
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.  
+
+# Throughput of a large file read on each PCSC reader: short APDUs (one
+# READ BINARY per 256 bytes) against the APDU sizes detected for the reader.
+#   python -m example.bench_apdu [file id, hex] [runs]
+
+import sys
+
+from fido2.pcsc import _list_readers
+from thalessecuritykey.apdu import ApduProfile, measure_read
+from thalessecuritykey.const import APDU_SELECT_FILE
+from thalessecuritykey.pcsc import PcscThalesDevice
+
+
+file_id = bytes.fromhex(sys.argv[1]) if len(sys.argv) > 1 else b"\x02\x01"
+runs    = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+select  = APDU_SELECT_FILE + bytes([len(file_id)]) + file_id
+
+for reader in _list_readers():
+    try:
+        dev = PcscThalesDevice(reader.createConnection(), reader.name)
+    except Exception:
+        print("\33[93m%s: no usable device\33[0m" % reader.name)
+        continue
+
+    with dev:
+        print("%s [%s]" % (reader.name, dev.apdu_profile))
+        for label, profile in (("short", ApduProfile(dev.apdu_profile.interface)), ("detected", dev.apdu_profile)):
+            try:
+                with dev.transaction():
+                    result = measure_read(dev._exchange, profile, select, runs)
+            except IOError as e:
+                print("  %-8s %s" % (label, e))
+                continue
+            print("  %-8s %6d bytes  %5.1f round-trips  %8.2f ms  %10.0f B/s" % (
+                  label, result["bytes"], result["round_trips"], result["seconds"] * 1000, result["bytes_per_second"] or 0))
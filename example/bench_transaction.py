@@ -0,0 +1,67 @@
+#Copyright 2025 Thales
+#
+# Redistribution and use in source and binary forms, with or 
+# without modification, are permitted provided that the following 
+# conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+# 
+# 3. Neither the name of the copyright holder nor the names of its 
+#    contributors may be used to endorse or promote products derived from 
+#    this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS 
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT 
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR 
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT 
+# HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, 
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED 
+# TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR 
+# PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF 
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING 
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS 
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.  
+
+# Measures the discovery latency of each PCSC token with & without the
+# exclusive PCSC transaction.
+#   python -m example.bench_transaction [runs]
+
+import sys
+import statistics
+
+from fido2.pcsc import _list_readers
+from thalessecuritykey.pcsc import PcscThalesDevice
+
+
+def measure(reader, runs, use_transaction):
+    PcscThalesDevice.use_transaction = use_transaction
+    timings = []
+    for _ in range(runs):
+        try:
+            dev = PcscThalesDevice(reader.createConnection(), reader.name)
+        except Exception:
+            return None
+        timings.append(dev.discovery_time)
+        dev.close()
+    return timings
+
+
+runs = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+
+for reader in _list_readers():
+    without = measure(reader, runs, False)
+    with_tr = measure(reader, runs, True)
+    if( without == None ) or ( with_tr == None ):
+        print("\33[93m%s: no usable device\33[0m" % reader.name)
+        continue
+    a = statistics.median(without) * 1000
+    b = statistics.median(with_tr) * 1000
+    print("%s" % reader.name)
+    print("   without transaction: %7.1f ms (median of %d)" % (a, runs))
+    print("   with transaction:    %7.1f ms (median of %d)" % (b, runs))
+    print("   \33[92mgain:                %7.1f ms (%.0f%%)\33[0m" % (a - b, 100 * (a - b) / a if a else 0))
@@ -31,12 +31,12 @@ from thalessecuritykey import helpers
 
 for _ in iter(int, 1):
     print("\33[93mWaiting device...\33[0m")
-    devices   = helpers.scan_devices()
-    print("\33[93mFound [%d] device(s)...\33[0m" % len(devices))
-    for device in devices:
-        device.dump()
+    with helpers.scan_devices() as devices:
+        print("\33[93mFound [%d] device(s)...\33[0m" % len(devices))
+        for device in devices:
+            device.dump()
 
-        print("")
+            print("")
     input("\33[93mPress Enter to continue...\33[0m")
 
 
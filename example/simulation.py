@@ -0,0 +1,238 @@
+#Copyright 2025 Thales
+#
+# Redistribution and use in source and binary forms, with or 
+# without modification, are permitted provided that the following 
+# conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+# 
+# 3. Neither the name of the copyright holder nor the names of its 
+#    contributors may be used to endorse or promote products derived from 
+#    this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS 
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT 
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR 
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT 
+# HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, 
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED 
+# TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR 
+# PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF 
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING 
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS 
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.  
+
+
+import itertools
+import struct
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+
+from fido2.hid import HidDescriptor, CAPABILITY
+
+try:
+    from smartcard.Exceptions import NoCardException
+except ImportError:
+    # PCSC support is optional (pyscard)
+    class NoCardException(Exception):
+        pass
+
+from thalessecuritykey.const import (thales_vendor_id, AID_CARD_MANAGER, APDU_GET_DETAILS, APDU_GET_SN,
+                    TAG_CM_SERIAL_NUMBER, TAG_CM_PRODUCT_NAME)
+
+
+# Simulated tokens, to exercise the discovery without hardware (tests & soak
+# runs, see example/soak.py). Not part of the library.
+#
+# SimulatedHidConnection answers the CTAPHID INIT and the Thales vendor
+# commands used by CtapHidThalesDevice; SimulatedCard answers the APDUs of the
+# card manager. SimulatedBus holds the inserted tokens and, inside install(),
+# replaces the HID & PCSC enumeration so that scan_devices() sees them.
+
+_SW_NOT_FOUND = ([], 0x6A, 0x82)
+
+
+class SimulatedHidConnection():
+    """ CtapHidConnection of a simulated FIDO token """
+
+    def __init__(self, serial_number: Optional[str], fido_version: str = "4.5.1", packet_size: int = 64):
+        self.serial_number  = serial_number
+        self.fido_version   = fido_version
+        self.packet_size    = packet_size
+        self.closed         = False
+        self._channel       = 0xFFFFFFFF
+        self._responses     = []
+
+    def _reply(self, channel, cmd, data):
+        packet = struct.pack(">IBH", channel, 0x80 | cmd, len(data)) + data
+        self._responses.append(packet.ljust(self.packet_size, b"\0"))
+
+    def write_packet(self, packet: bytes) -> None:
+        if( self.closed ):
+            raise OSError("Device removed")
+        channel, cmd = struct.unpack_from(">IB", packet)
+        cmd &= 0x7F
+        length = struct.unpack_from(">H", packet, 5)[0]
+        data = packet[7:7 + length]
+        if( cmd == 0x06 ):     # INIT
+            self._channel = 0x01020304
+            self._reply(channel, cmd, data + struct.pack(">IBBBBB", self._channel, 2, 31, 2, 3, CAPABILITY.CBOR | CAPABILITY.WINK))
+        elif( cmd == 0x50 ) and ( data == b"\x66" ):
+            self._reply(channel, cmd, b"\x00\x00" + self.fido_version.encode("utf-8") + b"\x00")
+        elif( cmd == 0x50 ) and ( data == b"\x55" ) and ( self.serial_number == None ):
+            self._reply(channel, cmd, b"\x01")      # No accessible S/N
+        elif( cmd == 0x50 ) and ( data == b"\x55" ):
+            self._reply(channel, cmd, b"\x00\x02" + self.serial_number.encode("utf-8"))
+        else:
+            self._reply(channel, 0x3F, b"\x01")     # ERROR: invalid command
+
+    def read_packet(self) -> bytes:
+        if( self.closed ) or ( not self._responses ):
+            raise OSError("No response")
+        return self._responses.pop(0)
+
+    def close(self) -> None:
+        self.closed = True
+
+
+class SimulatedCard():
+    """ CardConnection of a simulated Thales card (card manager only) """
+
+    def __init__(self, serial_number: str, product_name: str = "Simulated Card", atr: bytes = b"\x3B\x00"):
+        details = TAG_CM_SERIAL_NUMBER + bytes([len(serial_number)]) + serial_number.encode("utf-8")
+        details += TAG_CM_PRODUCT_NAME + bytes([len(product_name)]) + product_name.encode("utf-8")
+        self.atr        = atr
+        self.connected  = False
+        self.present    = True
+        self.delay      = 0.0       # Duration of each APDU (seconds)
+        self.answers: Dict[bytes, Tuple[List[int], int, int]] = {
+            AID_CARD_MANAGER:   ([], 0x90, 0x00),
+            APDU_GET_DETAILS:   (list(details), 0x90, 0x00),
+            APDU_GET_SN:        (list(b"\x00\x00\x00" + serial_number.encode("utf-8")), 0x90, 0x00),
+        }
+
+    @property
+    def component(self):
+        return self
+
+    @property
+    def hcard(self):
+        # Not an int: no PCSC transaction
+        return "simulated" if self.connected else None
+
+    def connect(self, protocol = None, mode = None, disposition = None) -> None:
+        if( not self.present ):
+            raise NoCardException("No card in the reader")
+        self.connected = True
+
+    def disconnect(self) -> None:
+        self.connected = False
+
+    def getATR(self) -> List[int]:
+        return list(self.atr) if self.present else []
+
+    def transmit(self, apdu, protocol = None) -> Tuple[List[int], int, int]:
+        if( not self.connected ):
+            raise OSError("Card not connected")
+        if( self.delay ):
+            time.sleep(self.delay)
+        return self.answers.get(bytes(apdu), _SW_NOT_FOUND)
+
+
+class _SimulatedReader():
+    def __init__(self, name: str, card: SimulatedCard):
+        self.name = name
+        self.card = card
+
+    def createConnection(self):
+        return self.card
+
+    def __str__(self):
+        return self.name
+
+
+class SimulatedBus():
+    """ Tokens currently 'inserted' in the simulated HID bus & PCSC readers """
+
+    def __init__(self):
+        self._lock      = threading.Lock()
+        self._serials   = itertools.count()
+        self._hid: Dict[str, Tuple[HidDescriptor, str]] = {}
+        self._readers: Dict[str, SimulatedCard] = {}
+        self.connections: List[SimulatedHidConnection] = []
+        try:
+            from thalessecuritykey import pcsc
+            self._pcsc = pcsc
+        except ImportError:
+            # PCSC support is optional (pyscard)
+            self._pcsc = None
+
+    def _serial_number(self) -> str:
+        return f"SIM{next(self._serials):010d}"
+
+    def insert_hid(self, serial_number: str = None) -> HidDescriptor:
+        serial_number = serial_number or self._serial_number()
+        with self._lock:
+            path = f"sim/hid{len(self._hid)}"
+            descriptor = HidDescriptor(path, thales_vendor_id, 0x0001, 64, 64, "Simulated Token", None)
+            self._hid[path] = (descriptor, serial_number)
+        return descriptor
+
+    def insert_card(self, reader: str = None, serial_number: str = None) -> SimulatedCard:
+        card = SimulatedCard(serial_number or self._serial_number())
+        with self._lock:
+            self._readers[reader or f"Simulated Reader {len(self._readers)}"] = card
+        return card
+
+    def remove_all(self) -> None:
+        with self._lock:
+            for card in self._readers.values():
+                card.present = False
+            self._hid.clear()
+            self._readers.clear()
+
+    def list_descriptors(self) -> List[HidDescriptor]:
+        with self._lock:
+            return [descriptor for descriptor, _ in self._hid.values()]
+
+    def open_connection(self, descriptor: HidDescriptor) -> SimulatedHidConnection:
+        with self._lock:
+            _, serial_number = self._hid[descriptor.path]
+        conn = SimulatedHidConnection(serial_number)
+        self.connections = [c for c in self.connections if not c.closed] + [conn]
+        return conn
+
+    def list_readers(self) -> list:
+        with self._lock:
+            return [_SimulatedReader(name, card) for name, card in self._readers.items()]
+
+    @property
+    def open_connections(self) -> int:
+        """ Simulated HID connections & cards not closed yet """
+        with self._lock:
+            cards = list(self._readers.values())
+        return sum(1 for c in self.connections if not c.closed) + sum(1 for c in cards if c.connected)
+
+    @contextmanager
+    def install(self):
+        """ Makes the HID & PCSC enumeration (and so scan_devices) see the simulated tokens """
+        from thalessecuritykey import hid
+        patches = [(hid, "list_descriptors", self.list_descriptors), (hid, "open_connection", self.open_connection)]
+        if( self._pcsc != None ):
+            patches += [(self._pcsc, "_list_readers", self.list_readers), (self._pcsc, "_reader_states", lambda names: None)]
+
+        saved = [(module, name, getattr(module, name)) for module, name, _ in patches]
+        for module, name, value in patches:
+            setattr(module, name, value)
+        try:
+            yield self
+        finally:
+            for module, name, value in saved:
+                setattr(module, name, value)
@@ -0,0 +1,57 @@
+#Copyright 2025 Thales
+#
+# Redistribution and use in source and binary forms, with or 
+# without modification, are permitted provided that the following 
+# conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+# 
+# 3. Neither the name of the copyright holder nor the names of its 
+#    contributors may be used to endorse or promote products derived from 
+#    this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS 
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT 
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR 
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT 
+# HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, 
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED 
+# TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR 
+# PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF 
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING 
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS 
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.  
+
+# Endurance test of the scan loop on simulated tokens: fails (exit code 1)
+# when memory, file descriptors, device handles or latency drift.
+#   python -m example.soak [hid|pcsc|scan] [cycles]
+
+import sys
+import json
+
+from example.simulation import SimulatedBus
+from thalessecuritykey.soak import SoakHarness, hid_cycle, pcsc_cycle, scan_cycle
+
+
+mode   = sys.argv[1] if len(sys.argv) > 1 else "hid"
+cycles = int(sys.argv[2]) if len(sys.argv) > 2 else 5000
+
+bus    = SimulatedBus()
+cycle  = {"hid": hid_cycle, "pcsc": pcsc_cycle, "scan": scan_cycle}[mode](bus)
+report = SoakHarness(cycle, cycles=cycles, sample_every=max(1, cycles // 20)).run()
+
+for sample in report.samples:
+    print("cycle %6d  p50 %7.3fms  p99 %7.3fms  rss %6s KiB  fds %4s  handles %3d  traced %8s B" % (
+          sample.cycle, sample.p50 * 1000, sample.p99 * 1000, (sample.rss or 0) // 1024, sample.fds,
+          sample.handles, sample.traced))
+
+if( not report.ok ):
+    print("\33[91m%s\33[0m" % json.dumps({"failures": report.failures, "errors": report.errors, "last_error": report.last_error,
+                                         "top_allocators": report.top_allocators}, indent=2))
+    sys.exit(1)
+print("\33[92mNo drift over %d cycles (%d errors)\33[0m" % (cycles, report.errors))
@@ -0,0 +1,73 @@
+from thalessecuritykey.apdu import ApduProfile, historical_bytes, supports_extended_length, read_binary, measure_read
+from thalessecuritykey.const import Interface
+
+# Contact ATR, historical bytes: 80 73 00 00 C0 (card capabilities: extended Lc/Le)
+ATR_EXTENDED    = bytes.fromhex("3b0580730000c0")
+ATR_FUSION_CC   = bytes.fromhex("3bff9600008131fe4380318065b0855956fb12017882900088")
+ATR_FUSION_NFC  = bytes.fromhex("3b8f800180318065b00000000012017882900000")
+
+
+class FakeFile():
+    """ Card answering READ BINARY on a file of 'size' bytes """
+    def __init__(self, size, extended = True):
+        self.content = bytes(i & 0xFF for i in range(size))
+        self.extended = extended
+        self.apdus = []
+
+    def exchange(self, apdu):
+        self.apdus.append(apdu)
+        offset = int.from_bytes(apdu[2:4], "big")
+        if( len(apdu) == 7 ):
+            if( not self.extended ):
+                return [], 0x67, 0x00
+            le = int.from_bytes(apdu[5:7], "big") or 65536
+        else:
+            le = apdu[4] or 256
+        if( offset >= len(self.content) ):
+            return [], 0x6B, 0x00
+        return list(self.content[offset:offset + le]), 0x90, 0x00
+
+
+def test_detect():
+    assert historical_bytes(ATR_FUSION_CC).hex() == "80318065b0855956fb120178829000"
+    assert not supports_extended_length(ATR_FUSION_CC)
+    assert supports_extended_length(ATR_EXTENDED)
+
+    profile = ApduProfile.detect(ATR_FUSION_NFC, "ACS ACR122U PICC Interface")
+    assert (profile.interface, profile.extended, profile.read_size) == (Interface.CONTACTLESS, False, 256)
+    assert ApduProfile.detect(ATR_FUSION_CC, "Thales eToken Fusion 00 00").interface == Interface.CONTACT
+
+    profile = ApduProfile.detect(ATR_EXTENDED, "Contact Reader", max_input=1034)
+    assert (profile.interface, profile.extended, profile.read_size) == (Interface.CONTACT, True, 1027)
+
+    # A reader which cannot carry more than a short APDU
+    assert not ApduProfile.detect(ATR_EXTENDED, "Contact Reader", max_input=261).extended
+
+    # No maximum message size (Windows), or a contactless reader: short APDUs
+    assert not ApduProfile.detect(ATR_EXTENDED, "Contact Reader").extended
+    profile = ApduProfile.detect(ATR_EXTENDED, "ACS ACR1252 PICC Reader", max_input=1034)
+    assert (profile.interface, profile.extended, profile.read_size) == (Interface.CONTACTLESS, False, 256)
+
+
+def test_read_binary_chunks():
+    card = FakeFile(3000)
+    ok, data = read_binary(card.exchange, ApduProfile())
+    assert ok and data == card.content
+    assert len(card.apdus) == 12
+    assert card.apdus[1] == bytes.fromhex("00b0010000")
+
+    card = FakeFile(3000)
+    ok, data = read_binary(card.exchange, ApduProfile(Interface.CONTACT, True, 2048, 2048))
+    assert ok and data == card.content
+    assert [apdu.hex() for apdu in card.apdus] == ["00b00000000800", "00b00800000800"]
+
+    card = FakeFile(3000)
+    ok, data = read_binary(card.exchange, ApduProfile(), size=300)
+    assert ok and data == card.content[:300]
+
+
+def test_measure_read():
+    card = FakeFile(1024)
+    result = measure_read(card.exchange, ApduProfile(Interface.CONTACT, True, 2048, 2048), repeat=3)
+    assert result["bytes"] == 1024
+    assert result["round_trips"] == 1
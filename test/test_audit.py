@@ -0,0 +1,191 @@
+import hashlib
+import os
+from types import SimpleNamespace
+
+import pytest
+from fido2.ctap import CtapError
+from fido2.ctap2 import ClientPin, CredentialManagement, Info
+from fido2.ctap2.pin import PinProtocolV2
+
+from thalessecuritykey import audit
+from thalessecuritykey.audit import AuditSession, ReadOnlyCredentialManagement, audit_credentials
+from thalessecuritykey.device import ThalesDevice
+
+R = CredentialManagement.RESULT
+
+# serial number -> {rp id: [user names]}
+CREDENTIALS = {
+    "KEY1": {"example.com": ["alice", "bob"], "thalesgroup.com": ["carol"]},
+    "KEY2": {},
+    "KEY3": {"example.com": ["dave"]},
+}
+
+
+class FakeClientPin():
+    PERMISSION = ClientPin.PERMISSION
+    issued = []
+
+    def __init__(self, ctap):
+        self.ctap = ctap
+        self.protocol = "protocol"
+
+    def get_pin_token(self, pin, permissions):
+        assert pin == "123456"
+        assert permissions == ClientPin.PERMISSION.CREDENTIAL_MGMT
+        token = f"token-{self.ctap.device.serial_number}-{len(self.issued)}"
+        self.issued.append(token)
+        return token
+
+
+class FakeCredman(CredentialManagement):
+    expired = set()
+
+    def __init__(self, ctap, protocol, token):
+        self.device = ctap.device
+        self.token = token
+        self.creds = CREDENTIALS[ctap.device.serial_number]
+
+    def get_metadata(self):
+        if( self.token in self.expired ):
+            raise CtapError(CtapError.ERR.PIN_TOKEN_EXPIRED)
+        return {R.EXISTING_CRED_COUNT: sum(len(u) for u in self.creds.values()), R.MAX_REMAINING_COUNT: 25}
+
+    def enumerate_rps(self):
+        return [{R.RP: {"id": rp}, R.RP_ID_HASH: rp.encode()} for rp in self.creds]
+
+    def enumerate_creds(self, rp_id_hash):
+        # Enumeration runs inside the background session of the device
+        assert self.device._scheduler.is_busy
+        return [{R.USER: {"id": name.encode(), "name": name}, R.CREDENTIAL_ID: {"id": b"\x01", "type": "public-key"}}
+                for name in self.creds[rp_id_hash.decode()]]
+
+
+def _device(serial_number):
+    dev = ThalesDevice("Key", True)
+    dev.serial_number = serial_number
+    return dev
+
+
+def _setup(monkeypatch):
+    FakeClientPin.issued = []
+    FakeCredman.expired = set()
+    monkeypatch.setattr(audit, "Ctap2", lambda device: SimpleNamespace(device=device, info=SimpleNamespace(options={})))
+    monkeypatch.setattr(audit, "ClientPin", FakeClientPin)
+    monkeypatch.setattr(audit, "CredentialManagement", FakeCredman)
+
+
+def test_audit_all_keys(monkeypatch):
+    _setup(monkeypatch)
+    results = []
+    records = list(audit_credentials([_device(sn) for sn in CREDENTIALS], "123456", results=results))
+
+    assert sorted((r.serial_number, r.rp_id, r.user_name) for r in records) == [
+        ("KEY1", "example.com", "alice"), ("KEY1", "example.com", "bob"),
+        ("KEY1", "thalesgroup.com", "carol"), ("KEY3", "example.com", "dave")]
+    assert {r.serial_number: (r.credentials, r.rps, r.error) for r in results} == {
+        "KEY1": (3, 2, None), "KEY2": (0, 0, None), "KEY3": (1, 1, None)}
+
+
+def test_token_reused(monkeypatch):
+    _setup(monkeypatch)
+    devices = [_device(sn) for sn in CREDENTIALS]
+    session = AuditSession("123456", max_workers=2)
+    assert len(list(session.audit(devices))) == 4
+    assert session.authentications == 3
+
+    results = []
+    assert len(list(session.audit(devices, results))) == 4
+    assert session.authentications == 3
+    assert all(r.token_reused for r in results)
+
+    # A key dropping its token is authenticated again
+    FakeCredman.expired.add(session._tokens["KEY1"][1])
+    results = []
+    assert len(list(session.audit(devices, results))) == 4
+    assert session.authentications == 4
+    assert [r.token_reused for r in results if r.serial_number == "KEY1"] == [False]
+
+
+def test_audit_error(monkeypatch):
+    _setup(monkeypatch)
+    results = []
+    records = list(audit_credentials([_device("KEY3"), _device("KEY1")], lambda device: "000000", results=results))
+    assert records == []
+    assert all(r.error for r in results)
+
+
+# GetInfo of a CTAP 2.1 key with persistent read-only credential management
+INFO = Info.from_dict({1: ["FIDO_2_0", "FIDO_2_1"], 3: bytes(16), 5: 1200, 6: [2, 1],
+                       4: {"rk": True, "clientPin": True, "pinUvAuthToken": True, "credMgmt": True, "perCredMgmtRO": True}})
+
+
+class FakeCtap2():
+    """ Authenticator answering the credential management subcommands """
+
+    def __init__(self, device):
+        self.device = device
+        self.info = INFO
+        self.commands = []
+        self.rps = {hashlib.sha256(rp.encode()).digest(): (rp, users) for rp, users in CREDENTIALS[device.serial_number].items()}
+        self.pending = []
+
+    def credential_mgmt(self, sub_cmd, sub_cmd_params = None, pin_uv_protocol = None, pin_uv_param = None):
+        assert self.device._scheduler.is_busy
+        self.commands.append((sub_cmd, pin_uv_param != None))
+        CMD = CredentialManagement.CMD
+        if( sub_cmd == CMD.GET_CREDS_METADATA ):
+            return {R.EXISTING_CRED_COUNT: sum(len(users) for _, users in self.rps.values()), R.MAX_REMAINING_COUNT: 25}
+        if( sub_cmd == CMD.ENUMERATE_RPS_BEGIN ):
+            self.pending = [{R.RP: {"id": rp}, R.RP_ID_HASH: rp_id_hash} for rp_id_hash, (rp, _) in self.rps.items()]
+            return {**self.pending.pop(0), R.TOTAL_RPS: len(self.rps)}
+        if( sub_cmd == CMD.ENUMERATE_CREDS_BEGIN ):
+            users = self.rps[sub_cmd_params[CredentialManagement.PARAM.RP_ID_HASH]][1]
+            self.pending = [{R.USER: {"id": name.encode(), "name": name}, R.CREDENTIAL_ID: {"id": os.urandom(16), "type": "public-key"}}
+                            for name in users]
+            return {**self.pending.pop(0), R.TOTAL_CREDENTIALS: len(users)}
+        if( sub_cmd in (CMD.ENUMERATE_RPS_NEXT, CMD.ENUMERATE_CREDS_NEXT) ):
+            return self.pending.pop(0)
+        raise CtapError(CtapError.ERR.INVALID_COMMAND)
+
+
+class PersistentClientPin(FakeClientPin):
+    def __init__(self, ctap):
+        super().__init__(ctap)
+        self.protocol = PinProtocolV2()
+
+    def get_pin_token(self, pin, permissions):
+        assert permissions == ClientPin.PERMISSION.PERSISTENT_CREDENTIAL_MGMT
+        self.issued.append(pin)
+        return os.urandom(32)
+
+
+def test_audit_persistent_token(monkeypatch):
+    PersistentClientPin.issued = []
+    authenticators = {}
+    def ctap2(device):
+        authenticators[device.serial_number] = FakeCtap2(device)
+        return authenticators[device.serial_number]
+    monkeypatch.setattr(audit, "Ctap2", ctap2)
+    monkeypatch.setattr(audit, "ClientPin", PersistentClientPin)
+
+    device = _device("KEY1")
+    sessions = []
+    session = device.session
+    device.session = lambda *args, **kwargs: sessions.append(args) or session(*args, **kwargs)
+
+    records = list(audit_credentials([device], "123456"))
+    assert sorted((r.rp_id, r.user_name) for r in records) == [
+        ("example.com", "alice"), ("example.com", "bob"), ("thalesgroup.com", "carol")]
+
+    # Only the read-only subcommands, the begin ones authenticated with the persistent token
+    CMD = CredentialManagement.CMD
+    assert authenticators["KEY1"].commands == [
+        (CMD.GET_CREDS_METADATA, True), (CMD.ENUMERATE_RPS_BEGIN, True), (CMD.ENUMERATE_RPS_NEXT, False),
+        (CMD.ENUMERATE_CREDS_BEGIN, True), (CMD.ENUMERATE_CREDS_NEXT, False), (CMD.ENUMERATE_CREDS_BEGIN, True)]
+
+    # One session for GetInfo, one for the metadata & the RPs, then one per RP
+    assert len(sessions) == 4
+
+    credman = ReadOnlyCredentialManagement(authenticators["KEY1"], PinProtocolV2(), os.urandom(32))
+    with pytest.raises(ValueError):
+        credman.delete_cred({"id": b"\x01", "type": "public-key"})
@@ -0,0 +1,223 @@
+from thalessecuritykey.broker import DeviceBroker, BrokerClient, BrokerError, scan_devices
+from thalessecuritykey import broker as broker_module
+from thalessecuritykey.device import ThalesDevice
+from thalessecuritykey.const import PkiApplet
+from example.simulation import SimulatedBus
+
+import os
+import stat
+import socket
+import struct
+import tempfile
+from unittest import mock
+
+import threading
+
+from fido2.ctap import CtapError, STATUS
+
+import pytest
+
+
+class MockDevice(ThalesDevice):
+    def call(self, cmd, data = b"", event = None, on_keepalive = None):
+        return bytes([cmd]) + data
+
+
+class WaitingDevice(ThalesDevice):
+    """ Waits for the user presence, until the call is cancelled """
+    def __init__(self, name, released):
+        super().__init__(name, True)
+        self.released = released
+
+    def call(self, cmd, data = b"", event = None, on_keepalive = None):
+        on_keepalive(STATUS.UPNEEDED)
+        while( not self.released.is_set() ):
+            if( event is not None ) and ( event.wait(0.05) ):
+                raise CtapError(CtapError.ERR.KEEPALIVE_CANCEL)
+        return b"done"
+
+
+def _serve(tmp_path, monkeypatch, devices):
+    socket_path = str(tmp_path / "broker.sock")
+    broker = DeviceBroker(socket_path, interval=60)
+    monkeypatch.setattr(broker, "refresh", lambda: None)
+    for key, dev in devices.items():
+        dev.serial_number = key
+        dev._is_thales_device = True
+        broker._add(key, dev)
+    broker.start()
+    return broker, socket_path
+
+
+def test_broker_list_and_call(tmp_path, monkeypatch):
+    socket_path = str(tmp_path / "broker.sock")
+    broker = DeviceBroker(socket_path, interval=60)
+    monkeypatch.setattr(broker, "refresh", lambda: None)
+
+    dev = MockDevice("Mock", True)
+    dev.serial_number = "0123456789"
+    dev._is_thales_device = True
+    dev._pki_applet = PkiApplet.PIV
+    broker._add("mock:1", dev)
+
+    broker.start()
+    try:
+        devices = scan_devices(wait=False, socket_path=socket_path)
+        assert len(devices) == 1
+        assert devices[0].serial_number == "0123456789"
+        assert devices[0].pki_applet == PkiApplet.PIV
+        assert devices[0].call(0x10, b"\x04") == b"\x10\x04"
+
+        # The connection to the broker is closed with the devices
+        client = devices[0]._client
+        assert not client.is_closed
+        for dev in devices:
+            dev.close()
+        assert client.is_closed
+
+        assert scan_devices(wait=False, serial_number="other", socket_path=socket_path) == []
+    finally:
+        broker.stop()
+
+
+def test_broker_pcsc_device(tmp_path):
+    pytest.importorskip("smartcard")
+    bus = SimulatedBus()
+    bus.insert_card("Simulated Reader", "0123456789")
+    broker = DeviceBroker(str(tmp_path / "broker.sock"), interval=60)
+
+    with bus.install():
+        broker.refresh()
+        broker.refresh()
+        devices = broker.dispatch({"op": "list"})["devices"]
+        assert [(d["key"], d["serial_number"]) for d in devices] == [("pcsc:Simulated Reader", "0123456789")]
+
+        reply = broker.dispatch({"op": "apdu", "key": "pcsc:Simulated Reader", "apdus": ["00a4040000"]})
+        assert reply["responses"] == [["", 0x90, 0x00]]
+
+        bus.remove_all()
+        broker.refresh()
+        assert broker.devices == {}
+
+
+def test_broker_private_socket(tmp_path, monkeypatch):
+    monkeypatch.delenv("XDG_RUNTIME_DIR", raising=False)
+    monkeypatch.setattr(tempfile, "tempdir", str(tmp_path))
+    socket_path = broker_module._default_socket()
+    assert socket_path == str(tmp_path / f"thalessecuritykey-{os.getuid()}" / "broker.sock")
+
+    broker = DeviceBroker(socket_path, interval=60)
+    monkeypatch.setattr(broker, "refresh", lambda: None)
+    broker.start()
+    try:
+        assert stat.S_IMODE(os.stat(os.path.dirname(socket_path)).st_mode) == 0o700
+        assert stat.S_IMODE(os.stat(socket_path).st_mode) == 0o600
+        with pytest.raises(BrokerError):
+            # A running broker is not replaced
+            DeviceBroker(socket_path).start()
+    finally:
+        broker.stop()
+
+
+def test_broker_stale_socket(tmp_path, monkeypatch):
+    socket_path = str(tmp_path / "broker.sock")
+    stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    stale.bind(socket_path)
+    stale.close()
+
+    broker = DeviceBroker(socket_path, interval=60)
+    monkeypatch.setattr(broker, "refresh", lambda: None)
+    broker.start()
+    try:
+        assert scan_devices(wait=False, socket_path=socket_path) == []
+    finally:
+        broker.stop()
+
+
+def test_broker_refuses_foreign_path(tmp_path):
+    socket_path = tmp_path / "broker.sock"
+    socket_path.write_text("not a socket")
+    with pytest.raises(BrokerError):
+        DeviceBroker(str(socket_path)).start()
+    assert socket_path.read_text() == "not a socket"
+
+    with pytest.raises(BrokerError):
+        BrokerClient(str(socket_path))
+
+    shared = tmp_path / "shared"
+    shared.mkdir()
+    shared.chmod(0o777)
+    with pytest.raises(BrokerError):
+        DeviceBroker(str(shared / "broker.sock")).start()
+
+
+def test_broker_peer_credentials():
+    if( not hasattr(socket, "SO_PEERCRED") ):
+        pytest.skip("SO_PEERCRED is not available")
+    server = mock.Mock()
+    request = mock.Mock()
+    request.getsockopt.return_value = struct.pack("3i", 1, os.getuid() + 1, 0)
+    assert not broker_module._BrokerServer.verify_request(server, request, None)
+    request.getsockopt.return_value = struct.pack("3i", 1, os.getuid(), 0)
+    assert broker_module._BrokerServer.verify_request(server, request, None)
+
+
+def test_broker_devices_do_not_wait_for_each_other(tmp_path, monkeypatch):
+    released = threading.Event()
+    broker, socket_path = _serve(tmp_path, monkeypatch, {"a": WaitingDevice("A", released), "b": MockDevice("B", True)})
+    try:
+        devices = {dev.serial_number: dev for dev in scan_devices(wait=False, socket_path=socket_path)}
+        assert devices["a"]._client is not devices["b"]._client
+
+        result = []
+        waiting = threading.Thread(target=lambda: result.append(devices["a"].call(0x10)))
+        waiting.start()
+        # "a" waits for the user presence, "b" still answers
+        assert devices["b"].call(0x10, b"\x01") == b"\x10\x01"
+        released.set()
+        waiting.join(5)
+        assert result == [b"done"]
+        for dev in devices.values():
+            dev.close()
+    finally:
+        broker.stop()
+
+
+def test_broker_call_keepalive_and_cancel(tmp_path, monkeypatch):
+    broker, socket_path = _serve(tmp_path, monkeypatch, {"a": WaitingDevice("A", threading.Event())})
+    try:
+        dev = scan_devices(wait=False, socket_path=socket_path)[0]
+        event = threading.Event()
+        statuses = []
+        def on_keepalive(status):
+            statuses.append(status)
+            event.set()
+
+        with pytest.raises(CtapError) as e:
+            dev.call(0x10, b"", event, on_keepalive)
+        assert e.value.code == CtapError.ERR.KEEPALIVE_CANCEL
+        assert statuses == [STATUS.UPNEEDED]
+        dev.close()
+    finally:
+        broker.stop()
+
+
+def test_broker_merges_hid_and_ccid(tmp_path):
+    pytest.importorskip("smartcard")
+    bus = SimulatedBus()
+    bus.insert_hid("0123456789")
+    bus.insert_card("Simulated Reader", "0123456789")
+    broker = DeviceBroker(str(tmp_path / "broker.sock"), interval=60)
+
+    with bus.install():
+        broker.refresh()
+        devices = broker.dispatch({"op": "list"})["devices"]
+        assert [(d["transport"], d["serial_number"], d.get("reader")) for d in devices] == [("hid", "0123456789", "Simulated Reader")]
+
+        # The PKI APDUs of the HID device go through its CCID interface
+        reply = broker.dispatch({"op": "apdu", "key": devices[0]["key"], "apdus": ["00a4040000"]})
+        assert reply["responses"] == [["", 0x90, 0x00]]
+
+        bus.remove_all()
+        broker.refresh()
+        assert broker.devices == {}
@@ -0,0 +1,86 @@
+import time
+
+from fido2 import cbor
+
+from thalessecuritykey.device import ThalesDevice
+from thalessecuritykey.capabilities import CapabilityCache, FidoCapabilities, changes_capabilities
+
+GET_INFO = b"\x00" + cbor.encode({1: ["FIDO_2_0"], 3: b"\x00" * 16, 4: {"clientPin": True}})
+
+
+class MockFido():
+    def __init__(self):
+        self.calls = []
+        self.status = b"\x00"
+
+    def call(self, cmd, data = b"", event = None, on_keepalive = None):
+        self.calls.append(data)
+        if( data == b"\x04" ):
+            return GET_INFO
+        return self.status
+
+
+class MockDevice(ThalesDevice, MockFido):
+    def __init__(self, cache):
+        ThalesDevice.__init__(self, "Mock", True)
+        MockFido.__init__(self)
+        self.capability_cache = cache
+        self.serial_number = "0123456789"
+
+
+def test_capabilities_cached():
+    cache = CapabilityCache()
+    dev = MockDevice(cache)
+    assert dev.fido_capabilities().pin_set
+    assert dev.fido_capabilities().versions == ["FIDO_2_0"]
+    assert dev.calls == [b"\x04"]
+
+    # Another object for the same token uses the cache
+    other = MockDevice(cache)
+    other.fido_capabilities()
+    assert other.calls == []
+    assert cache.stats()["hits"] == 2
+
+
+def test_capabilities_invalidated_on_reset():
+    cache = CapabilityCache()
+    dev = MockDevice(cache)
+    dev.fido_capabilities()
+    dev.call(0x10, b"\x07")
+    dev.fido_capabilities()
+    assert dev.calls == [b"\x04", b"\x07", b"\x04"]
+
+
+def test_changes_capabilities():
+    assert changes_capabilities(b"\x06" + cbor.encode({1: 2, 2: 4}))
+    assert not changes_capabilities(b"\x06" + cbor.encode({1: 2, 2: 1}))
+    assert not changes_capabilities(b"\x01")
+
+
+def test_capabilities_invalidated_on_pin_error():
+    cache = CapabilityCache()
+    dev = MockDevice(cache)
+    dev.fido_capabilities()
+    # The PIN was removed by another host
+    dev.status = b"\x35"
+    assert dev.call(0x10, b"\x02") == b"\x35"
+    dev.fido_capabilities()
+    assert dev.calls == [b"\x04", b"\x02", b"\x04"]
+
+
+def test_capabilities_bounded(monkeypatch):
+    cache = CapabilityCache(max_entries=2, ttl=60)
+    info = FidoCapabilities(GET_INFO)
+    for serial_number in ("a", "b"):
+        cache.put((serial_number, None), info)
+    cache.get(("a", None))
+    cache.put(("c", None), info)
+    # The least recently used entry is dropped
+    assert cache.get(("b", None)) == None
+    assert cache.get(("a", None)) is info
+    assert cache.stats()["entries"] == 2
+
+    now = time.monotonic()
+    monkeypatch.setattr(time, "monotonic", lambda: now + 61)
+    assert cache.get(("a", None)) == None
+    assert cache.stats()["entries"] == 1
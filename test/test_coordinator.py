@@ -0,0 +1,129 @@
+import time
+import multiprocessing
+
+from thalessecuritykey import coordinator
+from thalessecuritykey.coordinator import Aggregator, StationAgent, CoordinatorClient
+
+
+def _devices(station):
+    """ Each station holds one token seen over HID & PCSC, and a PKI card """
+    token = f"{station}-TOKEN"
+    return [{"serial_number": token, "transport": "hid", "path": "/dev/hidraw0", "reader": "Token CCID"},
+            {"serial_number": token, "transport": "pcsc", "reader": "Token CCID"},
+            {"serial_number": f"{station}-CARD", "transport": "pcsc", "reader": "Card Reader"}]
+
+
+def _run_agent(station, address):
+    StationAgent(station, address, scan=lambda: _devices(station), interval=0.05).serve_forever()
+
+
+def _wait(condition, timeout = 10.0):
+    deadline = time.monotonic() + timeout
+    while( not condition() ):
+        assert time.monotonic() < deadline
+        time.sleep(0.05)
+
+
+def test_agents_as_processes():
+    stations = ["station-0", "station-1", "station-2"]
+    ctx = multiprocessing.get_context("spawn")
+
+    with Aggregator() as aggregator:
+        agents = [ctx.Process(target=_run_agent, args=(station, aggregator.address), daemon=True) for station in stations]
+        for agent in agents:
+            agent.start()
+        try:
+            _wait(lambda: len(aggregator.devices()) == 6)
+
+            with CoordinatorClient(aggregator.address) as client:
+                locations = client.where("station-1-TOKEN")
+                assert {l["station"] for l in locations} == {"station-1"}
+                assert {l["key"] for l in locations} == {"hid:/dev/hidraw0", "pcsc:Token CCID"}
+                assert [d["serial_number"] for d in client.devices("station-2")] == ["station-2-CARD", "station-2-TOKEN"]
+                assert all(s["connected"] and s["devices"] == 3 for s in client.stations())
+        finally:
+            for agent in agents:
+                agent.terminate()
+                agent.join()
+        _wait(lambda: not any(s["connected"] for s in aggregator.stations()))
+
+
+def test_agent_changes():
+    devices = _devices("station")
+    with Aggregator() as aggregator:
+        agent = StationAgent("station", aggregator.address, scan=lambda: list(devices))
+        assert agent.poll() == (3, 0)
+        assert len(aggregator.devices()) == 2
+
+        # The card moves to another station
+        card = devices.pop()
+        assert agent.poll() == (0, 1)
+        assert aggregator.where("station-CARD") == []
+        aggregator.add("other", "pcsc:Reader", card)
+        assert aggregator.where("station-CARD")[0]["station"] == "other"
+
+        # Changed discovery results are sent again
+        devices[1] = dict(devices[1], pki_version="4.5")
+        assert agent.poll() == (1, 0)
+        assert agent.poll() == (0, 0)
+        agent._disconnect()
+
+
+def test_agent_partitions():
+    devices = _devices("station")
+    with Aggregator() as aggregator:
+        tokens = StationAgent("station", aggregator.address, scan=lambda: devices[:2])
+        cards = StationAgent("station", aggregator.address, scan=lambda: devices[2:], pcsc_reader="Card")
+        assert tokens.poll() == (2, 0)
+        assert cards.poll() == (1, 0)
+        _wait(lambda: len(aggregator.stations()) == 2 and all(s["connected"] for s in aggregator.stations()))
+
+        # Each agent syncs its own partition
+        assert [(s["partition"], s["devices"]) for s in aggregator.stations()] == [("", 2), ("Card", 1)]
+        assert aggregator.where("station-CARD")[0]["partition"] == "Card"
+
+        # The devices of a disconnected agent are dropped, the others are kept
+        cards._disconnect()
+        _wait(lambda: aggregator.where("station-CARD") == [])
+        assert len(aggregator.where("station-TOKEN")) == 2
+
+        # Restored by the sync when it reconnects
+        cards.poll()
+        _wait(lambda: len(aggregator.where("station-CARD")) == 1)
+        tokens._disconnect()
+        cards._disconnect()
+
+
+class _Scanned(list):
+    closed = False
+    def close(self):
+        self.closed = True
+
+
+def test_agent_default_scan_skips_unchanged_station(monkeypatch):
+    scans = []
+    def scan_station(pcsc_reader, hid):
+        scans.append((pcsc_reader, hid))
+        return _Scanned([])
+    monkeypatch.setattr(coordinator, "_scan_station", scan_station)
+
+    scan = coordinator._StationScan("Card", False)
+    state = [([], {"Card Reader": (1, True, b"\x3b")})]
+    monkeypatch.setattr(scan, "_station_state", lambda: state[0])
+
+    assert scan() == [] and scan() == []
+    assert scans == [("Card", False)]
+
+    # A card was inserted: discovered again
+    state[0] = ([], {"Card Reader": (2, True, b"\x3b")})
+    scan()
+    assert len(scans) == 2
+
+    # Unknown reader states or old results: always discovered
+    scan.max_age = 0
+    scan()
+    state[0] = None
+    scan.max_age = 300
+    scan()
+    assert len(scans) == 4
+    assert StationAgent("station", ("127.0.0.1", 0)).interval >= 10
@@ -1,5 +1,19 @@
 from thalessecuritykey.device import ThalesDevice
+from thalessecuritykey.const import PkiApplet
 from unittest import mock
 
 def test_pcsc_call_cbor():
-    ThalesDevice("Mock")
\ No newline at end of file
+    ThalesDevice("Mock")
+
+def test_device_merge():
+    hid = ThalesDevice("Mock HID", True)
+    hid.serial_number = "0123456789"
+    pcsc = ThalesDevice("Mock PCSC")
+    pcsc.pki_applet = PkiApplet.IDPRIME_940
+    pcsc.pki_version = b"4.5\x00"
+    hid._merge(pcsc)
+    assert hid.has_fido
+    assert hid.pki_applet == PkiApplet.IDPRIME_940
+    assert hid.pki_version == "4.5"
+    assert hid.serial_number == "0123456789"
+    assert hid.is_thales_device
@@ -0,0 +1,64 @@
+import gc
+import pytest
+
+from thalessecuritykey.device import ThalesDevice
+from thalessecuritykey.handles import HandleRegistry
+from thalessecuritykey import handles
+from unittest import mock
+
+
+def make_device(closer):
+    dev = ThalesDevice("Mock")
+    dev._track_handle(closer)
+    return dev
+
+
+def test_handle_close_once():
+    closer = mock.Mock()
+    with mock.patch.object(handles, "registry", HandleRegistry()) as registry:
+        with make_device(closer) as dev:
+            assert registry.open == 1
+        dev.close()
+        assert closer.call_count == 1
+        assert registry.stats()["closed"] == 1
+
+
+def test_handle_finalizer():
+    closer = mock.Mock()
+    with mock.patch.object(handles, "registry", HandleRegistry()) as registry:
+        make_device(closer)
+        gc.collect()
+        assert closer.call_count == 1
+        assert registry.stats()["leaked"] == 1
+
+
+def test_handle_lru_eviction():
+    closers = [mock.Mock() for _ in range(3)]
+    with mock.patch.object(handles, "registry", HandleRegistry(limit=2)) as registry:
+        devices = [make_device(closers[0]), make_device(closers[1])]
+        registry.touch(devices[0]._handle_id)
+        devices.append(make_device(closers[2]))
+        assert closers[1].call_count == 1
+        assert devices[1].is_closed
+        assert registry.open == 2
+        assert registry.stats()["evicted"] == 1
+
+
+def test_handle_eviction_pcsc():
+    pytest.importorskip("smartcard")
+    from thalessecuritykey.pcsc import PcscThalesDevice
+    from thalessecuritykey.readers import ReaderHealth
+    from example.simulation import SimulatedBus
+
+    bus = SimulatedBus()
+    cards = [bus.insert_card("Reader 0", "0000000001"), bus.insert_card("Reader 1", "0000000002")]
+    with mock.patch.object(handles, "registry", HandleRegistry(limit=1)) as registry:
+        with bus.install():
+            devices = list(PcscThalesDevice.list_devices(health = ReaderHealth()))
+        assert len(devices) == 2
+        assert registry.open == 1
+        assert registry.stats()["evicted"] == 1
+        assert [card.connected for card in cards].count(True) == 1
+        for dev in devices:
+            dev.close()
+        assert registry.open == 0
@@ -0,0 +1,60 @@
+import io
+import json
+import time
+
+from thalessecuritykey.device import ThalesDevice
+from thalessecuritykey.const import PkiApplet
+from thalessecuritykey.inventory import InventoryStore, version_key
+
+
+def make_device(serial, pki_version, applet = PkiApplet.PIV):
+    dev = ThalesDevice("Mock")
+    dev.serial_number = serial
+    dev.pki_applet = applet
+    dev.pki_version = pki_version.encode()
+    return dev
+
+
+def test_version_key():
+    assert version_key("4.5.10") > version_key("4.5.9")
+    assert version_key(None) == None
+
+
+def test_inventory_upsert_and_query():
+    with InventoryStore() as store:
+        store.upsert([make_device("A", "4.4"), make_device("B", "4.5.2"), ThalesDevice("No S/N")], station="st1", seen=100)
+        store.upsert([make_device("A", "4.5"), make_device("C", "3.10", PkiApplet.IDPRIME_940)], station="st2", seen=200)
+
+        assert store.count() == 3
+        assert [d["serial_number"] for d in store.query(pki_version_lt="4.5")] == ["C"]
+        assert [d["serial_number"] for d in store.query(pki_applet=PkiApplet.PIV, station="st1")] == ["B"]
+
+        device = store.get("A")
+        assert device["first_seen"] == 100 and device["last_seen"] == 200
+        assert store.last_seen("A")["station"] == "st2"
+        assert [h["pki_version"] for h in store.history("A")] == ["4.5", "4.4"]
+
+        out = io.StringIO()
+        assert store.export(out, "json", station="st2") == 2
+        assert len(json.loads(out.getvalue())) == 2
+
+
+def test_inventory_out_of_order():
+    with InventoryStore() as store:
+        store.upsert([make_device("A", "4.5")], station="st2", seen=200)
+        # Late batch of an older scan: only the first sighting moves
+        store.upsert([make_device("A", "4.4")], station="st1", seen=100)
+
+        device = store.get("A")
+        assert (device["station"], device["pki_version"]) == ("st2", "4.5")
+        assert (device["first_seen"], device["last_seen"]) == (100, 200)
+        assert [h["station"] for h in store.history("A")] == ["st2", "st1"]
+
+
+def test_inventory_bulk():
+    devices = [{"serial_number": "%06d" % i, "pki_applet": "PIV", "pki_version": "4.%d" % (i % 10)} for i in range(20000)]
+    with InventoryStore() as store:
+        start = time.perf_counter()
+        assert store.upsert(devices, station="st1") == 20000
+        assert store.count(pki_version_lt="4.5") == 10000
+        assert time.perf_counter() - start < 5
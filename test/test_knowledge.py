@@ -0,0 +1,95 @@
+from fido2.hid import HidDescriptor
+from unittest import mock
+
+import pytest
+
+from thalessecuritykey.knowledge import ModelKnowledge
+from thalessecuritykey.device import ThalesDevice
+from thalessecuritykey.hid import CtapHidThalesDevice
+from example.simulation import SimulatedHidConnection
+
+
+def test_learning():
+    knowledge = ModelKnowledge(threshold=2)
+    knowledge.record("m1", "probe", False)
+    assert not knowledge.skip("m1", "probe")
+    knowledge.record("m1", "probe", False)
+    assert knowledge.skip("m1", "probe", 3)
+    assert not knowledge.skip("m2", "probe")
+    assert not knowledge.skip(None, "probe")
+    assert knowledge.stats() == {"models": 1, "skipped": 1, "saved": 3}
+
+    # A single success: the probe is kept for this model
+    knowledge.record("m1", "other", False)
+    knowledge.record("m1", "other", True)
+    knowledge.record("m1", "other", False)
+    assert not knowledge.is_unsupported("m1", "other")
+    assert knowledge.unsupported() == {"m1": ["probe"]}
+
+
+def test_save_load(tmp_path):
+    knowledge = ModelKnowledge()
+    for _ in range(2):
+        knowledge.record("m1", "probe", False)
+    knowledge.save(tmp_path / "kb.json")
+    assert ModelKnowledge(tmp_path / "kb.json").unsupported() == {"m1": ["probe"]}
+
+    # Hand written list of unsupported probes
+    (tmp_path / "manual.json").write_text('{"atr:3b00": ["select:PIV"]}')
+    assert ModelKnowledge(tmp_path / "manual.json").is_unsupported("atr:3b00", "select:PIV")
+
+
+def test_hid_no_serial_number(monkeypatch):
+    knowledge = ModelKnowledge()
+    monkeypatch.setattr(ThalesDevice, "knowledge", knowledge)
+    descriptor = HidDescriptor("sim/hid", 0x08E6, 0x0001, 64, 64, "Simulated Token", None)
+
+    devices = [CtapHidThalesDevice(descriptor, SimulatedHidConnection(None)) for _ in range(3)]
+    assert [dev.skipped_commands for dev in devices] == [0, 0, 1]
+    assert knowledge.unsupported() == {"hid:08e6:0001:31.2.3": ["vendor_55"]}
+    assert knowledge.stats()["saved"] == 1
+    assert devices[2].fido_version == "4.5.1"
+    for dev in devices:
+        dev.close()
+
+
+def test_reprobe():
+    knowledge = ModelKnowledge(threshold=2, retry_every=3)
+    for _ in range(2):
+        knowledge.record("m1", "probe", False)
+    assert [knowledge.skip("m1", "probe") for _ in range(6)] == [True, True, False, True, True, False]
+    assert knowledge.stats()["skipped"] == 4
+
+    # The probe sent again succeeded: it is kept
+    knowledge.record("m1", "probe", True)
+    assert not knowledge.skip("m1", "probe")
+    assert knowledge.unsupported() == {}
+
+
+def test_disabled_until_loaded(tmp_path):
+    (tmp_path / "manual.json").write_text('{"atr:3b00": ["select:PIV"]}')
+    knowledge = ModelKnowledge(enabled=False)
+    for _ in range(2):
+        knowledge.record("m1", "probe", False)
+    assert knowledge.is_unsupported("m1", "probe")
+    assert not knowledge.skip("m1", "probe")
+    knowledge.load(tmp_path / "manual.json")
+    assert knowledge.skip("m1", "probe")
+    assert knowledge.skip("atr:3b00", "select:PIV")
+
+
+def test_pcsc_transport_error(monkeypatch):
+    pytest.importorskip("smartcard")
+    from thalessecuritykey.pcsc import PcscThalesDevice
+
+    knowledge = ModelKnowledge()
+    monkeypatch.setattr(ThalesDevice, "knowledge", knowledge)
+    conn = mock.Mock()
+    conn.getATR.return_value = [0x3B, 0x8F, 0x80, 0x01]
+    conn.transmit.side_effect = IOError("Card removed")
+    for _ in range(3):
+        PcscThalesDevice(conn, "Mock").close()
+
+    # No answer: nothing learnt about the card manager
+    assert knowledge.unsupported() == {}
+    assert knowledge.stats()["skipped"] == 0
@@ -1,7 +1,184 @@
+import time
 from thalessecuritykey.pcsc import PcscThalesDevice
 from thalessecuritykey.device import ThalesDevice
 from unittest import mock
+from thalessecuritykey.readers import ReaderHealth, ReaderReport
+from example.simulation import SimulatedBus
+from thalessecuritykey.apdu import ApduProfile
+from thalessecuritykey.const import Interface, PkiApplet, APDU_SELECT, AID_PIV, AID_CARD_MANAGER, APDU_GET_DETAILS, APDU_GET_SN
+from thalessecuritykey.settle import SettlePolicy
 
 def test_pcsc_call_cbor():
     device = mock.Mock()
+    device.getATR.return_value = [0x3B, 0x8F, 0x80, 0x01]
     PcscThalesDevice(device, "Mock")
+
+def test_pcsc_transaction_nested():
+    device = mock.Mock()
+    device.getATR.return_value = [0x3B, 0x8F, 0x80, 0x01]
+    device.transmit.return_value = ([], 0x6A, 0x82)
+    dev = PcscThalesDevice(device, "Mock")
+    device.component.hcard = 1
+    with mock.patch("thalessecuritykey.pcsc.SCardBeginTransaction", return_value=0) as begin, \
+         mock.patch("thalessecuritykey.pcsc.SCardEndTransaction", return_value=0) as end:
+        with dev.transaction():
+            with dev.transaction():
+                pass
+    assert begin.call_count == 1
+    assert end.call_count == 1
+
+def test_pcsc_list_devices():
+    bus = SimulatedBus()
+    card = bus.insert_card("Simulated Reader", "0123456789")
+    reports = []
+    with bus.install():
+        devices = list(PcscThalesDevice.list_devices(reports = reports, health = ReaderHealth()))
+    assert [dev.serial_number for dev in devices] == ["0123456789"]
+    assert [report.status for report in reports] == [ReaderReport.OK]
+    devices[0].close()
+    assert not card.connected
+
+def test_pcsc_list_devices_stopped_early():
+    bus = SimulatedBus()
+    cards = [bus.insert_card(f"Reader {i}", f"000000000{i}") for i in range(3)]
+    cards[2].delay = 0.2
+    with bus.install():
+        scan = PcscThalesDevice.list_devices(health = ReaderHealth())
+        first = next(scan)
+        time.sleep(0.05)
+        scan.close()
+
+    # The devices which were not yielded are closed, the busy one when its discovery ends
+    deadline = time.monotonic() + 5
+    while( sum(card.connected for card in cards) > 1 ):
+        assert time.monotonic() < deadline
+        time.sleep(0.05)
+    first.close()
+    assert bus.open_connections == 0
+
+def test_pcsc_list_devices_deadline():
+    bus = SimulatedBus()
+    bus.insert_card("Fast Reader", "0000000001")
+    slow = bus.insert_card("Slow Reader", "0000000002")
+    slow.delay = 0.2
+    health = ReaderHealth()
+    reports = []
+    with bus.install():
+        devices = list(PcscThalesDevice.list_devices(timeout = 0.1, reports = reports, health = health))
+
+    # The slow reader is abandoned at the deadline, and quarantined
+    assert [dev.serial_number for dev in devices] == ["0000000001"]
+    assert {report.reader: report.status for report in reports} == {"Fast Reader": ReaderReport.OK, "Slow Reader": ReaderReport.TIMEOUT}
+    assert health.is_quarantined("Slow Reader")
+
+    # Its device is closed when its discovery ends
+    deadline = time.monotonic() + 5
+    while( slow.connected ):
+        assert time.monotonic() < deadline
+        time.sleep(0.05)
+    devices[0].close()
+
+def test_pcsc_list_devices_empty_reader():
+    bus = SimulatedBus()
+    bus.insert_card("Empty Reader").present = False
+    health = ReaderHealth()
+    with bus.install():
+        for _ in range(3):
+            reports = []
+            assert list(PcscThalesDevice.list_devices(reports = reports, health = health)) == []
+            assert [(report.status, report.error) for report in reports] == [(ReaderReport.SKIPPED, "empty")]
+    assert not health.is_quarantined("Empty Reader")
+
+def test_pcsc_discovery_single_transaction():
+    bus = SimulatedBus()
+    bus.insert_card("Simulated Reader", "0123456789")
+    with bus.install(), \
+         mock.patch.object(PcscThalesDevice, "_begin_transaction", return_value=True) as begin, \
+         mock.patch.object(PcscThalesDevice, "_end_transaction") as end:
+        devices = list(PcscThalesDevice.list_devices(health = ReaderHealth()))
+    assert len(devices) == 1
+    assert begin.call_count == 1
+    assert end.call_count == 1
+    devices[0].close()
+
+def test_pcsc_ext_apdu_frame():
+    device = mock.Mock()
+    device.getATR.return_value = [0x3B, 0x8F, 0x80, 0x01]
+    device.transmit.return_value = ([], 0x90, 0x00)
+    dev = PcscThalesDevice(device, "Mock")
+    dev._profile = ApduProfile(Interface.CONTACT, True, 300, 300)
+    dev.use_ext_apdu = True
+    device.transmit.reset_mock()
+
+    # Fits in the reader frame: one extended APDU
+    dev._chain_apdus(0x80, 0x10, 0x00, 0x00, b"\x01" * 300)
+    assert [bytes(call.args[0][:5]) for call in device.transmit.call_args_list] == [bytes.fromhex("8010000000")]
+
+    # Larger: chained short APDUs
+    device.transmit.reset_mock()
+    dev._chain_apdus(0x80, 0x10, 0x00, 0x00, b"\x01" * 600)
+    assert [call.args[0][0] for call in device.transmit.call_args_list] == [0x90, 0x90, 0x80]
+    assert dev.use_ext_apdu
+
+def test_pcsc_rediscover_settle_outside_session():
+    device = mock.Mock()
+    device.getATR.return_value = [0x3B, 0x8F, 0x80, 0x01]
+    device.transmit.return_value = ([], 0x6A, 0x82)
+    dev = PcscThalesDevice(device, "Mock")
+    dev.settle_policy = SettlePolicy(first_delay=0.001, max_delay=0.002, max_wait=0.05)
+    attempts = []
+    def step():
+        attempts.append(dev.scheduler.is_busy)
+        return len(attempts) >= 2
+    dev._deferred.append(step)
+
+    # The device is free while the settle policy waits
+    busy = []
+    with mock.patch("thalessecuritykey.settle.time.sleep", side_effect=lambda delay: busy.append(dev.scheduler.is_busy)):
+        dev.rediscover()
+    assert attempts == [True, True]
+    assert busy == [False, False]
+
+    # Same in the constructor: the discovery transaction is over when the settle policy waits
+    devices = []
+    def settling():
+        attempts.append(devices[0].scheduler.is_busy)
+        return len(attempts) >= 2
+    def discovery(self):
+        devices.append(self)
+        self._defer(settling)
+    attempts.clear()
+    busy.clear()
+    with mock.patch.object(PcscThalesDevice, "_discovery", discovery), \
+         mock.patch.object(PcscThalesDevice, "settle_policy", dev.settle_policy), \
+         mock.patch("thalessecuritykey.settle.time.sleep", side_effect=lambda delay: busy.append((devices[0].scheduler.is_busy, devices[0]._transaction_depth))):
+        PcscThalesDevice(device, "Mock")
+    assert attempts == [True, True]
+    assert busy == [(False, 0), (False, 0)]
+
+def test_pcsc_foreign_piv_card():
+    # A card answering only SELECT PIV: no card manager, nothing to settle
+    select_piv = APDU_SELECT + bytes([len(AID_PIV)]) + AID_PIV
+    device = mock.Mock()
+    device.getATR.return_value = [0x3B, 0x8F, 0x80, 0x01]
+    device.transmit.side_effect = lambda apdu, protocol = None: ([], 0x90, 0x00) if bytes(apdu) == select_piv else ([], 0x6A, 0x82)
+    del device.transmit_batch
+    policy = mock.Mock()
+    with mock.patch.object(PcscThalesDevice, "settle_policy", policy):
+        dev = PcscThalesDevice(device, "Mock")
+    assert dev.pki_applet == PkiApplet.PIV
+    assert not dev.is_thales_device
+    assert policy.retry.call_count == 0
+
+def test_pcsc_card_manager_rejected():
+    # The card manager SELECT fails: the next answers must not be parsed
+    answers = {AID_CARD_MANAGER: ([], 0x6A, 0x82),
+               APDU_GET_DETAILS: (list(b"\xDF\x01\x07GARBAGE"), 0x90, 0x00),
+               APDU_GET_SN:      (list(b"\x00\x00\x00GARBAGE1"), 0x90, 0x00)}
+    device = mock.Mock()
+    device.getATR.return_value = [0x3B, 0x8F, 0x80, 0x01]
+    device.transmit.side_effect = lambda apdu, protocol = None: answers.get(bytes(apdu), ([], 0x6A, 0x82))
+    del device.transmit_batch
+    dev = PcscThalesDevice(device, "Mock")
+    assert dev.serial_number == None
+    assert not dev.is_thales_device
@@ -0,0 +1,45 @@
+from thalessecuritykey.readers import ReaderHealth, ReaderReport, CardPresenceCache
+
+
+class MockReader():
+    def __init__(self, name):
+        self.name = name
+
+
+def test_reader_quarantine_on_timeout():
+    health = ReaderHealth(quarantine_time=60)
+    health.record("Reader 0", 0.01, True)
+    health.record("Reader 1", 5.0, False, timeout=True)
+    assert not health.is_quarantined("Reader 0")
+    assert health.is_quarantined("Reader 1")
+    health.release("Reader 1")
+    assert not health.is_quarantined("Reader 1")
+
+
+def test_reader_order():
+    health = ReaderHealth()
+    health.record("Slow", 1.0, True)
+    health.record("Fast", 0.01, True)
+    health.record("Failing", 0.01, False)
+    readers = [MockReader("Failing"), MockReader("Slow"), MockReader("Fast"), MockReader("New")]
+    assert [r.name for r in health.order(readers)] == ["New", "Fast", "Slow", "Failing"]
+
+
+def test_reader_report():
+    report = ReaderReport("Reader 0", ReaderReport.ERROR, 0.5, "ValueError()")
+    assert report.to_dict()["status"] == "error"
+
+
+def test_card_presence_cache():
+    cache = CardPresenceCache()
+    atr = bytes.fromhex("3b8f8001")
+    assert cache.skip_reason("Reader 0", False, 0, b"") == "empty"
+    assert cache.skip_reason("Reader 0", True, 1, atr) == None
+    cache.rejected("Reader 0", 1, atr)
+    assert cache.skip_reason("Reader 0", True, 1, atr) != None
+    assert cache.skip_reason("Reader 0", True, 1, atr, thales_only=False) == None
+    assert cache.skip_reason("Reader 0", True, 1, atr, known_atr=True) == None
+
+    # Same model in another reader, or the card inserted again: probed again
+    assert cache.skip_reason("Reader 1", True, 1, atr) == None
+    assert cache.skip_reason("Reader 0", True, 2, atr) == None
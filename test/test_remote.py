@@ -0,0 +1,75 @@
+import pytest
+
+from thalessecuritykey.remote import ApduServer, RemoteTransport, list_remote_readers
+
+
+class FakeCard:
+    """ CardConnection answering from a table {apdu: (resp, sw1, sw2)} """
+    def __init__(self, answers):
+        self.answers = answers
+        self.received = []
+
+    def connect(self, protocol = None):
+        pass
+
+    def disconnect(self):
+        pass
+
+    def getATR(self):
+        return [0x3B, 0x01]
+
+    def transmit(self, apdu, protocol = None):
+        self.received.append(bytes(apdu))
+        return self.answers.get(bytes(apdu), ([], 0x6A, 0x82))
+
+
+def test_remote_batch():
+    card = FakeCard({b"\x00\xA4\x04\x00\x01\x02": ([], 0x90, 0x00),
+                     b"\x00\xCA\xDF\x30\x00":     ([1, 2, 3], 0x90, 0x00)})
+
+    with ApduServer(readers={"Fake Reader": lambda: card}, latency=0.01) as server:
+        assert list_remote_readers(server.address) == ["Fake Reader"]
+
+        remote = RemoteTransport(server.address, "Fake Reader")
+        remote.connect()
+        try:
+            assert remote.getATR() == [0x3B, 0x01]
+            trips = remote.round_trips
+
+            out = remote.transmit_batch([b"\x00\xA4\x04\x00\x01\x01", b"\x00\xA4\x04\x00\x01\x02", b"\x00\xCA\xDF\x30\x00"])
+            assert out == [([], 0x6A, 0x82), ([], 0x90, 0x00), ([1, 2, 3], 0x90, 0x00)]
+            assert remote.round_trips == trips + 1
+
+            # Stops at the first APDU answering 9000
+            card.received.clear()
+            out = remote.transmit_batch([b"\x00\xA4\x04\x00\x01\x01", b"\x00\xA4\x04\x00\x01\x02", b"\x00\xCA\xDF\x30\x00"], first_success=True)
+            assert len(out) == 2
+            assert len(card.received) == 2
+        finally:
+            remote.disconnect()
+        assert remote.hcard == None
+
+
+def test_remote_pcsc_discovery():
+    pytest.importorskip("smartcard")
+    from thalessecuritykey.pcsc import PcscThalesDevice
+    from example.simulation import SimulatedCard
+
+    card = SimulatedCard("0123456789")
+    sent = []
+    transmit = card.transmit
+    def counted(apdu, protocol = None):
+        sent.append(bytes(apdu))
+        return transmit(apdu, protocol)
+    card.transmit = counted
+
+    with ApduServer(readers={"Remote Reader": lambda: card}) as server:
+        remote = RemoteTransport(server.address, "Remote Reader")
+        dev = PcscThalesDevice(remote, "Remote Reader")
+        try:
+            assert dev.serial_number == "0123456789"
+            # open, connect & ATR, then the discovery APDUs grouped in batches
+            assert remote.round_trips - 3 <= len(sent) // 2
+        finally:
+            dev.close()
+        assert not card.connected
@@ -0,0 +1,47 @@
+import threading
+import time
+
+from thalessecuritykey.scheduler import DeviceScheduler
+from thalessecuritykey.const import Priority
+
+
+def test_scheduler_reentrant():
+    scheduler = DeviceScheduler("Mock")
+    with scheduler.session(Priority.BACKGROUND):
+        with scheduler.session(Priority.INTERACTIVE):
+            assert scheduler.is_busy
+    assert not scheduler.is_busy
+
+
+def test_scheduler_interactive_first():
+    scheduler = DeviceScheduler("Mock")
+    order = []
+
+    def worker(priority):
+        with scheduler.session(priority):
+            order.append(priority)
+
+    scheduler.acquire(Priority.BACKGROUND)
+    threads = [threading.Thread(target=worker, args=(Priority.BACKGROUND,))]
+    threads[0].start()
+    while scheduler.queue_depth < 1: time.sleep(0.001)
+    threads.append(threading.Thread(target=worker, args=(Priority.INTERACTIVE,)))
+    threads[1].start()
+    while scheduler.queue_depth < 2: time.sleep(0.001)
+    scheduler.release()
+    for t in threads: t.join()
+
+    assert order == [Priority.INTERACTIVE, Priority.BACKGROUND]
+    stats = scheduler.stats()
+    assert stats["max_queue_depth"] == 2
+    assert stats["interactive"]["count"] == 1
+
+
+def test_scheduler_timeout():
+    scheduler = DeviceScheduler("Mock")
+    scheduler.acquire()
+    result = []
+    t = threading.Thread(target=lambda: result.append(scheduler.acquire(timeout=0.05)))
+    t.start(); t.join()
+    assert result == [False]
+    assert scheduler.queue_depth == 0
@@ -0,0 +1,30 @@
+import time
+from thalessecuritykey.settle import SettlePolicy
+
+
+def test_settle_learns_delay():
+    policy = SettlePolicy(first_delay=0.001, max_delay=0.004, max_wait=0.1)
+    attempts = []
+    def step():
+        attempts.append(1)
+        return len(attempts) >= 3
+    assert policy.retry("Mock", step)
+    assert policy.delay("Mock") > 0.001
+
+
+def test_settle_gives_up():
+    policy = SettlePolicy(first_delay=0.001, max_delay=0.002, max_wait=0.01, max_failures=2)
+    assert not policy.retry("Mock", lambda: False)
+    assert not policy.retry("Mock", lambda: False)
+    assert policy.gave_up("Mock")
+    assert not policy.retry("Mock", lambda: True)
+
+
+def test_settle_give_up_expires():
+    policy = SettlePolicy(first_delay=0.001, max_delay=0.002, max_wait=0.01, max_failures=1, give_up_time=0.05)
+    assert not policy.retry("Mock", lambda: False)
+    assert policy.gave_up("Mock")
+    time.sleep(0.06)
+    assert not policy.gave_up("Mock")
+    assert policy.retry("Mock", lambda: True)
+    assert policy.stats()["failures"]["Mock"] == 0
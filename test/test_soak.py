@@ -0,0 +1,70 @@
+from thalessecuritykey import handles
+from thalessecuritykey.soak import SoakHarness, SoakFailure, hid_cycle, pcsc_cycle, scan_cycle, percentile
+from example.simulation import SimulatedBus
+
+import pytest
+
+
+def test_percentile():
+    assert percentile([], 50) == None
+    assert percentile([3, 1, 2], 50) == 2
+    assert percentile(list(range(101)), 99) == 99
+
+
+def test_hid_soak():
+    bus = SimulatedBus()
+    report = SoakHarness(hid_cycle(bus, tokens=2), cycles=300, sample_every=100, warmup=50, max_latency_ratio=None).run()
+    report.check()
+    assert report.errors == 0
+    assert len(report.samples) == 3
+    assert bus.open_connections == 0
+    assert report.samples[-1].handles == handles.registry.open
+
+
+def test_pcsc_soak():
+    pytest.importorskip("smartcard")
+    bus = SimulatedBus()
+    report = SoakHarness(pcsc_cycle(bus, cards=2), cycles=200, sample_every=100, warmup=20, max_latency_ratio=None).run()
+    report.check()
+    assert report.errors == 0
+    assert bus.open_connections == 0
+
+
+def test_scan_soak():
+    pytest.importorskip("smartcard")
+    bus = SimulatedBus()
+    report = SoakHarness(scan_cycle(bus), cycles=100, sample_every=50, warmup=20, max_latency_ratio=None).run()
+    report.check()
+    assert report.errors == 0
+    assert bus.open_connections == 0
+
+
+def test_errors_fail():
+    calls = []
+    def cycle():
+        calls.append(None)
+        if( len(calls) % 10 == 0 ):
+            raise ValueError("Device lost")
+
+    report = SoakHarness(cycle, cycles=100, sample_every=50, warmup=0, max_latency_ratio=None).run()
+    assert report.errors == 10
+    assert not report.ok
+    assert "10 cycles failed" in report.failures[0]
+    assert "Device lost" in report.last_error
+
+    report = SoakHarness(cycle, cycles=100, sample_every=50, warmup=0, max_latency_ratio=None, max_errors=10).run()
+    assert report.ok
+
+
+def test_leak_detected():
+    leaked = []
+    def cycle():
+        leaked.append(bytearray(4096))
+
+    report = SoakHarness(cycle, cycles=500, sample_every=100, warmup=10, max_memory_growth=100000,
+                         max_latency_ratio=None).run()
+    assert not report.ok
+    assert "traced memory" in report.failures[0]
+    assert any("test_soak.py" in line for line in report.top_allocators)
+    with pytest.raises(SoakFailure):
+        report.check()
@@ -0,0 +1,81 @@
+#Copyright 2025 Thales
+#
+# Redistribution and use in source and binary forms, with or 
+# without modification, are permitted provided that the following 
+# conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+# 
+# 3. Neither the name of the copyright holder nor the names of its 
+#    contributors may be used to endorse or promote products derived from 
+#    this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS 
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT 
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR 
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT 
+# HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, 
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED 
+# TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR 
+# PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF 
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING 
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS 
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.  
+
+import argparse
+import logging
+
+from .broker import DeviceBroker, DEFAULT_SOCKET
+from .coordinator import Aggregator, StationAgent
+
+
+def _address(value: str):
+    host, _, port = value.rpartition(":")
+    return (host or "127.0.0.1", int(port))
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(prog="thalessecuritykey")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    broker = commands.add_parser("broker", help="Run the device broker daemon")
+    broker.add_argument("--socket", default=DEFAULT_SOCKET, help="Unix socket path (default: %(default)s)")
+    broker.add_argument("--interval", type=float, default=1.0, help="Device polling interval in seconds")
+    broker.add_argument("-v", "--verbose", action="store_true")
+
+    aggregator = commands.add_parser("aggregator", help="Run the coordinator collecting the station inventories")
+    aggregator.add_argument("--listen", type=_address, default=("127.0.0.1", 7461),
+                            help="host:port (default: 127.0.0.1:7461). Plaintext & unauthenticated: only listen on a trusted network")
+    aggregator.add_argument("--inventory", help="SQLite inventory file recording the devices")
+    aggregator.add_argument("-v", "--verbose", action="store_true")
+
+    agent = commands.add_parser("agent", help="Stream the devices of this station to the aggregator")
+    agent.add_argument("--station", required=True, help="Station name")
+    agent.add_argument("--coordinator", type=_address, required=True, help="Aggregator host:port")
+    agent.add_argument("--reader", help="Only scan the PCSC readers containing this name")
+    agent.add_argument("--hid", action="store_true", default=None, help="Report the HID devices (default: only without --reader)")
+    agent.add_argument("--interval", type=float, default=10.0, help="Scan interval in seconds")
+    agent.add_argument("-v", "--verbose", action="store_true")
+
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO)
+
+    if( args.command == "broker" ):
+        DeviceBroker(args.socket, args.interval).serve_forever()
+    elif( args.command == "aggregator" ):
+        inventory = None
+        if( args.inventory ):
+            from .inventory import InventoryStore
+            inventory = InventoryStore(args.inventory)
+        Aggregator(*args.listen, inventory=inventory).serve_forever()
+    elif( args.command == "agent" ):
+        StationAgent(args.station, args.coordinator, interval=args.interval, pcsc_reader=args.reader, hid=args.hid).serve_forever()
+
+
+if __name__ == "__main__":
+    main()
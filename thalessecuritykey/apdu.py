@@ -0,0 +1,203 @@
+#Copyright 2025 Thales
+#
+# Redistribution and use in source and binary forms, with or 
+# without modification, are permitted provided that the following 
+# conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+# 
+# 3. Neither the name of the copyright holder nor the names of its 
+#    contributors may be used to endorse or promote products derived from 
+#    this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS 
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT 
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR 
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT 
+# HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, 
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED 
+# TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR 
+# PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF 
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING 
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS 
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.  
+
+
+import struct
+import time
+from typing import Callable, Optional, Tuple
+
+from .const import Interface, APDU_READ_BINARY
+
+
+# APDU sizing per reader.
+#
+# The interface (contact / contactless) comes from the ATR (PC/SC part 3
+# pseudo-ATR of the contactless cards) and the reader name; extended length
+# support from the card capabilities of the ATR historical bytes (ISO 7816-4
+# compact-TLV, tag 7); the frame size from the reader maximum message size
+# (SCARD_ATTR_MAXINPUT). Extended APDUs are only used on contact readers
+# giving their maximum message size (never given on Windows): many
+# contactless readers do not chain extended APDUs on the RF side, whatever
+# they declare. Otherwise large objects are read with short APDUs.
+
+# pcsc-lite: SCARD_ATTR_VALUE(SCARD_CLASS_VENDOR_DEFINED, 0xA007)
+SCARD_ATTR_MAXINPUT = 0x0007A007
+
+SW_SUCCESS          = (0x90, 0x00)
+
+SHORT_MAX_COMMAND   = 255
+SHORT_MAX_RESPONSE  = 256
+
+_CONTACTLESS_NAMES  = ("contactless", "nfc", "picc", " cl ")
+
+
+def historical_bytes(atr: bytes) -> bytes:
+    """ Historical bytes of an ATR (ISO 7816-3) """
+    if( len(atr) < 2 ):
+        return b""
+    count = atr[1] & 0x0F
+    y = atr[1] >> 4
+    index = 2
+    while( True ):
+        index += bin(y & 0x07).count("1")     # TA, TB, TC
+        if( not y & 0x08 ) or ( index >= len(atr) ):
+            break
+        y = atr[index] >> 4                     # TD
+        index += 1
+    return atr[index:index + count]
+
+
+def supports_extended_length(atr: bytes) -> bool:
+    """ Card capabilities (compact-TLV tag 7, 3rd byte, bit 7): extended Lc & Le """
+    hist = historical_bytes(atr)
+    if( not hist ) or ( hist[0] not in (0x00, 0x80) ):
+        return False
+    # Category 00: the last 3 bytes are the status indicator
+    objects = hist[1:-3] if hist[0] == 0x00 else hist[1:]
+    index = 0
+    while( index < len(objects) ):
+        tag, length = objects[index] >> 4, objects[index] & 0x0F
+        value = objects[index + 1:index + 1 + length]
+        if( tag == 0x7 ) and ( len(value) >= 3 ):
+            return bool(value[2] & 0x40)
+        index += 1 + length
+    return False
+
+
+def is_contactless(atr: bytes, reader: str = "") -> bool:
+    # PC/SC part 3: 3B 8n 80 01 ...
+    if( len(atr) >= 4 ) and ( atr[0] == 0x3B ) and ( atr[1] & 0xF0 == 0x80 ) and ( atr[2:4] == b"\x80\x01" ):
+        return True
+    name = f" {reader.lower()} "
+    return any(hint in name for hint in _CONTACTLESS_NAMES)
+
+
+class ApduProfile():
+    """ APDU sizes to use with one reader & card """
+
+    # Extended APDUs on contactless readers
+    contactless_extended = False
+
+    def __init__(self, interface: Interface = Interface.UNKNOWN, extended: bool = False,
+                 max_command: int = SHORT_MAX_COMMAND, max_response: int = SHORT_MAX_RESPONSE):
+        self.interface      = interface
+        self.extended       = extended
+        self.max_command    = max_command
+        self.max_response   = max_response
+
+    def __repr__(self):
+        return f"ApduProfile({self.interface.name}, extended={self.extended}, {self.max_command}/{self.max_response})"
+
+    def to_dict(self) -> dict:
+        return {"interface": self.interface.name, "extended": self.extended,
+                "max_command": self.max_command, "max_response": self.max_response}
+
+    @classmethod
+    def detect(cls, atr: bytes, reader: str = "", max_input: Optional[int] = None, nfc_capable: Optional[bool] = None) -> "ApduProfile":
+        """ max_input:   maximum message size of the reader (SCARD_ATTR_MAXINPUT), None if unknown
+            nfc_capable: from the card manager device info; a device without NFC is never contactless
+        """
+        atr = bytes(atr or b"")
+        contactless = is_contactless(atr, reader) and nfc_capable != False
+        profile = cls(Interface.CONTACTLESS if contactless else Interface.CONTACT)
+
+        if( not supports_extended_length(atr) ) or ( max_input == None ):
+            return profile
+        if( contactless ) and ( not cls.contactless_extended ):
+            return profile
+        # Header & 3 bytes Lc for the commands, SW for the responses
+        size = max_input - 7
+        if( size <= SHORT_MAX_RESPONSE ):
+            # The reader cannot carry an extended APDU larger than a short one
+            return profile
+        profile.extended     = True
+        profile.max_command  = min(size, 65535)
+        profile.max_response = min(size, 65536)
+        return profile
+
+    @property
+    def read_size(self) -> int:
+        """ Bytes requested by each READ BINARY """
+        return self.max_response
+
+    def read_binary_apdu(self, offset: int, length: int) -> bytes:
+        header = APDU_READ_BINARY[:2] + struct.pack(">H", offset & 0x7FFF)
+        if( length > SHORT_MAX_RESPONSE ) and ( self.extended ):
+            return header + b"\x00" + struct.pack(">H", length & 0xFFFF)
+        return header + struct.pack("!B", min(length, SHORT_MAX_RESPONSE) & 0xFF)
+
+
+def read_binary(exchange: Callable, profile: ApduProfile, size: Optional[int] = None) -> Tuple[bool, bytes]:
+    """ Reads the selected file from offset 0, in chunks sized by the profile.
+        exchange(apdu) -> (resp, sw1, sw2). size: bytes to read (None: up to the end of the file)
+    """
+    data = b""
+    while( size == None ) or ( len(data) < size ):
+        if( len(data) > 0x7FFF ):
+            # Offsets are on 15 bits
+            break
+        want = profile.read_size if size == None else min(profile.read_size, size - len(data))
+        resp, sw1, sw2 = exchange(profile.read_binary_apdu(len(data), want))
+        if( sw1 == 0x6C ):
+            # Wrong Le: the card gives the number of bytes available
+            want = sw2 or SHORT_MAX_RESPONSE
+            resp, sw1, sw2 = exchange(profile.read_binary_apdu(len(data), want))
+        resp = bytes(resp)
+        if( (sw1, sw2) in ((0x62, 0x82), (0x6B, 0x00)) ) and ( data or resp ):
+            # End of file reached
+            data += resp
+            break
+        if( (sw1, sw2) != SW_SUCCESS ):
+            return False, data
+        data += resp
+        if( len(resp) < want ):
+            break
+    return True, data
+
+
+def measure_read(exchange: Callable, profile: ApduProfile, select: bytes = None, repeat: int = 5) -> dict:
+    """ Throughput of read_binary() with this profile: select is sent before each read """
+    trips = [0]
+    def counted(apdu):
+        trips[0] += 1
+        return exchange(apdu)
+
+    size = 0
+    start = time.perf_counter()
+    for _ in range(repeat):
+        if( select != None ):
+            counted(select)
+        ok, data = read_binary(counted, profile)
+        if( not ok ):
+            raise IOError("READ BINARY failed")
+        size = len(data)
+    duration = time.perf_counter() - start
+    return {"interface": profile.interface.name, "extended": profile.extended, "read_size": profile.read_size,
+            "bytes": size, "round_trips": trips[0] / repeat, "seconds": duration / repeat,
+            "bytes_per_second": size * repeat / duration if duration else None}
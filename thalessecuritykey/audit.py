@@ -0,0 +1,263 @@
+#Copyright 2025 Thales
+#
+# Redistribution and use in source and binary forms, with or 
+# without modification, are permitted provided that the following 
+# conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+# 
+# 3. Neither the name of the copyright holder nor the names of its 
+#    contributors may be used to endorse or promote products derived from 
+#    this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS 
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT 
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR 
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT 
+# HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, 
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED 
+# TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR 
+# PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF 
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING 
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS 
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.  
+
+
+import queue
+import threading
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, Iterator, Optional, Tuple, Union
+
+from fido2.ctap import CtapError
+from fido2.ctap2 import Ctap2, ClientPin, CredentialManagement
+
+from .const import Priority
+
+
+# Resident credentials audit of all the connected keys.
+#
+# Each key is enumerated (credential management) in its own worker. Each
+# begin/next sequence (metadata & RPs, then the credentials of one RP) runs in
+# a background session of the device so that it is not interleaved with other
+# clients, which are served between two RPs. The records are yielded as they
+# arrive. An AuditSession keeps the PIN/UV token of each key: the next audits
+# of the same session do not authenticate again (until the key rejects the
+# token). Keys supporting it (perCredMgmtRO) get a persistent read-only token,
+# used for the read-only subcommands only.
+
+_TOKEN_ERRORS = (CtapError.ERR.PIN_AUTH_INVALID, CtapError.ERR.PIN_TOKEN_EXPIRED)
+
+# Subcommands allowed by a persistent credential management token (pcmr)
+_READONLY_SUBCOMMANDS = (CredentialManagement.CMD.GET_CREDS_METADATA,
+                         CredentialManagement.CMD.ENUMERATE_RPS_BEGIN, CredentialManagement.CMD.ENUMERATE_RPS_NEXT,
+                         CredentialManagement.CMD.ENUMERATE_CREDS_BEGIN, CredentialManagement.CMD.ENUMERATE_CREDS_NEXT)
+
+
+class ReadOnlyCredentialManagement(CredentialManagement):
+    """ CredentialManagement refusing the subcommands a persistent token does not allow """
+
+    def _call(self, sub_cmd, params = None, auth = True):
+        if( sub_cmd not in _READONLY_SUBCOMMANDS ):
+            raise ValueError(f"Credential management subcommand {sub_cmd} not allowed with a read-only token")
+        return super()._call(sub_cmd, params, auth)
+
+
+class CredentialRecord():
+    """ One resident credential of a key """
+
+    def __init__(self, device, rp: dict, cred: dict):
+        user = cred.get(CredentialManagement.RESULT.USER, {})
+        self.serial_number  = device.serial_number
+        self.device_name    = device.name
+        self.rp_id          = rp.get(CredentialManagement.RESULT.RP, {}).get("id")
+        self.rp_id_hash     = rp.get(CredentialManagement.RESULT.RP_ID_HASH, b"").hex()
+        self.user_id        = bytes(user.get("id", b"")).hex()
+        self.user_name      = user.get("name")
+        self.display_name   = user.get("displayName")
+        self.credential_id  = bytes(cred.get(CredentialManagement.RESULT.CREDENTIAL_ID, {}).get("id", b"")).hex()
+        self.cred_protect   = cred.get(CredentialManagement.RESULT.CRED_PROTECT)
+
+    def __repr__(self):
+        return f"CredentialRecord({self.serial_number}, {self.rp_id!r}, {self.user_name!r})"
+
+    def to_dict(self) -> dict:
+        return dict(self.__dict__)
+
+
+class DeviceAudit():
+    """ Outcome of the audit of one key (see the 'results' argument) """
+
+    def __init__(self, device):
+        self.serial_number  = device.serial_number
+        self.device_name    = device.name
+        self.rps            = 0
+        self.credentials    = 0
+        self.existing       = None      # Count reported by the metadata
+        self.remaining      = None
+        self.token_reused   = False
+        self.duration       = None
+        self.error          = None
+
+    def __repr__(self):
+        return f"DeviceAudit({self.serial_number}, {self.credentials} credentials, error={self.error!r})"
+
+    def to_dict(self) -> dict:
+        return dict(self.__dict__)
+
+
+class AuditSession():
+    """ PIN/UV tokens of the audited keys, reused from one audit to the next.
+
+        pin: PIN of the keys, or function(device) -> PIN. Without PIN, the
+             built-in user verification of the key is used.
+    """
+
+    def __init__(self, pin: Union[str, Callable, None] = None, max_workers: Optional[int] = None):
+        self.pin            = pin
+        self.max_workers    = max_workers
+        self._lock          = threading.Lock()
+        self._tokens: Dict[str, Tuple] = {}
+        self.authentications = 0
+
+    def _pin(self, device) -> Optional[str]:
+        return self.pin(device) if callable(self.pin) else self.pin
+
+    def _token(self, device, ctap: Ctap2, refresh: bool = False) -> Tuple:
+        """ Returns (protocol, token, persistent, reused) """
+        with self._lock:
+            entry = None if refresh else self._tokens.get(device.serial_number)
+        if( entry != None ):
+            return entry + (True,)
+
+        client_pin = ClientPin(ctap)
+        permissions = ClientPin.PERMISSION.CREDENTIAL_MGMT
+        persistent = CredentialManagement.is_readonly_supported(ctap.info)
+        if( persistent ):
+            # Read-only token which does not expire with the next command
+            permissions = ClientPin.PERMISSION.PERSISTENT_CREDENTIAL_MGMT
+
+        pin = self._pin(device)
+        if( pin != None ):
+            token = client_pin.get_pin_token(pin, permissions)
+        else:
+            token = client_pin.get_uv_token(permissions)
+
+        with self._lock:
+            self.authentications += 1
+            if( device.serial_number != None ):
+                self._tokens[device.serial_number] = (client_pin.protocol, token, persistent)
+        return client_pin.protocol, token, persistent, False
+
+    def forget(self, serial_number: str = None) -> None:
+        """ Drops the token of one key (all the keys if serial_number is None) """
+        with self._lock:
+            if( serial_number == None ):
+                self._tokens.clear()
+            else:
+                self._tokens.pop(serial_number, None)
+
+    def _credman(self, device, ctap: Ctap2, audit: DeviceAudit, refresh: bool = False) -> CredentialManagement:
+        protocol, token, persistent, audit.token_reused = self._token(device, ctap, refresh)
+        if( persistent ):
+            return ReadOnlyCredentialManagement(ctap, protocol, token)
+        return CredentialManagement(ctap, protocol, token)
+
+    def _run(self, device, ctap: Ctap2, audit: DeviceAudit, credman: CredentialManagement, command: Callable) -> Tuple:
+        """ Runs command(credman) in a session of the device, returns (credman, result) """
+        with device.session(Priority.BACKGROUND):
+            if( credman is None ):
+                credman = self._credman(device, ctap, audit)
+            try:
+                return credman, command(credman)
+            except CtapError as e:
+                if( e.code not in _TOKEN_ERRORS ):
+                    raise
+                # The key dropped the token (power cycle, timeout, other client): authenticate again
+                credman = self._credman(device, ctap, audit, refresh=True)
+                return credman, command(credman)
+
+    def _enumerate(self, device, audit: DeviceAudit, emit: Callable, stop: threading.Event) -> None:
+        with device.session(Priority.BACKGROUND):
+            ctap = Ctap2(device)
+
+        def read_rps(credman):
+            metadata = credman.get_metadata()
+            if( not metadata.get(CredentialManagement.RESULT.EXISTING_CRED_COUNT) ):
+                return metadata, []
+            return metadata, credman.enumerate_rps()
+
+        credman, (metadata, rps) = self._run(device, ctap, audit, None, read_rps)
+        audit.existing  = metadata.get(CredentialManagement.RESULT.EXISTING_CRED_COUNT)
+        audit.remaining = metadata.get(CredentialManagement.RESULT.MAX_REMAINING_COUNT)
+
+        for rp in rps:
+            if( stop.is_set() ):
+                return
+            audit.rps += 1
+            rp_id_hash = rp[CredentialManagement.RESULT.RP_ID_HASH]
+            credman, creds = self._run(device, ctap, audit, credman, lambda credman: credman.enumerate_creds(rp_id_hash))
+            for cred in creds:
+                if( stop.is_set() ):
+                    return
+                audit.credentials += 1
+                emit(CredentialRecord(device, rp, cred))
+
+    def _audit_device(self, device, emit: Callable, stop: threading.Event) -> DeviceAudit:
+        audit = DeviceAudit(device)
+        start = time.perf_counter()
+        try:
+            self._enumerate(device, audit, emit, stop)
+        except Exception as e:
+            logging.warning("Credential audit of %s failed: %r", device.serial_number, e)
+            audit.error = str(e) or repr(e)
+        audit.duration = time.perf_counter() - start
+        return audit
+
+    def audit(self, devices: Iterable, results: list = None) -> Iterator[CredentialRecord]:
+        """ Enumerates the resident credentials of all the keys concurrently and yields
+            one CredentialRecord per credential, as they arrive.
+            results: list receiving one DeviceAudit per key, when its enumeration ends.
+        """
+        devices = list(devices)
+        if( not devices ):
+            return
+        records = queue.Queue()
+        stop    = threading.Event()
+        done    = object()
+
+        def work(device):
+            try:
+                audit = self._audit_device(device, records.put, stop)
+                if( results != None ):
+                    results.append(audit)
+            finally:
+                records.put(done)
+
+        executor = ThreadPoolExecutor(self.max_workers or len(devices), thread_name_prefix="audit")
+        try:
+            for device in devices:
+                executor.submit(work, device)
+            pending = len(devices)
+            while( pending > 0 ):
+                record = records.get()
+                if( record is done ):
+                    pending -= 1
+                else:
+                    yield record
+        finally:
+            # The caller may stop iterating early: the workers end at their next credential
+            stop.set()
+            executor.shutdown(wait=False)
+
+
+def audit_credentials(devices: Iterable, pin: Union[str, Callable, None] = None, max_workers: Optional[int] = None,
+                      results: list = None) -> Iterator[CredentialRecord]:
+    """ One-off audit (see AuditSession.audit) """
+    return AuditSession(pin, max_workers).audit(devices, results)
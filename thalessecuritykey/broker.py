@@ -0,0 +1,537 @@
+#Copyright 2025 Thales
+#
+# Redistribution and use in source and binary forms, with or 
+# without modification, are permitted provided that the following 
+# conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+# 
+# 3. Neither the name of the copyright holder nor the names of its 
+#    contributors may be used to endorse or promote products derived from 
+#    this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS 
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT 
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR 
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT 
+# HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, 
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED 
+# TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR 
+# PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF 
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING 
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS 
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.  
+
+import os
+import stat
+import time
+import errno
+import struct
+import socket
+import socketserver
+import tempfile
+import threading
+import logging
+from typing import Dict, List, Optional, Tuple
+
+from fido2.ctap import CtapDevice, CtapError
+from fido2.hid import CAPABILITY
+
+from .device import ThalesDevice
+from . import hid
+from .hid import CtapHidThalesDevice
+from .wire import send_message, recv_message
+from .const import Priority
+
+
+def _uid() -> int:
+    # Unix sockets only: there is no uid on Windows
+    return os.getuid() if hasattr(os, "getuid") else 0
+
+
+def _default_socket() -> str:
+    """ $XDG_RUNTIME_DIR is private to the user, otherwise the socket goes in
+        a per-user directory of the temporary folder """
+    runtime = os.environ.get("XDG_RUNTIME_DIR")
+    if( runtime ):
+        return os.path.join(runtime, "thalessecuritykey.sock")
+    return os.path.join(tempfile.gettempdir(), f"thalessecuritykey-{_uid()}", "broker.sock")
+
+
+DEFAULT_SOCKET = _default_socket()
+
+
+class BrokerError(Exception):
+    """ Error returned by the broker daemon """
+
+
+def _check_owner(path: str, directory=False) -> None:
+    """ The socket (or its directory) must belong to us and must not be
+        writable by the other users, or anyone could squat it """
+    st = os.lstat(path)
+    kind = stat.S_ISDIR(st.st_mode) if directory else stat.S_ISSOCK(st.st_mode)
+    if( not kind ) or ( st.st_uid != _uid() ) or ( st.st_mode & (stat.S_IWGRP | stat.S_IWOTH) ):
+        raise BrokerError(f"{path} is not a private broker {'directory' if directory else 'socket'}")
+
+
+def _prepare_socket(path: str) -> None:
+    """ Creates the private directory of the socket and removes our own
+        stale socket. Any other file is left untouched. """
+    directory = os.path.dirname(os.path.abspath(path))
+    if( not os.path.exists(directory) ):
+        os.makedirs(directory, mode=0o700)
+    _check_owner(directory, directory=True)
+
+    if( not os.path.lexists(path) ):
+        return
+    _check_owner(path)
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(path)
+    except OSError as e:
+        if( e.errno not in (errno.ECONNREFUSED, errno.ENOENT) ):
+            raise
+        os.unlink(path)
+        return
+    finally:
+        probe.close()
+    raise BrokerError(f"A broker is already listening on {path}")
+
+
+def _match(dev: ThalesDevice, fido_only=False, thales_only=True, serial_number=None, pcsc_reader=None) -> bool:
+    """ Same filters as scan_devices """
+    if( thales_only ) and ( not dev.is_thales_device ):
+        return False
+    if( serial_number ) and ( dev.serial_number != serial_number ):
+        return False
+    if( fido_only ) and ( not dev.has_fido_accessible ):
+        return False
+    if( pcsc_reader ):
+        reader = getattr(dev, "reader", None)
+        if( reader != None ) and ( pcsc_reader not in reader ):
+            return False
+    return True
+
+
+#******************************************************************************
+# Daemon side: owns the PCSC context & HID handles
+
+class DeviceBroker():
+    """ Keeps the inventory of connected devices up to date and serves it
+        to the local clients over a Unix socket.
+
+        A device is discovered once, when it is inserted. Clients get the
+        discovered information and can forward APDU or FIDO commands, which
+        go through the per-device scheduler.
+    """
+
+    def __init__(self, socket_path: str = DEFAULT_SOCKET, interval: float = 1.0):
+        self._socket_path = socket_path
+        self._interval    = interval
+        self._lock        = threading.Lock()
+        self._devices: Dict[str, ThalesDevice] = {}
+        self._rejected: Dict[str, object] = {}   # Readers holding an unusable card
+        self._stop        = threading.Event()
+        self._server      = None
+        self._thread      = None
+
+    @property
+    def devices(self) -> Dict[str, ThalesDevice]:
+        with self._lock:
+            return dict(self._devices)
+
+    def refresh(self) -> None:
+        """ Adds the inserted devices & drops the removed ones """
+        self._refresh_hid()
+        try:
+            self._refresh_pcsc()
+        except ImportError:
+            # PCSC support is optional (pyscard)
+            pass
+
+    def _add(self, key, dev):
+        with self._lock:
+            self._devices[key] = dev
+        logging.info("Broker: device added %s (%s)", key, dev.serial_number)
+
+    def _remove(self, key):
+        with self._lock:
+            dev = self._devices.pop(key, None)
+            # The CCID interface merged into a HID device is closed with it
+            for twin in [k for k, d in self._devices.items() if dev is not None and getattr(d, "twin", None) is dev]:
+                del self._devices[twin]
+        if( dev is not None ):
+            logging.info("Broker: device removed %s", key)
+            try:
+                dev.close()
+            except Exception:
+                pass
+
+    def _refresh_hid(self):
+        present = set()
+        # Same enumeration as CtapHidThalesDevice.list_devices
+        for d in hid.list_descriptors():
+            key = f"hid:{d.path}"
+            present.add(key)
+            if( key in self._devices ):
+                continue
+            try:
+                self._add(key, CtapHidThalesDevice(d, hid.open_connection(d)))
+            except Exception as e:
+                logging.debug("Broker: unable to open %s %r", key, e)
+
+        for key in [k for k in self._devices if k.startswith("hid:") and k not in present]:
+            self._remove(key)
+
+    def _refresh_pcsc(self):
+        from .pcsc import PcscThalesDevice, _list_readers
+
+        # Same correlation as scan_devices: a token seen through HID & CCID is listed once
+        correlate = {dev._thales_serial_number: dev for key, dev in self.devices.items()
+                     if key.startswith("hid:") and dev._thales_serial_number}
+
+        present = set()
+        for reader in _list_readers():
+            key = f"pcsc:{reader.name}"
+            present.add(key)
+
+            dev = self._devices.get(key)
+            if( dev is not None ):
+                if( dev.is_present() ):
+                    if( dev.twin is not None ) or ( dev._thales_serial_number not in correlate ):
+                        continue
+                    # The HID interface showed up after the CCID one: probe again to merge them
+                self._remove(key)
+
+            # Do not probe again a card which was already rejected
+            conn = self._rejected.get(key)
+            if( conn != None ):
+                try:
+                    if( conn.getATR() ):
+                        continue
+                except Exception:
+                    pass
+                del self._rejected[key]
+
+            conn = reader.createConnection()
+            try:
+                dev = PcscThalesDevice(conn, reader.name, correlate=correlate)
+                if( dev.twin is not None ):
+                    dev.twin.attach_pcsc(dev)
+                self._add(key, dev)
+            except Exception as e:
+                logging.debug("Broker: unable to use %s %r", key, e)
+                self._rejected[key] = conn
+
+        for key in [k for k in self._devices if k.startswith("pcsc:") and k not in present]:
+            self._remove(key)
+        for key in [k for k in self._rejected if k not in present]:
+            del self._rejected[key]
+
+    def _refresh_loop(self):
+        while( not self._stop.is_set() ):
+            try:
+                self.refresh()
+            except Exception as e:
+                logging.error("Broker: refresh failed %r", e)
+            self._stop.wait(self._interval)
+
+    def _device(self, key) -> ThalesDevice:
+        with self._lock:
+            dev = self._devices.get(key)
+        if( dev is None ):
+            raise BrokerError(f"Unknown device {key}")
+        return dev
+
+    def dispatch(self, message: dict, event = None, on_keepalive = None) -> dict:
+        """ Executes one client request. event & on_keepalive are given to
+            the CTAP calls, see _BrokerHandler. """
+        op = message.get("op")
+        if( op == "list" ):
+            out = []
+            for key, dev in self.devices.items():
+                if( getattr(dev, "twin", None) is not None ):
+                    # Listed through its HID device
+                    continue
+                if( _match(dev, message.get("fido_only", False), message.get("thales_only", True),
+                           message.get("serial_number"), message.get("pcsc_reader")) ):
+                    values = dev.to_dict()
+                    values["key"] = key
+                    out.append(values)
+            return {"ok": True, "devices": out}
+
+        dev = self._device(message.get("key"))
+        if( op == "call" ):
+            try:
+                resp = dev.call(message["cmd"], bytes.fromhex(message.get("data", "")), event, on_keepalive)
+            except CtapError as e:
+                return {"ok": False, "error": str(e), "ctap_error": e.code}
+            return {"ok": True, "data": resp.hex()}
+
+        if( op == "apdu" ):
+            # The APDUs of a merged HID device go through its CCID interface
+            if( getattr(dev, "pcsc", None) is not None ):
+                dev = dev.pcsc
+            # All the APDUs are sent in a single session (PCSC transaction when available)
+            out = []
+            batch = getattr(dev, "transaction", dev.session)
+            with batch(Priority.INTERACTIVE):
+                for apdu in message["apdus"]:
+                    resp, sw1, sw2 = dev.apdu_exchange(bytes.fromhex(apdu))
+                    out.append([resp.hex(), sw1, sw2])
+            return {"ok": True, "responses": out}
+
+        if( op == "rediscover" ):
+            dev.rediscover()
+            return {"ok": True, "device": dev.to_dict()}
+
+        raise BrokerError(f"Unknown operation {op}")
+
+    def start(self) -> None:
+        """ Starts the refresh loop and the socket server in background threads """
+        _prepare_socket(self._socket_path)
+        self._server = _BrokerServer(self._socket_path, self)
+        self._stop.clear()
+        self.refresh()
+        self._thread = threading.Thread(target=self._refresh_loop, name="broker-refresh", daemon=True)
+        self._thread.start()
+        threading.Thread(target=self._server.serve_forever, name="broker-server", daemon=True).start()
+
+    def serve_forever(self) -> None:
+        self.start()
+        try:
+            self._stop.wait()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if( self._server != None ):
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+            if( os.path.exists(self._socket_path) ):
+                os.unlink(self._socket_path)
+        for key in list(self._devices):
+            self._remove(key)
+
+
+class _BrokerHandler(socketserver.StreamRequestHandler):
+    """ One connection per client device. A CTAP call runs in its own thread
+        so that the handler can still read the cancel message of the client,
+        the keepalive messages are sent before the reply. """
+
+    def handle(self):
+        self._write  = threading.Lock()
+        self._cancel = None
+        call = None
+        while (message := recv_message(self.rfile)) != None:
+            op = message.get("op")
+            if( op == "cancel" ):
+                if( self._cancel is not None ):
+                    self._cancel.set()
+            elif( op == "call" ):
+                self._cancel = threading.Event()
+                call = threading.Thread(target=self._reply, args=(message, self._cancel), name="broker-call", daemon=True)
+                call.start()
+            else:
+                self._reply(message)
+
+        # The client is gone: cancel its pending call before the stream is closed
+        if( call is not None ):
+            self._cancel.set()
+            call.join()
+
+    def _send(self, message: dict) -> None:
+        with self._write:
+            send_message(self.wfile, message)
+
+    def _reply(self, message: dict, event = None) -> None:
+        try:
+            reply = self.server.broker.dispatch(message, event, lambda status: self._send({"keepalive": status}))
+        except Exception as e:
+            reply = {"ok": False, "error": str(e)}
+        try:
+            self._send(reply)
+        except (OSError, ValueError):
+            # The client is gone
+            pass
+
+
+class _BrokerServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path, broker: DeviceBroker):
+        self.broker = broker
+        # The socket is created 0600: no window where another user can connect
+        umask = os.umask(0o177)
+        try:
+            super().__init__(socket_path, _BrokerHandler)
+        finally:
+            os.umask(umask)
+        os.chmod(socket_path, 0o600)
+
+    def verify_request(self, request, client_address) -> bool:
+        """ Only serves the processes of the same user """
+        if( not hasattr(socket, "SO_PEERCRED") ):
+            return True
+        creds = request.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize("3i"))
+        _, uid, _ = struct.unpack("3i", creds)
+        if( uid != _uid() ):
+            logging.warning("Broker: connection refused for uid %d", uid)
+            return False
+        return True
+
+
+#******************************************************************************
+# Client side
+
+class BrokerClient():
+    """ Connection to the broker daemon.
+
+        Each device listed through the client gets its own connection, so the
+        commands sent to different devices do not wait for each other.
+    """
+
+    def __init__(self, socket_path: str = DEFAULT_SOCKET, timeout: Optional[float] = None):
+        # Do not send our commands to a socket planted by another user
+        _check_owner(socket_path)
+        self._socket_path = socket_path
+        self._timeout = timeout
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._sock.settimeout(timeout)
+        self._sock.connect(socket_path)
+        self._stream = self._sock.makefile("rwb")
+        self._lock  = threading.Lock()      # One request at a time
+        self._write = threading.Lock()      # The cancel message is sent during a request
+
+    def clone(self) -> "BrokerClient":
+        """ New connection to the same broker """
+        return BrokerClient(self._socket_path, self._timeout)
+
+    def _send(self, message: dict) -> None:
+        with self._write:
+            send_message(self._stream, message)
+
+    def _watch(self, event, done: threading.Event) -> None:
+        while( not done.is_set() ):
+            if( event.wait(0.1) ):
+                if( not done.is_set() ):
+                    self._send({"op": "cancel"})
+                return
+
+    def request(self, op: str, event = None, on_keepalive = None, **kwargs) -> dict:
+        with self._lock:
+            self._send(dict(op=op, **kwargs))
+            done = threading.Event()
+            if( event is not None ):
+                threading.Thread(target=self._watch, args=(event, done), name="broker-cancel", daemon=True).start()
+            try:
+                while True:
+                    reply = recv_message(self._stream)
+                    if( reply == None ) or ( "keepalive" not in reply ):
+                        break
+                    if( on_keepalive ):
+                        on_keepalive(reply["keepalive"])
+            finally:
+                done.set()
+        if( reply == None ):
+            raise ConnectionError("Broker closed the connection")
+        if( not reply.get("ok") ):
+            if( "ctap_error" in reply ):
+                raise CtapError(reply["ctap_error"])
+            raise BrokerError(reply.get("error"))
+        return reply
+
+    def list_devices(self, fido_only=False, thales_only=True, serial_number=None, pcsc_reader=None) -> List["BrokerDevice"]:
+        reply = self.request("list", fido_only=fido_only, thales_only=thales_only,
+                             serial_number=serial_number, pcsc_reader=pcsc_reader)
+        return [BrokerDevice(self, values) for values in reply["devices"]]
+
+    def close(self) -> None:
+        self._stream.close()
+        self._sock.close()
+
+    @property
+    def is_closed(self) -> bool:
+        return self._sock.fileno() == -1
+
+
+class BrokerDevice(ThalesDevice, CtapDevice):
+    """ Device discovered by the broker. FIDO & APDU commands are forwarded
+        to the daemon so it can be used like the local device classes. """
+
+    def __init__(self, client: BrokerClient, values: dict):
+        ThalesDevice.__init__(self, values.get("name"), values.get("has_fido", False))
+        self._client = client.clone()
+        self._track_handle(self._client.close)
+        self._load_dict(values)
+
+    def _load_dict(self, values: dict):
+        super()._load_dict(values)
+        self._key          = values["key"]
+        self._transport    = values.get("transport")
+        self._reader       = values.get("reader")
+        self._capabilities = CAPABILITY(values.get("capabilities", 0))
+
+    def __repr__(self):
+        return f"BrokerDevice({self.name}, {self._transport}, {self.serial_number})"
+
+    @property
+    def reader(self) -> Optional[str]:
+        return self._reader
+
+    @property
+    def capabilities(self) -> int:
+        return self._capabilities
+
+    def call(self, cmd, data = b"", event = None, on_keepalive = None) -> bytes:
+        """ Forwards a CTAP command, with its cancellation & keepalive status """
+        with self._scheduler.session(Priority.INTERACTIVE):
+            reply = self._client.request("call", event, on_keepalive, key=self._key, cmd=cmd, data=bytes(data).hex())
+            return bytes.fromhex(reply["data"])
+
+    def apdu_exchange(self, apdu: bytes, protocol = None) -> Tuple[bytes, int, int]:
+        return self.transmit_batch([apdu])[0]
+
+    def transmit_batch(self, apdus) -> List[Tuple[bytes, int, int]]:
+        """ Sends several APDUs, the daemon holds the device during the whole batch """
+        reply = self._client.request("apdu", key=self._key, apdus=[bytes(a).hex() for a in apdus])
+        return [(bytes.fromhex(resp), sw1, sw2) for resp, sw1, sw2 in reply["responses"]]
+
+    def rediscover(self) -> None:
+        values = self._client.request("rediscover", key=self._key)["device"]
+        values["key"] = self._key
+        self._load_dict(values)
+
+    @classmethod
+    def list_devices(cls, socket_path: str = DEFAULT_SOCKET):
+        client = BrokerClient(socket_path)
+        try:
+            return client.list_devices()
+        finally:
+            client.close()
+
+
+def scan_devices(fido_only=False, thales_only=True, wait=True, serial_number = None, pcsc_reader = None, socket_path = DEFAULT_SOCKET) -> List[BrokerDevice]:
+    """ scan_devices() served by the broker daemon """
+    client = BrokerClient(socket_path)
+    try:
+        while True:
+            devices = client.list_devices(fido_only, thales_only, serial_number, pcsc_reader)
+            if( len(devices) > 0 ) or ( not wait ):
+                return devices
+            try:
+                time.sleep(1)
+            except KeyboardInterrupt:
+                return []
+    finally:
+        # The devices have their own connection
+        client.close()
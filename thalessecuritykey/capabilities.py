@@ -0,0 +1,161 @@
+#Copyright 2025 Thales
+#
+# Redistribution and use in source and binary forms, with or 
+# without modification, are permitted provided that the following 
+# conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+# 
+# 3. Neither the name of the copyright holder nor the names of its 
+#    contributors may be used to endorse or promote products derived from 
+#    this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS 
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT 
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR 
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT 
+# HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, 
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED 
+# TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR 
+# PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF 
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING 
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS 
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.  
+
+import time
+import threading
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from fido2 import cbor
+from fido2.ctap import CtapError
+from fido2.ctap2 import Ctap2, Info, ClientPin
+
+
+class FidoCapabilities():
+    """ Snapshot of the FIDO capabilities of a token (authenticatorGetInfo) """
+
+    def __init__(self, response: bytes, fido_version = None):
+        self.response       = bytes(response)
+        self.info           = Info.from_dict(cbor.decode(self.response[1:]))
+        self.fido_version   = fido_version
+
+    def __repr__(self):
+        return f"FidoCapabilities({self.fido_version}, {self.versions}, pin={self.pin_set}, uv={self.uv})"
+
+    @property
+    def versions(self) -> list:
+        return self.info.versions
+
+    @property
+    def extensions(self) -> list:
+        return self.info.extensions
+
+    @property
+    def options(self) -> dict:
+        return self.info.options
+
+    @property
+    def pin_set(self) -> Optional[bool]:
+        """ True: PIN set, False: PIN supported but not set, None: no PIN support """
+        return self.info.options.get("clientPin")
+
+    @property
+    def uv(self) -> Optional[bool]:
+        """ Built-in user verification (e.g. fingerprint): True configured, False not configured """
+        return self.info.options.get("uv")
+
+    @property
+    def force_pin_change(self) -> bool:
+        return self.info.force_pin_change
+
+
+class CapabilityCache():
+    """ authenticatorGetInfo responses, keyed by (serial number, FIDO version).
+
+        The devices answer GET_INFO from this cache (see ThalesDevice.call), so
+        repeated Fido2Client/Ctap2 instances on the same token skip the round-trip.
+        An entry is dropped when the device runs a command changing its
+        configuration (PIN set/change, reset, authenticatorConfig, bio enrollment),
+        or when a PIN/UV error shows that the cached options are wrong.
+        Volatile counters (remainingDiscoverableCredentials, uvCountSinceLastPinEntry)
+        may be stale: use refresh=True when they matter.
+
+        max_entries: least recently used entries are dropped beyond this size
+        ttl:         age (seconds) after which an entry is read again from the
+                     token, for the changes made by another host (None = no limit)
+    """
+
+    def __init__(self, max_entries: int = 256, ttl: Optional[float] = 3600.0):
+        self.max_entries = max_entries
+        self.ttl         = ttl
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Tuple, Tuple[float, FidoCapabilities]]" = OrderedDict()
+        self.hits   = 0
+        self.misses = 0
+
+    def get(self, key) -> Optional[FidoCapabilities]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if( entry != None ) and ( self.ttl != None ) and ( time.monotonic() - entry[0] > self.ttl ):
+                del self._entries[key]
+                entry = None
+            if( entry == None ):
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key, capabilities: FidoCapabilities) -> None:
+        with self._lock:
+            self._entries[key] = (time.monotonic(), capabilities)
+            self._entries.move_to_end(key)
+            while( len(self._entries) > self.max_entries ):
+                self._entries.popitem(last=False)
+
+    def invalidate(self, serial_number = None) -> None:
+        """ Drops the entries of one token (all the tokens if serial_number is None) """
+        with self._lock:
+            for key in [k for k in self._entries if serial_number == None or k[0] == serial_number]:
+                del self._entries[key]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+def changes_capabilities(request: bytes) -> bool:
+    """ True if the CTAP2 request (command byte + CBOR) modifies the authenticatorGetInfo response """
+    if( not request ):
+        return False
+    command = request[0]
+    if( command in (Ctap2.CMD.RESET, Ctap2.CMD.CONFIG, Ctap2.CMD.BIO_ENROLLMENT, Ctap2.CMD.BIO_ENROLLMENT_PRE) ):
+        return True
+    if( command == Ctap2.CMD.CLIENT_PIN ):
+        try:
+            sub_command = cbor.decode(request[1:]).get(2)
+        except Exception:
+            return True
+        return sub_command in (ClientPin.CMD.SET_PIN, ClientPin.CMD.CHANGE_PIN)
+    return False
+
+
+# Errors showing that the PIN / UV options of the token are not the cached ones
+# (PIN removed by a reset, set or blocked from another host...)
+_STALE_ERRORS = {CtapError.ERR.PIN_NOT_SET, CtapError.ERR.PUAT_REQUIRED, CtapError.ERR.PIN_BLOCKED,
+                 CtapError.ERR.PIN_AUTH_BLOCKED, CtapError.ERR.PIN_POLICY_VIOLATION, CtapError.ERR.UV_BLOCKED}
+
+
+def stale_capabilities(status: int) -> bool:
+    """ True if the CTAP2 error status means the cached authenticatorGetInfo is out of date """
+    return status in _STALE_ERRORS
+
+
+# Cache shared by all the devices of the process
+default_cache = CapabilityCache()
@@ -44,6 +44,17 @@ class FormFactor(Enum):
     USB_C = 2
     SMARTCARD = 3
 
+# Interface between the PCSC reader and the device
+class Interface(Enum):
+    UNKNOWN = -1
+    CONTACT = 1         # Smart card reader or USB token (CCID)
+    CONTACTLESS = 2     # NFC reader
+
+# Priority classes of the per-device scheduler (lower value is served first)
+class Priority(Enum):
+    INTERACTIVE = 0
+    BACKGROUND = 1
+
 # List of ATRs for Thales NFC devices
 ATRs = [
   ATR("eToken Fusion",      0x3b8f800180318065b00000000012017882900000,             0xFFFFFFFFFFFFFFFFF000000000FFFFFFFFFFFF00 ), #PIV, #FIPS
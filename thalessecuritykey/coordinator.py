@@ -0,0 +1,492 @@
+#Copyright 2025 Thales
+#
+# Redistribution and use in source and binary forms, with or 
+# without modification, are permitted provided that the following 
+# conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+# 
+# 3. Neither the name of the copyright holder nor the names of its 
+#    contributors may be used to endorse or promote products derived from 
+#    this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS 
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT 
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR 
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT 
+# HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, 
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED 
+# TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR 
+# PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF 
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING 
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS 
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.  
+
+
+import socket
+import socketserver
+import threading
+import time
+import logging
+from typing import Callable, Dict, List, Optional, Tuple
+
+from .device import ThalesDevice
+from .wire import send_message, recv_message
+
+
+# Several provisioning stations, one coordinator.
+#
+# Each station runs a StationAgent: it scans its own devices and sends the
+# changes (add / remove) to the Aggregator over TCP. A station may run several
+# agents, each scanning a partition of its readers (--reader); only one of
+# them reports the HID devices. The aggregator keeps one shard per station &
+# partition, each with its own lock, so that the agents never wait on each
+# other, and a small global index serial number -> locations which answers
+# "which station holds this token". A token seen over HID & PCSC on the same
+# station, or moved to another station, is one device with several
+# locations. The devices of an agent are dropped when it disconnects, its
+# sync restores them when it reconnects.
+#
+# The protocol is plaintext & unauthenticated: the aggregator listens on the
+# loopback by default, expose it on a trusted network only.
+
+
+class CoordinatorError(Exception):
+    """ Error returned by the aggregator """
+
+
+def device_key(values: dict) -> str:
+    """ Location of a device on its station: transport & reader / HID path """
+    if( values.get("transport") == "hid" ):
+        return f"hid:{values.get('path')}"
+    if( values.get("reader") ):
+        return f"pcsc:{values['reader']}"
+    return f"sn:{values.get('serial_number')}"
+
+
+class _StationShard():
+    def __init__(self, station: str, partition: str):
+        self.station        = station
+        self.partition      = partition
+        self.lock           = threading.Lock()
+        self.devices: Dict[str, dict] = {}
+        self.connected      = False
+        self.connections    = 0
+        self.last_event     = None
+        self.events         = 0
+
+
+#******************************************************************************
+# Coordinator side
+
+class Aggregator():
+    """ Global deduplicated inventory built from the events of the station agents.
+
+        inventory: optional InventoryStore recording each added device (sightings).
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, inventory = None):
+        self.inventory  = inventory
+        self._lock      = threading.Lock()     # Protects _stations & _index only
+        self._stations: Dict[Tuple[str, str], _StationShard] = {}
+        self._index: Dict[str, Dict[Tuple[str, str, str], dict]] = {}
+        self._server    = _AggregatorServer((host, port), self)
+        self._thread    = None
+
+    @property
+    def address(self) -> Tuple[str, int]:
+        return self._server.server_address[:2]
+
+    def start(self) -> "Aggregator":
+        self._thread = threading.Thread(target=self._server.serve_forever, name="aggregator", daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self) -> None:
+        try:
+            self._server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, typ, value, traceback):
+        self.stop()
+
+    def _shard(self, station: str, partition: str) -> _StationShard:
+        with self._lock:
+            shard = self._stations.get((station, partition))
+            if( shard == None ):
+                shard = self._stations[(station, partition)] = _StationShard(station, partition)
+            return shard
+
+    def _index_add(self, location, values):
+        serial_number = values.get("serial_number")
+        if( serial_number ):
+            with self._lock:
+                self._index.setdefault(serial_number, {})[location] = values
+
+    def _index_remove(self, location, values):
+        serial_number = values.get("serial_number")
+        with self._lock:
+            locations = self._index.get(serial_number)
+            if( locations != None ):
+                locations.pop(location, None)
+                if( not locations ):
+                    del self._index[serial_number]
+
+    # Events of the agents
+
+    def add(self, station: str, key: str, values: dict, partition: str = "") -> None:
+        shard = self._shard(station, partition)
+        with shard.lock:
+            previous = shard.devices.get(key)
+            shard.devices[key] = values
+            shard.last_event = time.time()
+            shard.events += 1
+        if( previous != None ):
+            self._index_remove((station, partition, key), previous)
+        self._index_add((station, partition, key), values)
+        if( self.inventory != None ):
+            self.inventory.upsert([values], station)
+
+    def remove(self, station: str, key: str, partition: str = "") -> None:
+        shard = self._shard(station, partition)
+        with shard.lock:
+            values = shard.devices.pop(key, None)
+            shard.last_event = time.time()
+            shard.events += 1
+        if( values != None ):
+            self._index_remove((station, partition, key), values)
+
+    def sync(self, station: str, devices: Dict[str, dict], partition: str = "") -> None:
+        """ Full state of an agent, sent when it (re)connects """
+        shard = self._shard(station, partition)
+        with shard.lock:
+            stale = [key for key in shard.devices if key not in devices]
+        for key in stale:
+            self.remove(station, key, partition)
+        for key, values in devices.items():
+            self.add(station, key, values, partition)
+
+    def _connected(self, station: str, connected: bool, partition: str = "") -> None:
+        shard = self._shard(station, partition)
+        with shard.lock:
+            shard.connections += 1 if connected else -1
+            shard.connected = shard.connections > 0
+            stale = {}
+            if( not shard.connected ):
+                # Restored by the sync of the next connection
+                stale, shard.devices = shard.devices, {}
+        for key, values in stale.items():
+            self._index_remove((station, partition, key), values)
+
+    # Queries
+
+    def where(self, serial_number: str) -> List[dict]:
+        """ Stations & readers holding this serial number """
+        with self._lock:
+            locations = dict(self._index.get(serial_number, {}))
+        return [{"station": station, "partition": partition, "key": key, "reader": values.get("reader"), "transport": values.get("transport")}
+                for (station, partition, key), values in sorted(locations.items())]
+
+    def devices(self, station: str = None) -> List[dict]:
+        """ One entry per serial number, with all its locations """
+        with self._lock:
+            index = {serial_number: dict(locations) for serial_number, locations in self._index.items()}
+        out = []
+        for serial_number, locations in sorted(index.items()):
+            if( station != None ) and ( station not in {s for s, _, _ in locations} ):
+                continue
+            values = dict(next(iter(locations.values())))
+            values["locations"] = [{"station": s, "partition": p, "key": k} for s, p, k in sorted(locations)]
+            out.append(values)
+        return out
+
+    def stations(self) -> List[dict]:
+        with self._lock:
+            shards = list(self._stations.values())
+        out = []
+        for shard in shards:
+            with shard.lock:
+                out.append({"station": shard.station, "partition": shard.partition, "connected": shard.connected,
+                            "devices": len(shard.devices), "events": shard.events, "last_event": shard.last_event})
+        return sorted(out, key=lambda s: (s["station"], s["partition"]))
+
+    def dispatch(self, message: dict) -> dict:
+        op = message.get("op")
+        if( op == "add" ):
+            self.add(message["station"], message["key"], message["device"], message.get("partition", ""))
+        elif( op == "remove" ):
+            self.remove(message["station"], message["key"], message.get("partition", ""))
+        elif( op == "sync" ):
+            self.sync(message["station"], message["devices"], message.get("partition", ""))
+        elif( op == "where" ):
+            return {"ok": True, "locations": self.where(message["serial_number"])}
+        elif( op == "devices" ):
+            return {"ok": True, "devices": self.devices(message.get("station"))}
+        elif( op == "stations" ):
+            return {"ok": True, "stations": self.stations()}
+        else:
+            raise CoordinatorError(f"Unknown operation {op}")
+        return {"ok": True}
+
+
+class _AggregatorHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        aggregator = self.server.aggregator
+        station = None
+        partition = ""
+        try:
+            while (message := recv_message(self.rfile)) != None:
+                try:
+                    if( message.get("op") == "hello" ) and ( station == None ):
+                        station = message["station"]
+                        partition = message.get("partition", "")
+                        aggregator._connected(station, True, partition)
+                        reply = {"ok": True}
+                    else:
+                        reply = aggregator.dispatch(message)
+                except Exception as e:
+                    reply = {"ok": False, "error": str(e)}
+                send_message(self.wfile, reply)
+        finally:
+            if( station != None ):
+                aggregator._connected(station, False, partition)
+
+
+class _AggregatorServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, aggregator: Aggregator):
+        self.aggregator = aggregator
+        super().__init__(address, _AggregatorHandler)
+
+
+class CoordinatorClient():
+    """ Queries the aggregator """
+
+    def __init__(self, address: Tuple[str, int], timeout: Optional[float] = None):
+        self._sock   = socket.create_connection(address, timeout)
+        self._stream = self._sock.makefile("rwb")
+        self._lock   = threading.Lock()
+
+    def request(self, op: str, **kwargs) -> dict:
+        with self._lock:
+            send_message(self._stream, dict(op=op, **kwargs))
+            reply = recv_message(self._stream)
+        if( reply == None ):
+            raise ConnectionError("Aggregator closed the connection")
+        if( not reply.get("ok") ):
+            raise CoordinatorError(reply.get("error"))
+        return reply
+
+    def where(self, serial_number: str) -> List[dict]:
+        return self.request("where", serial_number=serial_number)["locations"]
+
+    def devices(self, station: str = None) -> List[dict]:
+        return self.request("devices", station=station)["devices"]
+
+    def stations(self) -> List[dict]:
+        return self.request("stations")["stations"]
+
+    def close(self) -> None:
+        self._stream.close()
+        self._sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, typ, value, traceback):
+        self.close()
+
+
+#******************************************************************************
+# Station side
+
+def _scan_station(pcsc_reader = None, hid = True):
+    from . import helpers
+    if( hid ):
+        return helpers.scan_devices(wait=False, pcsc_reader=pcsc_reader)
+    # The HID devices are reported by another agent of the station
+    return helpers.DeviceList(helpers.enumerate_pcsc_devices(pcsc_reader=pcsc_reader))
+
+
+class _StationScan():
+    """ Default scan of an agent. The devices are discovered again only when
+        the HID paths or the state of a reader (event counter, presence & ATR)
+        changed, or after max_age seconds; otherwise the previous results are
+        returned without connecting to any device.
+    """
+
+    def __init__(self, pcsc_reader = None, hid = True, max_age: float = 300.0):
+        self.pcsc_reader = pcsc_reader
+        self.hid         = hid
+        self.max_age     = max_age
+        self._state      = None
+        self._values: List[dict] = []
+        self._time       = None
+
+    def _station_state(self):
+        """ Returns the state of the HID devices & readers, None if unknown """
+        from . import hid
+        paths = sorted(str(d.path) for d in hid.list_descriptors()) if self.hid else []
+        try:
+            from . import pcsc
+        except ImportError:
+            # PCSC support is optional (pyscard)
+            return (paths, None)
+        names = [reader.name for reader in pcsc._list_readers() if (not self.pcsc_reader) or (self.pcsc_reader in reader.name)]
+        states = pcsc._reader_states(names)
+        if( states == None ):
+            return None
+        return (paths, {name: (state >> 16, bool(state & pcsc.SCARD_STATE_PRESENT), atr) for name, (state, atr) in states.items()})
+
+    def __call__(self) -> List[dict]:
+        state = self._station_state()
+        fresh = ( self._time != None ) and ( time.monotonic() - self._time < self.max_age )
+        if( state != None ) and ( state == self._state ) and ( fresh ):
+            return self._values
+
+        devices = _scan_station(self.pcsc_reader, self.hid)
+        try:
+            self._values = [dev.to_dict() for dev in devices]
+        finally:
+            devices.close()
+        self._state = state
+        self._time  = time.monotonic()
+        return self._values
+
+
+class StationAgent():
+    """ Scans the devices of one station and streams the changes to the aggregator.
+
+        scan:        function returning the devices (ThalesDevice or to_dict() values);
+                     by default scan_devices() restricted to pcsc_reader, run again only
+                     when a reader or the HID devices changed (see _StationScan).
+        pcsc_reader: partition of the readers scanned by this agent, when a
+                     station runs several agents.
+        hid:         report the HID devices; by default only the agent without
+                     pcsc_reader does, so that they are not reported by each partition.
+    """
+
+    def __init__(self, station: str, address: Tuple[str, int], scan: Callable = None, interval: float = 10.0,
+                 pcsc_reader: str = None, timeout: Optional[float] = 10.0, hid: Optional[bool] = None):
+        if( hid == None ):
+            hid = pcsc_reader == None
+        self.station    = station
+        self.partition  = pcsc_reader or ""
+        self.address    = address
+        self.interval   = interval
+        self.timeout    = timeout
+        self._scan      = scan if scan != None else _StationScan(pcsc_reader, hid)
+        self._known: Dict[str, dict] = {}
+        self._sock      = None
+        self._stream    = None
+        self._stop      = threading.Event()
+        self._thread    = None
+
+    def __repr__(self):
+        return f"StationAgent({self.station!r}, {self.address})"
+
+    def _snapshot(self) -> Dict[str, dict]:
+        devices = self._scan()
+        try:
+            out = {}
+            for dev in devices:
+                values = dev.to_dict() if isinstance(dev, ThalesDevice) else dict(dev)
+                out[device_key(values)] = values
+            return out
+        finally:
+            close = getattr(devices, "close", None)
+            if( close != None ):
+                close()
+
+    def _send(self, op, **kwargs) -> None:
+        send_message(self._stream, dict(op=op, station=self.station, partition=self.partition, **kwargs))
+        reply = recv_message(self._stream)
+        if( reply == None ):
+            raise ConnectionError("Aggregator closed the connection")
+        if( not reply.get("ok") ):
+            raise CoordinatorError(reply.get("error"))
+
+    def _connect(self) -> None:
+        self._sock = socket.create_connection(self.address, self.timeout)
+        self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._stream = self._sock.makefile("rwb")
+        try:
+            self._send("hello")
+            self._send("sync", devices=self._known)
+        except:
+            self._disconnect()
+            raise
+
+    def _disconnect(self) -> None:
+        if( self._sock != None ):
+            self._stream.close()
+            self._sock.close()
+        self._sock = None
+        self._stream = None
+
+    def poll(self) -> Tuple[int, int]:
+        """ Scans once and sends the changes, returns (added or changed, removed) """
+        current = self._snapshot()
+        added   = {key: values for key, values in current.items() if self._known.get(key) != values}
+        removed = [key for key in self._known if key not in current]
+
+        if( self._sock == None ):
+            # (Re)connection: the sync carries the whole state
+            self._known = current
+            self._connect()
+            return len(added), len(removed)
+
+        try:
+            for key in removed:
+                self._send("remove", key=key)
+                del self._known[key]
+            for key, values in added.items():
+                self._send("add", key=key, device=values)
+                self._known[key] = values
+        except Exception:
+            self._disconnect()
+            raise
+        return len(added), len(removed)
+
+    def run(self) -> None:
+        while( not self._stop.is_set() ):
+            try:
+                self.poll()
+            except Exception as e:
+                logging.warning("Agent %s: %r", self.station, e)
+                self._disconnect()
+            self._stop.wait(self.interval)
+        self._disconnect()
+
+    def start(self) -> "StationAgent":
+        self._stop.clear()
+        self._thread = threading.Thread(target=self.run, name=f"agent-{self.station}", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+        if( self._thread != None ):
+            self._thread.join()
+            self._thread = None
+
+    def serve_forever(self) -> None:
+        try:
+            self.run()
+        except KeyboardInterrupt:
+            pass
@@ -28,11 +28,26 @@
 # SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.  
 
 from typing import Optional
+from fido2.ctap import CtapError
 from .const import * 
+from .scheduler import DeviceScheduler
+from . import handles
+from .capabilities import CapabilityCache, FidoCapabilities, changes_capabilities, stale_capabilities, default_cache
+from .knowledge import ModelKnowledge, default_knowledge
+
+CTAPHID_CBOR    = 0x10
+CTAP2_GET_INFO  = b"\x04"
 
 
 
 class ThalesDevice():
+
+    # authenticatorGetInfo responses shared by the devices (None to disable)
+    capability_cache: CapabilityCache = default_cache
+
+    # Discovery probes known to fail per model (None to disable)
+    knowledge: ModelKnowledge = default_knowledge
+
     def __init__(self, name : None, has_fido: bool = False):
         self._custom_serial_number  = None
         self._thales_serial_number  = None
@@ -49,6 +64,11 @@ class ThalesDevice():
         self._device_info           = None
         self._form_factor           = FormFactor.UNKNOWN
         self._has_otp               = False
+        self._scheduler             = DeviceScheduler(name)
+        self._finalizer             = None
+        self._handle_id             = None
+        self._skipped_commands      = 0
+        self._device_capabilities   = None
 
     
     @property
@@ -133,6 +153,161 @@ class ThalesDevice():
         if( self._fido_version == None ) : return "?"
         return self._fido_version
 
+    @property
+    def scheduler(self) -> DeviceScheduler:
+        """Scheduler serializing the commands sent to this device."""
+        return self._scheduler
+
+    def session(self, priority: Priority = Priority.INTERACTIVE, timeout: Optional[float] = None):
+        """Holds the device for a sequence of commands (with device.session(): ...)."""
+        return self._scheduler.session(priority, timeout)
+
+    @property
+    def skipped_commands(self) -> int:
+        """Discovery commands not sent because they always fail on this model."""
+        return self._skipped_commands
+
+    def _model_key(self) -> Optional[str]:
+        """Identity of the model in the knowledge base (HID identity or ATR)"""
+        return None
+
+    def _skip_probe(self, probe: str, commands: int = 1) -> bool:
+        if( self.knowledge == None ) or ( not self.knowledge.skip(self._model_key(), probe, commands) ):
+            return False
+        self._skipped_commands += commands
+        return True
+
+    def _probe_result(self, probe: str, ok: bool) -> None:
+        if( self.knowledge != None ):
+            self.knowledge.record(self._model_key(), probe, ok)
+
+    @property
+    def nfc_capable(self) -> Optional[bool]:
+        """NFC interface declared by the card manager (None if unknown)."""
+        if( self._device_capabilities == None ):
+            return None
+        return bool(self._device_capabilities & 2)
+
+    def _track_handle(self, closer):
+        """Registers the open handle: closed by close(), by the garbage collector as a
+           backstop, or when too many handles are open (see handles.registry)"""
+        self._finalizer = handles.registry.register(self, closer)
+
+    def _touch(self):
+        if( self._handle_id != None ):
+            handles.registry.touch(self._handle_id)
+
+    @property
+    def is_closed(self) -> bool:
+        return self._finalizer != None and not self._finalizer.alive
+
+    def close(self) -> None:
+        """Closes the device handle. Can be called several times."""
+        if( self._finalizer != None ):
+            handles.registry.release(self._finalizer)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, typ, value, traceback):
+        self.close()
+
+    def call(self, cmd, data = b"", event = None, on_keepalive = None):
+        """FIDO commands are interactive: they are served before any background work.
+           GET_INFO is answered from the capability cache when the token is known."""
+        self._touch()
+        key = self._capability_key() if cmd == CTAPHID_CBOR else None
+        if( key != None ) and ( data == CTAP2_GET_INFO ):
+            if( (entry := self.capability_cache.get(key)) != None ):
+                return entry.response
+
+        with self._scheduler.session(Priority.INTERACTIVE):
+            try:
+                resp = super().call(cmd, data, event, on_keepalive)
+            except CtapError as e:
+                if( key != None ) and ( stale_capabilities(e.code) ):
+                    self.capability_cache.invalidate(self.serial_number)
+                raise
+
+        if( key != None ) and ( resp[:1] == b"\x00" ):
+            if( data == CTAP2_GET_INFO ):
+                self.capability_cache.put(key, FidoCapabilities(resp, self._fido_version))
+            elif( changes_capabilities(data) ):
+                self.capability_cache.invalidate(self.serial_number)
+        elif( key != None ) and ( resp ) and ( stale_capabilities(resp[0]) ):
+            # The PIN / UV options cached do not match the token anymore
+            self.capability_cache.invalidate(self.serial_number)
+        return resp
+
+    def _capability_key(self):
+        if( self.capability_cache == None ) or ( self.serial_number == None ):
+            return None
+        return (self.serial_number, self._fido_version)
+
+    def fido_capabilities(self, refresh: bool = False) -> FidoCapabilities:
+        """FIDO capabilities (authenticatorGetInfo), from the cache unless refresh is set."""
+        if( refresh ):
+            self.invalidate_capabilities()
+        resp = self.call(CTAPHID_CBOR, CTAP2_GET_INFO)
+        if( resp[0] != 0 ):
+            raise CtapError(resp[0])
+        return FidoCapabilities(resp, self._fido_version)
+
+    def invalidate_capabilities(self) -> None:
+        """Drops the cached capabilities of this token (e.g. after a change made by another host)."""
+        if( self.capability_cache != None ) and ( self.serial_number != None ):
+            self.capability_cache.invalidate(self.serial_number)
+
+    def to_dict(self) -> dict:
+        """Device information as a JSON compatible dictionary."""
+        return {
+            "name":                 self._name,
+            "serial_number":        self.serial_number,
+            "custom_serial_number": self._custom_serial_number,
+            "thales_serial_number": self._thales_serial_number,
+            "pki_serial_number":    self._pki_serial_number,
+            "is_thales_device":     self._is_thales_device,
+            "has_fido":             self._has_fido,
+            "has_fido_accessible":  self._has_fido_accessible,
+            "fido_version":         self._fido_version,
+            "pki_applet":           self._pki_applet.name,
+            "pki_version":          self._pki_version,
+            "model_name":           self._model_name,
+            "chip_ref":             self._chip_ref,
+            "form_factor":          self._form_factor.name,
+            "has_otp":              self._has_otp,
+            "skipped_commands":     self._skipped_commands,
+        }
+
+    def _load_dict(self, values: dict):
+        """Restores the information exported by to_dict()"""
+        self._name                  = values.get("name")
+        self._custom_serial_number  = values.get("custom_serial_number")
+        self._thales_serial_number  = values.get("thales_serial_number")
+        self._pki_serial_number     = values.get("pki_serial_number")
+        self._is_thales_device      = values.get("is_thales_device", False)
+        self._has_fido              = values.get("has_fido", False)
+        self._has_fido_accessible   = values.get("has_fido_accessible", False)
+        self._fido_version          = values.get("fido_version")
+        self._pki_applet            = PkiApplet[values.get("pki_applet", "UNKNOWN")]
+        self._pki_version           = values.get("pki_version")
+        self._model_name            = values.get("model_name")
+        self._chip_ref              = values.get("chip_ref")
+        self._form_factor           = FormFactor[values.get("form_factor", "UNKNOWN")]
+        self._has_otp               = values.get("has_otp", False)
+
+    def _merge(self, other: "ThalesDevice"):
+        """Completes the information with the one discovered through another transport"""
+        for attr in ("_custom_serial_number", "_thales_serial_number", "_pki_serial_number", "_pki_version", "_model_name", "_chip_ref"):
+            if( getattr(self, attr) == None ):
+                setattr(self, attr, getattr(other, attr))
+        if( self._pki_applet == PkiApplet.UNKNOWN ) or ( self._pki_applet == PkiApplet.NONE ):
+            self._pki_applet = other._pki_applet
+        if( self._form_factor == FormFactor.UNKNOWN ):
+            self._form_factor = other._form_factor
+        self._has_otp           = self._has_otp or other._has_otp
+        self._is_thales_device  = self._is_thales_device or other._is_thales_device
+
     #@staticmethod
     #def hex(value) -> str:
     #    if isinstance(value, int):
@@ -167,6 +342,7 @@ class ThalesDevice():
     def _parse_device_info(self, bytes):
         #length = len(bytes)
         capacity_byte = bytes[0]
+        self._device_capabilities = capacity_byte
         if( capacity_byte&1 ):
             self._pcsc_capable = True
         if( capacity_byte&2 ):
@@ -0,0 +1,132 @@
+#Copyright 2025 Thales
+#
+# Redistribution and use in source and binary forms, with or 
+# without modification, are permitted provided that the following 
+# conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+# 
+# 3. Neither the name of the copyright holder nor the names of its 
+#    contributors may be used to endorse or promote products derived from 
+#    this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS 
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT 
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR 
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT 
+# HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, 
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED 
+# TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR 
+# PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF 
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING 
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS 
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.  
+
+import itertools
+import logging
+import threading
+import weakref
+from collections import OrderedDict
+from typing import Callable, Optional
+
+
+class HandleRegistry():
+    """ Tracks the open device handles (HID connections, PCSC cards).
+
+        Each device registers the function closing its handle. A weakref
+        finalizer closes it if the device is garbage collected without close()
+        (counted as leaked). When more than 'limit' handles are open, the least
+        recently used idle devices are closed (counted as evicted).
+    """
+
+    def __init__(self, limit: Optional[int] = 128):
+        self.limit      = limit
+        self._lock      = threading.RLock()
+        self._handles   = OrderedDict()     # id -> weakref to the device
+        self._ids       = itertools.count()
+        self.opened     = 0
+        self.closed     = 0
+        self.evicted    = 0
+        self.leaked     = 0
+
+    @property
+    def open(self) -> int:
+        """ Number of handles currently open """
+        with self._lock:
+            return len(self._handles)
+
+    def register(self, device, closer: Callable[[], None]) -> weakref.finalize:
+        """ Returns the finalizer to call to close the handle """
+        handle_id = next(self._ids)
+        finalizer = weakref.finalize(device, self._close, handle_id, closer, True)
+        finalizer.atexit = False
+        with self._lock:
+            self._handles[handle_id] = weakref.ref(device)
+            self.opened += 1
+        device._handle_id = handle_id
+        self._evict()
+        return finalizer
+
+    def release(self, finalizer: weakref.finalize) -> None:
+        """ Closes the handle now (device.close()), the finalizer will not run """
+        info = finalizer.detach()
+        if( info is not None ):
+            handle_id, closer, _ = info[2]
+            self._close(handle_id, closer)
+
+    def touch(self, handle_id) -> None:
+        """ The device was used: it is the last one to be evicted """
+        with self._lock:
+            if( handle_id in self._handles ):
+                self._handles.move_to_end(handle_id)
+
+    def _close(self, handle_id, closer, leaked = False) -> None:
+        with self._lock:
+            if( self._handles.pop(handle_id, None) is None ):
+                return
+            self.closed += 1
+            if( leaked ):
+                self.leaked += 1
+        if( leaked ):
+            logging.debug("Device handle %d was not closed", handle_id)
+        try:
+            closer()
+        except Exception as e:
+            logging.debug("Unable to close device handle %d %r", handle_id, e)
+
+    def _evict(self) -> None:
+        while True:
+            with self._lock:
+                if( self.limit is None ) or ( len(self._handles) <= self.limit ):
+                    return
+                victim = None
+                for ref in list(self._handles.values())[:-1]:
+                    device = ref()
+                    if( device is not None ) and ( not device.scheduler.is_busy ):
+                        victim = device
+                        break
+                if( victim is None ):
+                    return
+                self.evicted += 1
+            logging.info("Too many open devices, closing %r", victim)
+            victim.close()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "open":     len(self._handles),
+                "opened":   self.opened,
+                "closed":   self.closed,
+                "evicted":  self.evicted,
+                "leaked":   self.leaked,
+                "limit":    self.limit,
+            }
+
+
+# Registry of all the devices of the process
+registry = HandleRegistry()
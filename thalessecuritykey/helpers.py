@@ -30,6 +30,7 @@
 
 from time import sleep
 import ctypes, os
+import logging
 
 from fido2.hid import CtapHidDevice
 from fido2.pcsc import CtapPcscDevice
@@ -37,6 +38,7 @@ from fido2.pcsc import CtapPcscDevice
 from thalessecuritykey.device import ThalesDevice
 from .hid import CtapHidThalesDevice
 from .pcsc import PcscThalesDevice
+from . import broker as _broker
 from .const import ATRs, thales_vendor_id
 
 def is_user_admin() -> bool:
@@ -72,31 +74,69 @@ def is_thales_device(device):
 
 
 
-def scan_devices(fido_only=False, thales_only=True, wait=True, serial_number = None, pcsc_reader = None) :
+class DeviceList(list):
+    """ Devices returned by scan_devices: 'with scan_devices() as devices:' closes them all """
+
+    def close(self) -> None:
+        for dev in self:
+            try:
+                dev.close()
+            except Exception:
+                pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, typ, value, traceback):
+        self.close()
+
+
+
+def scan_devices(fido_only=False, thales_only=True, wait=True, serial_number = None, pcsc_reader = None, broker = None, merge = True,
+                 timeout = None, apdu_timeout = None, reports = None) :
+    """ timeout & apdu_timeout bound the PCSC discovery; reports receives one ReaderReport per PCSC reader """
+
+    # Ask the broker daemon, which already discovered the devices
+    if( broker ):
+        socket_path = _broker.DEFAULT_SOCKET if broker == True else broker
+        return DeviceList(_broker.scan_devices(fido_only, thales_only, wait, serial_number, pcsc_reader, socket_path))
     
     # Get list of valid HID FIDO devices
-    devices = list(enumerate_hid_devices(thales_only, serial_number))
+    devices = DeviceList(enumerate_hid_devices(thales_only, serial_number))
+
+    # A token exposing both HID & CCID is returned once: the PCSC discovery
+    # of a S/N already seen over HID is merged into the HID device
+    correlate = None
+    if( merge ):
+        correlate = {dev._thales_serial_number: dev for dev in devices if dev._thales_serial_number}
 
     # Add all PCSC valid devices (FIDO & NON-FIDO)
-    devices += list(enumerate_pcsc_devices(fido_only, thales_only, pcsc_reader))
+    devices += list(enumerate_pcsc_devices(fido_only, thales_only, pcsc_reader, correlate, timeout, apdu_timeout, reports))
 
     if( len(devices) == 0) and ( wait ):
         try:
             sleep(1)
         except KeyboardInterrupt:
-            return []
-        return scan_devices(fido_only, thales_only, wait, serial_number, pcsc_reader)    
+            return DeviceList()
+        if( reports != None ):
+            reports.clear()
+        return scan_devices(fido_only, thales_only, wait, serial_number, pcsc_reader, broker, merge, timeout, apdu_timeout, reports)    
+
+    # Commands known to fail on these models (see ThalesDevice.knowledge)
+    skipped = sum(dev.skipped_commands for dev in devices) + sum(dev.pcsc.skipped_commands for dev in devices if getattr(dev, "pcsc", None))
+    if( skipped ):
+        logging.info("Scan: %d discovery command(s) skipped by the model knowledge base", skipped)
  
     return devices
 
 
 
 def enumerate_hid_devices(thales_only=True, serial_number = None):
-    for dev in CtapHidThalesDevice.list_devices(thales_only, serial_number):
-        yield dev
+    yield from CtapHidThalesDevice.list_devices(thales_only, serial_number)
 
 
-def enumerate_pcsc_devices(fido_only=False, thales_only=True, pcsc_reader = None):
-    for dev in PcscThalesDevice.list_devices(fido_only, thales_only, pcsc_reader):
-        yield dev
+def enumerate_pcsc_devices(fido_only=False, thales_only=True, pcsc_reader = None, correlate = None, timeout = None, apdu_timeout = None, reports = None):
+    # yield from: closing this generator early also closes the probes of list_devices
+    yield from PcscThalesDevice.list_devices(fido_only, thales_only, pcsc_reader, correlate = correlate,
+                                             timeout = timeout, apdu_timeout = apdu_timeout, reports = reports)
 
@@ -35,46 +35,96 @@ from venv import logger
 from fido2.hid import CtapHidDevice, list_descriptors, open_connection
 
 from .device import ThalesDevice 
-from .const import (thales_vendor_id)
+from .const import (thales_vendor_id, Priority)
 
 
 class CtapHidThalesDevice(ThalesDevice, CtapHidDevice):
     def __init__(self, descriptor, connection,):
         ThalesDevice.__init__(self, descriptor.product_name, True)
-        CtapHidDevice.__init__(self, descriptor, connection)
+        self._pcsc = None
+        self._track_handle(connection.close)
+        try:
+            CtapHidDevice.__init__(self, descriptor, connection)
 
-        # Set to default value
-        self._fido_version = '.'.join(map(str, self._device_version))
+            # Set to default value
+            self._fido_version = '.'.join(map(str, self._device_version))
 
-        # Setup the Thales Serial Number with this default value
-        self.serial_number = descriptor.serial_number
+            # Setup the Thales Serial Number with this default value
+            self.serial_number = descriptor.serial_number
 
-        # if firmware = 31, 2, 3, it returns the FIDO applet version
-        self._discovery()
+            # if firmware = 31, 2, 3, it returns the FIDO applet version
+            self._discovery()
+        except:
+            self.close()
+            raise
         if( descriptor.vid == thales_vendor_id):
             self._is_thales_device = True
 
     def __repr__(self):
         try:
+            if( self._pcsc is not None ):
+                return f"CtapHidThalesDevice({self.name!r}, {self.device_version}, {self.serial_number}, {self._pcsc.reader!r})"
             return f"CtapHidThalesDevice({self.name!r}, {self.device_version}, {self.serial_number})"
         except:
             # The object is not yet fully initialized
             return f"CtapHidThalesDevice({self.name!r})"
+
+    @property
+    def pcsc(self):
+        """ PCSC (CCID) interface of the same token, if any """
+        return self._pcsc
+
+    def attach_pcsc(self, dev) -> None:
+        """ The token also exposes a CCID interface: keep a single object
+            serving FIDO over HID and the PKI APDUs over PCSC """
+        self._pcsc = dev
+        self._merge(dev)
+
+    def close(self) -> None:
+        if( self._pcsc is not None ):
+            self._pcsc.close()
+        super().close()
+
+    def to_dict(self) -> dict:
+        out = super().to_dict()
+        out["transport"]      = "hid"
+        out["path"]           = str(self.descriptor.path)
+        out["vid"]            = self.descriptor.vid
+        out["pid"]            = self.descriptor.pid
+        out["device_version"] = list(self.device_version)
+        out["capabilities"]   = int(self.capabilities)
+        if( self._pcsc is not None ):
+            out["reader"]     = self._pcsc.reader
+        return out
+
+    def rediscover(self) -> bool:
+        """ Runs the discovery again as background work """
+        with self.session(Priority.BACKGROUND):
+            return self._discovery()
     
   
+    def _model_key(self) -> str:
+        return "hid:%04x:%04x:%s" % (self.descriptor.vid, self.descriptor.pid, '.'.join(map(str, self.device_version)))
+
     def _discovery(self) -> bool:
         """
             Discover product details like S/N, Applet version...
         """        
         # Send GETDATA to the applet. works only on FMW > 29.x.x
-        resp = self.call_raw(0x50, b"\x00\x01\x66")
-        if (resp[0] == 0x00):
-            if( self.device_version[0] >= 29 ):
-                self._fido_version = resp[2:].decode("utf-8").split('\x00', 1)[0]
-            else:
-                self._pki_version = resp[2:].decode("utf-8").split('\x00', 1)[0]
-
+        if( not self._skip_probe("vendor_66") ):
+            resp = self.call_raw(0x50, b"\x00\x01\x66")
+            self._probe_result("vendor_66", resp[0] == 0x00)
+            if (resp[0] == 0x00):
+                if( self.device_version[0] >= 29 ):
+                    self._fido_version = resp[2:].decode("utf-8").split('\x00', 1)[0]
+                else:
+                    self._pki_version = resp[2:].decode("utf-8").split('\x00', 1)[0]
+
+        if( self._skip_probe("vendor_55") ):
+            return False
         resp = self.call_raw(0x50, b"\x00\x01\x55")
+        if( resp[0] in (0, 1) ):
+            self._probe_result("vendor_55", resp[0] == 0)
 
         if (resp[0] == 1):            
             logger.info("This product do not have an accessible S/N")
@@ -94,9 +144,11 @@ class CtapHidThalesDevice(ThalesDevice, CtapHidDevice):
             There is no equivalent in the mother class CtapHidDevice
         """
         
+        self._touch()
         packet = struct.pack(">IB", self._channel_id, 128 | command) + data
-        self._connection.write_packet(packet.ljust(self._packet_size, b"\0"))
-        recv = self._connection.read_packet()
+        with self.session(Priority.INTERACTIVE):
+            self._connection.write_packet(packet.ljust(self._packet_size, b"\0"))
+            recv = self._connection.read_packet()
 
         r_channel = struct.unpack_from(">I", recv)[0]
         if r_channel != self._channel_id:
@@ -115,4 +167,7 @@ class CtapHidThalesDevice(ThalesDevice, CtapHidDevice):
             if( not thales_only ) or ( dev.is_thales_device and thales_only):
                 if( not serial_number ) or ( dev.serial_number == serial_number):
                     yield dev
+                    continue
+            # Filtered out: do not keep the HID handle open
+            dev.close()
     
\ No newline at end of file
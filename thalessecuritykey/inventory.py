@@ -0,0 +1,273 @@
+#Copyright 2025 Thales
+#
+# Redistribution and use in source and binary forms, with or 
+# without modification, are permitted provided that the following 
+# conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+# 
+# 3. Neither the name of the copyright holder nor the names of its 
+#    contributors may be used to endorse or promote products derived from 
+#    this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS 
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT 
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR 
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT 
+# HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, 
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED 
+# TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR 
+# PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF 
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING 
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS 
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.  
+
+import csv
+import json
+import re
+import sqlite3
+import threading
+import time
+from typing import Iterable, List, Optional
+
+from .device import ThalesDevice
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS devices (
+    serial_number       TEXT PRIMARY KEY,
+    name                TEXT,
+    model_name          TEXT,
+    chip_ref            TEXT,
+    pki_applet          TEXT,
+    pki_version         TEXT,
+    pki_version_key     TEXT,
+    fido_version        TEXT,
+    fido_version_key    TEXT,
+    form_factor         TEXT,
+    is_thales_device    INTEGER,
+    has_fido            INTEGER,
+    has_otp             INTEGER,
+    transport           TEXT,
+    reader              TEXT,
+    station             TEXT,
+    first_seen          REAL,
+    last_seen           REAL
+);
+CREATE INDEX IF NOT EXISTS idx_devices_model       ON devices (model_name);
+CREATE INDEX IF NOT EXISTS idx_devices_pki         ON devices (pki_applet, pki_version_key);
+CREATE INDEX IF NOT EXISTS idx_devices_pki_version ON devices (pki_version_key);
+CREATE INDEX IF NOT EXISTS idx_devices_fido        ON devices (fido_version_key);
+CREATE INDEX IF NOT EXISTS idx_devices_form_factor ON devices (form_factor);
+CREATE INDEX IF NOT EXISTS idx_devices_location    ON devices (station, reader);
+
+CREATE TABLE IF NOT EXISTS sightings (
+    serial_number       TEXT NOT NULL,
+    station             TEXT,
+    reader              TEXT,
+    transport           TEXT,
+    pki_version         TEXT,
+    fido_version        TEXT,
+    seen                REAL
+);
+CREATE INDEX IF NOT EXISTS idx_sightings_serial ON sightings (serial_number, seen);
+"""
+
+# State of the device at its last sighting: a batch arriving late (e.g. from
+# a station which was offline) only moves first_seen / last_seen
+_LATEST_COLUMNS = ("name", "model_name", "chip_ref", "pki_applet", "pki_version", "pki_version_key",
+                   "fido_version", "fido_version_key", "form_factor", "is_thales_device", "has_fido", "has_otp",
+                   "transport", "reader", "station")
+
+_UPSERT = """
+INSERT INTO devices (serial_number, name, model_name, chip_ref, pki_applet, pki_version, pki_version_key,
+                     fido_version, fido_version_key, form_factor, is_thales_device, has_fido, has_otp,
+                     transport, reader, station, first_seen, last_seen)
+VALUES (:serial_number, :name, :model_name, :chip_ref, :pki_applet, :pki_version, :pki_version_key,
+        :fido_version, :fido_version_key, :form_factor, :is_thales_device, :has_fido, :has_otp,
+        :transport, :reader, :station, :seen, :seen)
+ON CONFLICT (serial_number) DO UPDATE SET
+""" + "".join(f"    {column} = CASE WHEN excluded.last_seen >= devices.last_seen THEN excluded.{column} ELSE devices.{column} END,\n"
+              for column in _LATEST_COLUMNS) + """\
+    first_seen = MIN(devices.first_seen, excluded.first_seen),
+    last_seen = MAX(devices.last_seen, excluded.last_seen)
+"""
+
+_SIGHTING = """
+INSERT INTO sightings (serial_number, station, reader, transport, pki_version, fido_version, seen)
+VALUES (:serial_number, :station, :reader, :transport, :pki_version, :fido_version, :seen)
+"""
+
+_COLUMNS = ("serial_number", "name", "model_name", "chip_ref", "pki_applet", "pki_version", "fido_version",
+            "form_factor", "is_thales_device", "has_fido", "has_otp", "transport", "reader", "station",
+            "first_seen", "last_seen")
+
+
+def version_key(version) -> Optional[str]:
+    """ Sortable form of a version string: "4.5.10" -> "00004.00005.00010" """
+    if( version == None ):
+        return None
+    numbers = re.findall(r"\d+", str(version))
+    if( not numbers ):
+        return None
+    return ".".join(n.zfill(5) for n in numbers)
+
+
+class InventoryStore():
+    """ Embedded SQLite store of the scanned devices.
+
+        One row per serial number holds the last known state and the first/last
+        time it was seen; every scan adds a sighting (station, reader, versions)
+        to the history. The query columns are indexed.
+    """
+
+    def __init__(self, path: str = ":memory:", batch_size: int = 1000):
+        self._path          = path
+        self.batch_size     = batch_size
+        self._lock          = threading.Lock()
+        self._db            = sqlite3.connect(path, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        if( path != ":memory:" ):
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(_SCHEMA)
+
+    def __repr__(self):
+        return f"InventoryStore({self._path!r})"
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, typ, value, traceback):
+        self.close()
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+    @staticmethod
+    def _row(device, station, seen) -> Optional[dict]:
+        values = device.to_dict() if isinstance(device, ThalesDevice) else dict(device)
+        if( not values.get("serial_number") ):
+            return None
+        return {
+            "serial_number":    values["serial_number"],
+            "name":             values.get("name"),
+            "model_name":       values.get("model_name"),
+            "chip_ref":         values.get("chip_ref"),
+            "pki_applet":       values.get("pki_applet"),
+            "pki_version":      values.get("pki_version"),
+            "pki_version_key":  version_key(values.get("pki_version")),
+            "fido_version":     values.get("fido_version"),
+            "fido_version_key": version_key(values.get("fido_version")),
+            "form_factor":      values.get("form_factor"),
+            "is_thales_device": int(bool(values.get("is_thales_device"))),
+            "has_fido":         int(bool(values.get("has_fido"))),
+            "has_otp":          int(bool(values.get("has_otp"))),
+            "transport":        values.get("transport"),
+            "reader":           values.get("reader"),
+            "station":          station if station != None else values.get("station"),
+            "seen":             values.get("seen", seen),
+        }
+
+    def upsert(self, devices: Iterable, station: str = None, seen: float = None) -> int:
+        """ Records the devices (ThalesDevice or to_dict() values) seen by a scan, returns the count.
+            Devices without serial number are ignored. """
+        seen  = time.time() if seen == None else seen
+        count = 0
+        batch = []
+        with self._lock, self._db:
+            for device in devices:
+                row = self._row(device, station, seen)
+                if( row == None ):
+                    continue
+                batch.append(row)
+                if( len(batch) >= self.batch_size ):
+                    count += self._write(batch)
+                    batch = []
+            if( batch ):
+                count += self._write(batch)
+        return count
+
+    def _write(self, batch) -> int:
+        self._db.executemany(_UPSERT, batch)
+        self._db.executemany(_SIGHTING, batch)
+        return len(batch)
+
+    def _select(self, sql, params = ()) -> List[dict]:
+        with self._lock:
+            return [dict(row) for row in self._db.execute(sql, params)]
+
+    def get(self, serial_number: str) -> Optional[dict]:
+        rows = self._select(f"SELECT {', '.join(_COLUMNS)} FROM devices WHERE serial_number = ?", (serial_number,))
+        return rows[0] if rows else None
+
+    def last_seen(self, serial_number: str) -> Optional[dict]:
+        """ Where & when a serial number was seen for the last time """
+        rows = self._select("SELECT station, reader, transport, last_seen FROM devices WHERE serial_number = ?", (serial_number,))
+        return rows[0] if rows else None
+
+    def history(self, serial_number: str, limit: int = None) -> List[dict]:
+        """ Sightings of a serial number, most recent first """
+        sql = "SELECT station, reader, transport, pki_version, fido_version, seen FROM sightings WHERE serial_number = ? ORDER BY seen DESC"
+        params = [serial_number]
+        if( limit != None ):
+            sql += " LIMIT ?"
+            params.append(limit)
+        return self._select(sql, params)
+
+    @staticmethod
+    def _where(model = None, pki_applet = None, pki_version = None, pki_version_lt = None, pki_version_ge = None,
+               fido_version = None, fido_version_lt = None, fido_version_ge = None, form_factor = None,
+               station = None, reader = None, seen_since = None):
+        clauses, params = [], []
+        def add(clause, value):
+            if( value != None ):
+                clauses.append(clause)
+                params.append(value)
+        add("model_name = ?",        model)
+        add("pki_applet = ?",        getattr(pki_applet, "name", pki_applet))
+        add("pki_version = ?",       pki_version)
+        add("pki_version_key < ?",   version_key(pki_version_lt))
+        add("pki_version_key >= ?",  version_key(pki_version_ge))
+        add("fido_version = ?",      fido_version)
+        add("fido_version_key < ?",  version_key(fido_version_lt))
+        add("fido_version_key >= ?", version_key(fido_version_ge))
+        add("form_factor = ?",       getattr(form_factor, "name", form_factor))
+        add("station = ?",           station)
+        add("reader = ?",            reader)
+        add("last_seen >= ?",        seen_since)
+        return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+    def query(self, limit: int = None, **filters) -> List[dict]:
+        """ Devices matching all the filters, e.g. query(pki_applet="PIV", pki_version_lt="4.5").
+            Filters: model, pki_applet, pki_version[_lt|_ge], fido_version[_lt|_ge], form_factor,
+            station, reader, seen_since. """
+        where, params = self._where(**filters)
+        sql = f"SELECT {', '.join(_COLUMNS)} FROM devices{where} ORDER BY serial_number"
+        if( limit != None ):
+            sql += " LIMIT ?"
+            params.append(limit)
+        return self._select(sql, params)
+
+    def count(self, **filters) -> int:
+        where, params = self._where(**filters)
+        return self._select(f"SELECT COUNT(*) AS count FROM devices{where}", params)[0]["count"]
+
+    def export(self, stream, format: str = "csv", **filters) -> int:
+        """ Writes the matching devices to a text stream (csv or json), returns the count """
+        rows = self.query(**filters)
+        if( format == "json" ):
+            json.dump(rows, stream, indent=2)
+        elif( format == "csv" ):
+            writer = csv.DictWriter(stream, fieldnames=_COLUMNS)
+            writer.writeheader()
+            writer.writerows(rows)
+        else:
+            raise ValueError(f"Unknown export format {format}")
+        return len(rows)
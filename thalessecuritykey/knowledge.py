@@ -0,0 +1,144 @@
+#Copyright 2025 Thales
+#
+# Redistribution and use in source and binary forms, with or 
+# without modification, are permitted provided that the following 
+# conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+# 
+# 3. Neither the name of the copyright holder nor the names of its 
+#    contributors may be used to endorse or promote products derived from 
+#    this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS 
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT 
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR 
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT 
+# HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, 
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED 
+# TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR 
+# PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF 
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING 
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS 
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.  
+
+
+import json
+import threading
+from typing import Dict, List, Optional
+
+
+# Probes which always fail on a given model.
+#
+# A model is identified by its HID identity (vid, pid, device_version) or its
+# ATR. Each discovery probe (vendor command, applet SELECT...) reports its
+# outcome; once a probe failed 'threshold' times on a model and never
+# succeeded, the devices of this model stop sending it, except one time in
+# 'retry_every' (a firmware update or a transient failure must not disable a
+# probe forever: a success re-enables it). The knowledge can be saved and
+# loaded (JSON), e.g. to ship it to the stations.
+#
+# The knowledge shared by the process (default_knowledge) only learns: it
+# skips probes once a knowledge file is loaded, or when enabled by hand.
+#
+# File format: {model: {probe: [failures, successes]}}, or {model: [probe, ...]}
+# to declare unsupported probes by hand.
+
+
+class ModelKnowledge():
+
+    def __init__(self, path: str = None, threshold: int = 2, retry_every: Optional[int] = 50, enabled: bool = True):
+        self.threshold      = threshold
+        self.retry_every    = retry_every
+        self.enabled        = enabled
+        self._lock          = threading.Lock()
+        self._models: Dict[str, Dict[str, List[int]]] = {}
+        self._skips: Dict[tuple, int] = {}
+        self.skipped        = 0         # Probes not sent
+        self.saved          = 0         # APDU / HID commands not sent
+        if( path != None ):
+            self.load(path)
+
+    def __repr__(self):
+        return f"ModelKnowledge({len(self._models)} models)"
+
+    def is_unsupported(self, model: str, probe: str) -> bool:
+        with self._lock:
+            failures, successes = self._models.get(model, {}).get(probe, (0, 0))
+        return successes == 0 and failures >= self.threshold
+
+    def skip(self, model: str, probe: str, commands: int = 1) -> bool:
+        """ True if the probe must not be sent (counted as saved) """
+        if( not self.enabled ) or ( model == None ) or ( not self.is_unsupported(model, probe) ):
+            return False
+        with self._lock:
+            skips = self._skips.get((model, probe), 0) + 1
+            if( self.retry_every != None ) and ( skips >= self.retry_every ):
+                # Probed again: its result is recorded
+                self._skips[(model, probe)] = 0
+                return False
+            self._skips[(model, probe)] = skips
+            self.skipped += 1
+            self.saved   += commands
+        return True
+
+    def record(self, model: str, probe: str, ok: bool) -> None:
+        if( model == None ):
+            return
+        with self._lock:
+            counts = self._models.setdefault(model, {}).setdefault(probe, [0, 0])
+            counts[1 if ok else 0] += 1
+
+    def unsupported(self, model: str = None) -> Dict[str, List[str]]:
+        """ {model: [probes not sent anymore]} """
+        with self._lock:
+            models = {m: dict(p) for m, p in self._models.items() if model == None or m == model}
+        out = {}
+        for m, probes in models.items():
+            names = sorted(probe for probe, (failures, successes) in probes.items()
+                           if successes == 0 and failures >= self.threshold)
+            if( names ):
+                out[m] = names
+        return out
+
+    def forget(self, model: str = None) -> None:
+        with self._lock:
+            if( model == None ):
+                self._models.clear()
+                self._skips.clear()
+            else:
+                self._models.pop(model, None)
+                self._skips = {key: count for key, count in self._skips.items() if key[0] != model}
+
+    def load(self, path: str) -> None:
+        with open(path, "r", encoding="utf-8") as f:
+            content = json.load(f)
+        with self._lock:
+            for model, probes in content.items():
+                entry = self._models.setdefault(model, {})
+                if( isinstance(probes, list) ):
+                    probes = {probe: [self.threshold, 0] for probe in probes}
+                for probe, (failures, successes) in probes.items():
+                    counts = entry.setdefault(probe, [0, 0])
+                    counts[0] += failures
+                    counts[1] += successes
+            self.enabled = True
+
+    def save(self, path: str) -> None:
+        with self._lock:
+            content = {model: {probe: list(counts) for probe, counts in probes.items()} for model, probes in self._models.items()}
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(content, f, indent=2, sort_keys=True)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"models": len(self._models), "skipped": self.skipped, "saved": self.saved}
+
+
+# Knowledge shared by all the devices of the process: learns, skips once loaded
+default_knowledge = ModelKnowledge(enabled=False)
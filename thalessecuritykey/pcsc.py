@@ -31,69 +31,323 @@
 import hashlib
 import struct
 import logging
+import time
+import queue
+import threading
+from contextlib import contextmanager
 from typing import Iterator,  Tuple
 
 from fido2.pcsc import CtapPcscDevice, _list_readers, SW_SUCCESS, CardConnection
+from fido2.hid import CAPABILITY
+from smartcard.Exceptions import NoCardException
+from smartcard.scard import (SCardBeginTransaction, SCardEndTransaction, SCardEstablishContext, SCardReleaseContext,
+                             SCardGetStatusChange, SCARD_S_SUCCESS, SCARD_LEAVE_CARD, SCARD_SCOPE_USER,
+                             SCARD_STATE_UNAWARE, SCARD_STATE_PRESENT, SCARD_STATE_MUTE)
 from .device import PkiApplet, ThalesDevice
+from .settle import SettlePolicy, default_policy
+from .readers import ReaderHealth, ReaderReport, CardPresenceCache, default_health
+from .apdu import ApduProfile, SCARD_ATTR_MAXINPUT, read_binary
 from .const import *
 
 
+class ApduTimeout(TimeoutError):
+    """ The device answered an APDU after the deadline: the discovery is aborted """
+
+
+# pcsclite accepts at most 16 readers per SCardGetStatusChange call
+_STATUS_CHUNK   = 16
+_status_lock    = threading.Lock()
+_status_context = None
+
+def _reader_states(names) -> dict:
+    """ Returns {reader: (state, ATR)} for all the readers with SCardGetStatusChange,
+        without connecting to any of them. Returns None if the query is not available.
+    """
+    global _status_context
+    with _status_lock:
+        try:
+            if( _status_context == None ):
+                hresult, hcontext = SCardEstablishContext(SCARD_SCOPE_USER)
+                if( hresult != SCARD_S_SUCCESS ):
+                    return None
+                _status_context = hcontext
+
+            out = {}
+            for index in range(0, len(names), _STATUS_CHUNK):
+                hresult, states = SCardGetStatusChange(_status_context, 0, [(name, SCARD_STATE_UNAWARE) for name in names[index:index + _STATUS_CHUNK]])
+                if( hresult != SCARD_S_SUCCESS ):
+                    raise Exception(f"SCardGetStatusChange failed [{hex(hresult)}]")
+                for name, state, atr in states:
+                    out[name] = (state, bytes(atr))
+            return out
+        except Exception as e:
+            logging.debug("Reader status query failed %r", e)
+            if( _status_context != None ):
+                SCardReleaseContext(_status_context)
+                _status_context = None
+            return None
+
+
 #******************************************************************************
 # Default class for PCSC connection (PKI & FIDO)
 
 class PcscThalesDevice(ThalesDevice, CtapPcscDevice):
-    def __init__(self, connection: CardConnection, name: str, has_fido: bool = False):
+
+    # Run the multi-APDU sequences inside an exclusive PCSC transaction
+    use_transaction = True
+
+    # Retry of the steps failing just after insertion (SAC)
+    settle_policy: SettlePolicy = default_policy
+
+    # Maximum duration of one APDU during the discovery (seconds, None = no limit)
+    apdu_timeout = None
+
+    # Deadline of list_devices when no timeout is given (seconds, None = no limit)
+    scan_timeout = 10.0
+
+    # Cards rejected by the previous scans (see list_devices fast_path)
+    presence_cache = CardPresenceCache()
+
+    def __init__(self, connection: CardConnection, name: str, has_fido: bool = False, protocol = None, correlate: dict = None, apdu_timeout = None):
+        """ correlate: Thales S/N -> device already discovered through another transport (HID).
+            When the card manager returns one of these S/N, the FIDO probing is skipped
+            and only the PKI discovery runs.
+        """
         super().__init__(name, has_fido)
         self._conn = connection
-        
+        self._reader = name
+        self._protocol = protocol
+        self._transaction_depth = 0
+        self._discovery_time = None
+        self._twin = None
+        self._deferred = []
+        self._atr = None
+        self._profile = ApduProfile()
+        if( apdu_timeout != None ):
+            self.apdu_timeout = apdu_timeout
+        self._track_handle(connection.disconnect)
+
         try:
-            CtapPcscDevice.__init__(self, connection, name)
-            self._has_fido = True
-            self._has_fido_accessible = True
-        except: 
-            pass
+            self._open(correlate)
+        except:
+            self.close()
+            raise
+
+    def _open(self, correlate):
+        """ Connects to the card & runs the discovery """
+        name = self._reader
 
         # The connection is not yet open
-        if( self._conn.component.hcard == None):
-            self._conn.connect()
+        if( self._hcard() == None ):
+            self._conn.connect(self._protocol)
+        self._atr = bytes(self._conn.getATR() or b"")
+
+        start = time.perf_counter()
+        # The whole discovery in one PCSC transaction: another application
+        # cannot select its applet between our SELECTs & reads
+        with self.transaction(Priority.BACKGROUND):
+            self._check_card_manager()
+
+            if( correlate ) and ( self._thales_serial_number in correlate ):
+                # Same token as an already discovered device: FIDO is served by the other transport
+                self._twin = correlate[self._thales_serial_number]
+                self._capabilities = CAPABILITY(0)
+                self.use_ext_apdu = False
+                self.use_nfcctap_getresponse = True
+            else:
+                product_name = self._name
+                try:
+                    CtapPcscDevice.__init__(self, self._conn, name)
+                    self._has_fido = True
+                    self._has_fido_accessible = True
+                except: 
+                    pass
+                # Keep the product name read from the card manager
+                self._name = product_name
+
+            self._profile = ApduProfile.detect(self._atr, name, self._max_input(), self.nfc_capable)
+            # Large CBOR messages in one extended APDU rather than chained short APDUs
+            # (see _chain_apdus for the messages larger than the reader frame)
+            self.use_ext_apdu = self._profile.extended
+
+            atr = self._atr
+            self._discovery()
 
-        atr = bytes(self._conn.getATR())
-        self._check_card_manager()
-        self._discovery()
-        
-        try:
-            # Check if the device is a Thales device
-            for atr_entry in ATRs:
-                if( atr_entry.isValid(atr) ): 
-                    self._is_thales_device = True
-                    break
-        except Exception as e:
-            print("ATR Error (%s) %r", name, e)
+            try:
+                # Check if the device is a Thales device
+                for atr_entry in ATRs:
+                    if( atr_entry.isValid(atr) ): 
+                        self._is_thales_device = True
+                        break
+            except Exception as e:
+                print("ATR Error (%s) %r", name, e)
 
-        # Select the FIDO Applet to enable all FIDO commmands
-        self._select()
+        # Outside of the transaction: each retry takes the device, the settle
+        # delays do not hold it
+        self._run_deferred()
 
-            
-            
+        # Select the FIDO Applet to enable all FIDO commmands
+        if( self._twin is None ) and ( self._has_fido_accessible ):
+            with self.transaction(Priority.BACKGROUND):
+                self._select()
+        self._discovery_time = time.perf_counter() - start
 
     def __repr__(self):
         return f"PcscThalesDevice({self.name}, {self.serial_number})"
     
     def __eq__(self, other): 
         return self.serial_number == other.serial_number
-      
+
+    @property
+    def reader(self) -> str:
+        """ Name of the PCSC reader holding the device """
+        return self._reader
+
+    def to_dict(self) -> dict:
+        out = super().to_dict()
+        out["transport"]    = "pcsc"
+        out["reader"]       = self._reader
+        out["capabilities"] = int(getattr(self, "_capabilities", 0))
+        out["interface"]    = self._profile.interface.name
+        return out
+
+    @property
+    def apdu_profile(self) -> ApduProfile:
+        """ APDU sizes used with this reader (interface, extended length, frame size) """
+        return self._profile
+
+    def _max_input(self):
+        """ Maximum message size of the reader, None if the driver does not give it """
+        get_attrib = getattr(getattr(self._conn, "component", self._conn), "getAttrib", None)
+        if( get_attrib == None ):
+            return None
+        try:
+            value = bytes(get_attrib(SCARD_ATTR_MAXINPUT) or b"")
+        except Exception:
+            return None
+        return int.from_bytes(value, "little") if value else None
+
+    def read_object(self, file_id) -> Tuple[bool, bytes]:
+        """ Reads a whole file (e.g. a certificate) with the fewest READ BINARY the reader allows """
+        with self.transaction():
+            resp, sw1, sw2 = self._exchange(APDU_SELECT_FILE + struct.pack("!B", len(file_id)) + file_id)
+            if (sw1, sw2) != SW_SUCCESS:
+                return False, None
+            return read_binary(self._exchange, self._profile)
+
+    def is_present(self) -> bool:
+        """ Checks that the card is still in the reader, without sending any APDU """
+        try:
+            return bool(self._conn.getATR())
+        except Exception:
+            return False
+
+    @property
+    def twin(self):
+        """ Same token discovered through another transport (see correlate) """
+        return self._twin
+
+    @property
+    def discovery_time(self):
+        """ Duration of the last discovery, in seconds """
+        return self._discovery_time
+
+    def rediscover(self) -> None:
+        """ Runs the discovery again as background work, then restores the FIDO applet """
+        start = time.perf_counter()
+        with self.transaction(Priority.BACKGROUND):
+            self._check_card_manager()
+            self._discovery()
+        # Each retry takes the device: the settle delays do not hold it
+        self._run_deferred()
+        if( self._has_fido_accessible ):
+            with self.transaction(Priority.BACKGROUND):
+                self._select()
+        self._discovery_time = time.perf_counter() - start
+
+    @contextmanager
+    def transaction(self, priority: Priority = Priority.INTERACTIVE):
+        """ Holds the device and runs the enclosed APDUs in one exclusive PCSC transaction:
+            other applications cannot slip commands in between (with device.transaction(): ...)
+        """
+        with self.session(priority):
+            began = False
+            if( self._transaction_depth == 0 ) and ( self.use_transaction ):
+                began = self._begin_transaction()
+            self._transaction_depth += 1
+            try:
+                yield self
+            finally:
+                self._transaction_depth -= 1
+                if( began ):
+                    self._end_transaction()
+
+    def _hcard(self):
+        component = getattr(self._conn, "component", self._conn)
+        return getattr(component, "hcard", None)
+
+    def _begin_transaction(self) -> bool:
+        hcard = self._hcard()
+        if( not isinstance(hcard, int) ):
+            return False
+        hresult = SCardBeginTransaction(hcard)
+        if( hresult != SCARD_S_SUCCESS ):
+            logging.debug("SCardBeginTransaction failed [%s]", hex(hresult))
+            return False
+        return True
+
+    def _end_transaction(self) -> None:
+        hresult = SCardEndTransaction(self._hcard(), SCARD_LEAVE_CARD)
+        if( hresult != SCARD_S_SUCCESS ):
+            logging.debug("SCardEndTransaction failed [%s]", hex(hresult))
+
+    def connect(self):
+        if( self._hcard() == None ):
+            self._conn.connect(self._protocol)
+        self._select()
+
+    def apdu_exchange(self, apdu: bytes, protocol = None):
+        self._touch()
+        with self.session(Priority.INTERACTIVE):
+            return super().apdu_exchange(apdu, protocol if protocol != None else self._protocol)
+
+    def _chain_apdus(self, cla: int, ins: int, p1: int, p2: int, data: bytes = b""):
+        if( not self.use_ext_apdu ) or ( len(data) <= self._profile.max_command ):
+            return super()._chain_apdus(cla, ins, p1, p2, data)
+        # fido2 sends the whole message in one extended APDU: chain short ones
+        # when it does not fit in the reader frame
+        with self.session(Priority.INTERACTIVE):
+            self.use_ext_apdu = False
+            try:
+                return super()._chain_apdus(cla, ins, p1, p2, data)
+            finally:
+                self.use_ext_apdu = True
+
+    def _model_key(self):
+        return f"atr:{self._atr.hex()}" if self._atr else None
+
     def _check_card_manager(self):
-        ''' Select the Card Manager to retrieve basic product information'''
-        if( self._transmit(AID_CARD_MANAGER) == False ):
+        ''' Select the Card Manager to retrieve basic product information (form factor, capabilities & S/N) '''
+        if( self._skip_probe("card_manager", 3) ):
             return
-                
+        select, details, sn = self._batch([AID_CARD_MANAGER, APDU_GET_DETAILS, APDU_GET_SN])
+        if( select[1:] != SW_SUCCESS ):
+            # No answer (0000) is a transport error, not an unsupported card manager
+            if( select[1] != 0x00 ):
+                self._probe_result("card_manager", False)
+            # The next answers do not come from the card manager
+            return
+        found = details[1:] == SW_SUCCESS or sn[1:] == SW_SUCCESS
+        if( found ) or ( details[1] != 0x00 and sn[1] != 0x00 ):
+            self._probe_result("card_manager", found)
+
         ''' Get all product details from the Card Manager (form factor & capabilities) '''
-        if(ret := self._transmit(APDU_GET_DETAILS))[0]:
-            self._parse_card_manager(bytes(ret[1]))
+        if( details[1:] == SW_SUCCESS ):
+            self._parse_card_manager(details[0])
             
         ''' Get S/N from the Card Manager'''
-        if(self.serial_number == None) and (ret := self._transmit(APDU_GET_SN))[0]:
-            self.serial_number = bytes(ret[1])[3:]
+        if( self.serial_number == None ) and ( sn[1:] == SW_SUCCESS ):
+            self.serial_number = sn[0][3:]
        
 
     def _discovery(self):
@@ -102,105 +356,171 @@ class PcscThalesDevice(ThalesDevice, CtapPcscDevice):
         if( self._pki_applet == PkiApplet.UNKNOWN):
             return self._discovery_legacy()
 
-        # Select the PKI Applet
-        if( self.pki_applet == PkiApplet.IDPRIME_930 ):
-            self._select_by_aid(AID_IDPRIME_930)
-        elif( self.pki_applet == PkiApplet.IDPRIME_940 ):
-            self._select_by_aid(AID_IDPRIME_940)
-        elif( self.pki_applet == PkiApplet.PIV ):
-            self._select_by_aid(AID_PIV)
-        
         if( self._pki_applet == PkiApplet.IDPRIME_930 ) or (self._pki_applet == PkiApplet.IDPRIME_940 ) or (self._pki_applet == PkiApplet.IDPRIME ):
 
-            if (ret := self._get_data(b"\xDF\x30", 0x00))[0]:
+            # Select the PKI Applet & get its version
+            plan = [self._get_data_apdu(b"\xDF\x30", 0x00)]
+            if( self._pki_applet == PkiApplet.IDPRIME_930 ):
+                plan.insert(0, self._select_apdu(AID_IDPRIME_930))
+            elif( self._pki_applet == PkiApplet.IDPRIME_940 ):
+                plan.insert(0, self._select_apdu(AID_IDPRIME_940))
+
+            if (ret := self._get_data_result(b"\xDF\x30", self._batch(plan)[-1]))[0]:
                 self.pki_version = ret[1][3:]
 
-        elif( self._pki_applet == PkiApplet.PIV ) and (self._select_by_aid(AID_PIV_ADMIN)):            
+        elif( self._pki_applet == PkiApplet.PIV ):
 
-            ret, resp = self._get_data(b"\xDF\x30") 
-            if( ret ):
-                self.pki_version = resp[3:]
-                self._is_thales_device  = True
+            responses = self._batch([self._select_apdu(AID_PIV)] + self._piv_admin_apdus())
+            if( not self._piv_admin_result(*responses[1:]) ):
+                self._defer(self._read_piv_admin_version)
 
                   
     def _discovery_legacy(self):
         """ Discover all applets inside the device; search for S/N"""
 
-        # Try to select any of the PKI Applet
-        if( self._select_by_aid(AID_PIV) ):
-            self.pki_applet     = PkiApplet.PIV
-        elif( self._select_by_aid(AID_IDPRIME_930) ):
-            self.pki_applet     = PkiApplet.IDPRIME_930
-        elif( self._select_by_aid(AID_IDPRIME_940) ):
-            self.pki_applet     = PkiApplet.IDPRIME_940
-        elif( self._select_by_aid(AID_IDPRIME) ):
-            self.pki_applet     = PkiApplet.IDPRIME
-            #print("I SHOULD NOT BE THERE")
+        # Try to select any of the PKI Applet, in this order: stops at the first one found
+        applets = [ (AID_PIV,           PkiApplet.PIV),
+                    (AID_IDPRIME_930,   PkiApplet.IDPRIME_930),
+                    (AID_IDPRIME_940,   PkiApplet.IDPRIME_940),
+                    (AID_IDPRIME,       PkiApplet.IDPRIME) ]
+        # Skip the applets this model never has
+        applets = [(aid, applet) for aid, applet in applets if not self._skip_probe(f"select:{applet.name}")]
+        responses = self._batch([self._select_apdu(aid) for aid, _ in applets], first_success = True) if applets else []
+        for (aid, applet), resp in zip(applets, responses):
+            # No answer (0000) is a transport error, not an unsupported applet
+            if( resp[1] != 0x00 ):
+                self._probe_result(f"select:{applet.name}", resp[1:] == SW_SUCCESS)
+            if( resp[1:] == SW_SUCCESS ):
+                self.pki_applet = applet
+                break
 
         if( self.has_idprime ):
+
+            # All these reads are independent: a single batch
+            plan  = self._read_file_apdus(b"\x00\x25") + self._read_file_apdus(b"\x00\x29")
+            plan += [self._get_data_apdu(b"\xDF\x30", 0x00)] + self._read_file_apdus(b"\x02\x01")
+            r = self._batch(plan)
             
-            if (ret := self._read_file(b"\x00\x25"))[0]:
+            if (ret := self._read_file_result(b"\x00\x25", r[0], r[1]))[0]:
                 self._parse_info_file(ret[1])
             
-            if (ret := self._read_file(b"\x00\x29"))[0]:
+            if (ret := self._read_file_result(b"\x00\x29", r[2], r[3]))[0]:
                 self._custom_serial_number = ret[1].decode("utf-8").split("\x00",1)[0].upper() # Works for FIPS
 
-            if (ret := self._get_data(b"\xDF\x30", 0x00))[0]:
+            if (ret := self._get_data_result(b"\xDF\x30", r[4]))[0]:
                 self.pki_version = ret[1][3:]
           
-            if (ret := self._read_file(b"\x02\x01"))[0]:
+            if (ret := self._read_file_result(b"\x02\x01", r[5], r[6]))[0]:
                 self._pki_serial_number = hashlib.md5(ret[1][4:]).hexdigest()[:16].upper()
 
         elif( self._pki_applet == PkiApplet.PIV ):    
 
-            if (ret := self._get_container_data(b"\x5F\xFF\x12"))[0]:
-                self._parse_info_file(ret[1])
+            r = self._batch([self._container_apdu(b"\x5F\xFF\x12"), self._container_apdu(b"\x5F\xFF\x13"), AID_CARD_MANAGER])
+
+            if( r[0][1:] == SW_SUCCESS ):
+                self._parse_info_file(r[0][0])
                 self._is_thales_device  = True # It's a Thales device
 
-            if (ret := self._get_container_data(b"\x5F\xFF\x13"))[0]:
-                self._custom_serial_number = ret[1][2:].decode("utf-8").upper()
+            if( r[1][1:] == SW_SUCCESS ):
+                self._custom_serial_number = r[1][0][2:].decode("utf-8").upper()
                 self._is_thales_device  = True # It's a Thales device
 
-            if( self._transmit(AID_CARD_MANAGER) == False ):
+            # Not a Thales token: no PIV admin applet to wait for
+            if( r[2][1:] != SW_SUCCESS ):
                 return
         
             # This select can fail just after inserting the device when SAC is enabled
-            if( self._select_by_aid(AID_PIV_ADMIN) ):
-                if (ret := self._get_data(b"\xDF\x30"))[0]:
-                    self.pki_version = ret[1][3:]
+            if( not self._read_piv_admin_version() ):
+                self._defer(self._read_piv_admin_version)
+
+
+    def _read_piv_admin_version(self) -> bool:
+        """ Select the PIV admin applet & get the applet version """
+        return self._piv_admin_result(*self._batch(self._piv_admin_apdus()))
+
+    def _piv_admin_apdus(self) -> list:
+        return [self._select_apdu(AID_PIV_ADMIN), self._get_data_apdu(b"\xDF\x30")]
+
+    def _piv_admin_result(self, select, data) -> bool:
+        if( select[1:] != SW_SUCCESS ):
+            return False
+        if (ret := self._get_data_result(b"\xDF\x30", data))[0]:
+            self.pki_version = ret[1][3:]
+            self._is_thales_device  = True
+            return True
+        return False
+
+    def _defer(self, step) -> None:
+        """ The step failed: it is retried once the rest of the discovery is done """
+        if( step not in self._deferred ):
+            self._deferred.append(step)
+
+    def _settle_model(self) -> str:
+        if( self._model_name ):
+            return self._model_name
+        try:
+            return bytes(self._conn.getATR()).hex()
+        except Exception:
+            return self._reader
 
+    def _run_deferred(self) -> None:
+        """ Retries the failed steps, waiting for the device to settle """
+        model = self._settle_model()
+        while( self._deferred ):
+            step = self._deferred.pop(0)
+            def attempt():
+                with self.transaction(Priority.BACKGROUND):
+                    return step()
+            self.settle_policy.retry(model, attempt)
 
-    def close(self) -> None:
-        self._conn.disconnect()
 
 
     def _read_file(self, file_id, le = 0x00) -> Tuple[bool, bytes]:
         """ Reads a specific file from the device, returns True if successful """
-        
-        # Select File 
-        resp, sw1, sw2 = self._conn.transmit(list(APDU_SELECT_FILE + struct.pack("!B", len(file_id)) + file_id))
-        if (sw1, sw2) != SW_SUCCESS:
-            logging.debug("Error ["+hex(sw1)+","+hex(sw2)+"] after sending APDU")
-            return False, None
+        with self.transaction():
+            # Select File 
+            resp, sw1, sw2 = self._exchange(APDU_SELECT_FILE + struct.pack("!B", len(file_id)) + file_id)
+            if (sw1, sw2) != SW_SUCCESS:
+                logging.debug("Error ["+hex(sw1)+","+hex(sw2)+"] after sending APDU")
+                return False, None
 
-        # Read binary
-        resp, sw1, sw2 = self._conn.transmit(list(APDU_READ_BINARY + struct.pack("!B", le)))
-        if( sw1 == 0x6C ) and ( le == 0x00 ):
-            return self._read_file(file_id, sw2)
-        if (sw1, sw2) != SW_SUCCESS:
-            logging.debug("Error ["+hex(sw1)+","+hex(sw2)+"] after sending APDU")
-            return False, None
-        
-        return True, bytes(resp)
+            # Read binary
+            resp, sw1, sw2 = self._exchange(APDU_READ_BINARY + struct.pack("!B", le))
+            if( sw1 == 0x6C ) and ( le == 0x00 ):
+                return self._read_file(file_id, sw2)
+            if (sw1, sw2) != SW_SUCCESS:
+                logging.debug("Error ["+hex(sw1)+","+hex(sw2)+"] after sending APDU")
+                return False, None
+
+            return True, bytes(resp)
     
 
-    def _get_data(self, data_id , le = 0x00 ) -> Tuple[bool, bytes]:
+    def _read_file_apdus(self, file_id, le = 0x00) -> list:
+        return [APDU_SELECT_FILE + struct.pack("!B", len(file_id)) + file_id, APDU_READ_BINARY + struct.pack("!B", le)]
+
+    def _read_file_result(self, file_id, select, read) -> Tuple[bool, bytes]:
+        """ Result of the _read_file_apdus batch; reads again with the right length on 6C """
+        if( select[1:] != SW_SUCCESS ):
+            return False, None
+        if( read[1] == 0x6C ):
+            return self._read_file(file_id, read[2])
+        if( read[1:] != SW_SUCCESS ):
+            return False, None
+        return True, read[0]
+
+
+    def _get_data_apdu(self, data_id, le = 0x00) -> bytes:
         if( self.pki_applet == PkiApplet.IDPRIME_930 ) or ( self.pki_applet == PkiApplet.IDPRIME_940 ) or ( self.pki_applet == PkiApplet.IDPRIME ):
-            apdu = APDU_IDP_GET_DATA + data_id + struct.pack("!B", le)
-        else:
-            apdu = APDU_PIV_GET_DATA + data_id + struct.pack("!B", le)
+            return APDU_IDP_GET_DATA + data_id + struct.pack("!B", le)
+        return APDU_PIV_GET_DATA + data_id + struct.pack("!B", le)
+
+    def _get_data_result(self, data_id, resp) -> Tuple[bool, bytes]:
+        if( resp[1] == 0x6C ):
+            return self._get_data(data_id, resp[2])
+        return resp[1:] == SW_SUCCESS, resp[0]
 
-        resp, sw1, sw2 = self._conn.transmit(list(apdu))
+    def _get_data(self, data_id , le = 0x00 ) -> Tuple[bool, bytes]:
+        resp, sw1, sw2 = self._exchange(self._get_data_apdu(data_id, le))
         if( sw1 == 0x6C ) and ( le == 0x00 ):
             return self._get_data(data_id, sw2)
         if (sw1, sw2) != SW_SUCCESS:
@@ -208,42 +528,237 @@ class PcscThalesDevice(ThalesDevice, CtapPcscDevice):
         return True, bytes(resp)
 
 
+    def _container_apdu(self, data_id) -> bytes:
+        return APDU_GET_CONTAINER + struct.pack("!B", len(data_id)) + data_id + b"\x00"
+
     def _get_container_data(self, data_id ) -> Tuple[bool, bytes]:
-        apdu = APDU_GET_CONTAINER + struct.pack("!B", len(data_id)) + data_id + b"\x00"
-        return self._transmit(list(apdu))
+        return self._transmit(list(self._container_apdu(data_id)))
     
     
+    def _select_apdu(self, aid) -> bytes:
+        return APDU_SELECT + struct.pack("!B", len(aid)) + aid
+
     def _select_by_aid(self, aid) -> bool:
         """ Selects an applet by its AID, returns True if successful """
-        apdu = APDU_SELECT + struct.pack("!B", len(aid)) + aid
-        return self._transmit(list(apdu))[0]
+        return self._transmit(list(self._select_apdu(aid)))[0]
         
+    def _exchange(self, data):
+        """ Sends one APDU of the discovery, enforcing apdu_timeout """
+        self._touch()
+        start = time.monotonic()
+        resp, sw1, sw2 = self._conn.transmit(list(data), self._protocol)
+        if( self.apdu_timeout != None ) and ( time.monotonic() - start > self.apdu_timeout ):
+            raise ApduTimeout(f"APDU took {time.monotonic() - start:.3f}s on {self._reader}")
+        return resp, sw1, sw2
+
+    def _batch(self, apdus, first_success = False) -> list:
+        """ Sends independent APDUs of a discovery plan, returns [(resp, sw1, sw2)].
+            The transports supporting it (transmit_batch, e.g. RemoteTransport) get the
+            whole plan in one round-trip. With first_success, stops at the first 9000.
+        """
+        self._touch()
+        transmit_batch = getattr(self._conn, "transmit_batch", None)
+        if( transmit_batch != None ):
+            start = time.monotonic()
+            try:
+                out = [(bytes(resp), sw1, sw2) for resp, sw1, sw2 in transmit_batch([list(apdu) for apdu in apdus], self._protocol, first_success)]
+            except Exception as e:
+                logging.debug("APDU batch failed on %s %r", self._reader, e)
+                return [(b"", 0x00, 0x00)] * len(apdus)
+            if( self.apdu_timeout != None ) and ( time.monotonic() - start > self.apdu_timeout * len(apdus) ):
+                raise ApduTimeout(f"APDU batch took {time.monotonic() - start:.3f}s on {self._reader}")
+            return out
+
+        out = []
+        for apdu in apdus:
+            try:
+                resp, sw1, sw2 = self._exchange(apdu)
+            except ApduTimeout:
+                raise
+            except Exception:
+                resp, sw1, sw2 = [], 0x00, 0x00
+            out.append((bytes(resp), sw1, sw2))
+            if( first_success ) and ( (sw1, sw2) == SW_SUCCESS ):
+                break
+        return out
+
     def _transmit(self, data, le = 0x00 ) -> Tuple[bool, bytes]:
         try:
-            resp, sw1, sw2 = self._conn.transmit(list(data))
+            resp, sw1, sw2 = self._exchange(data)
             if (sw1, sw2) != SW_SUCCESS:
                 return False, None
             return True, bytes(resp)
+        except ApduTimeout:
+            raise
         except:
             return False, None
 
     @classmethod
-    def list_devices(cls, fido_only=False, thales_only = True, pcsc_reader: str = "", serial_number = None) -> Iterator[CtapPcscDevice] : # type: ignore
-        for reader in _list_readers():
-            if(pcsc_reader) and (pcsc_reader not in reader.name):
+    def list_devices(cls, fido_only=False, thales_only = True, pcsc_reader: str = "", serial_number = None, correlate: dict = None,
+                     timeout: float = None, apdu_timeout: float = None, reports: list = None, health: ReaderHealth = None,
+                     fast_path: bool = True) -> Iterator[CtapPcscDevice] : # type: ignore
+        """ Probes the readers in parallel and yields the devices as their discovery completes.
+
+            timeout:      deadline of the whole scan (seconds, default scan_timeout); readers still busy are reported & abandoned
+            apdu_timeout: aborts the discovery of a device which answers an APDU too slowly
+            reports:      list receiving one ReaderReport per reader
+            health:       reader latency/failure tracking; quarantined readers are skipped
+            fast_path:    reads the state & ATR of all the readers first, and only connects to the
+                          readers holding a card which was not already rejected
+        """
+        health  = health or default_health
+        timeout = cls.scan_timeout if timeout is None else timeout
+        done    = queue.Queue()
+        probes  = []
+
+        readers = [reader for reader in _list_readers() if (not pcsc_reader) or (pcsc_reader in reader.name)]
+        states  = _reader_states([reader.name for reader in readers]) if fast_path else None
+        for reader in health.order(readers):
+            if( health.is_quarantined(reader.name) ):
+                cls._report(reports, ReaderReport(reader.name, ReaderReport.QUARANTINED))
                 continue
-            try:
-                dev = cls(reader.createConnection(), reader.name)
-                close = True
+
+            slot = None
+            if( states != None ) and ( reader.name in states ):
+                state, atr = states[reader.name]
+                slot = (state >> 16, atr)
+                present = bool(state & SCARD_STATE_PRESENT) and not (state & SCARD_STATE_MUTE)
+                known_atr = any(entry.isValid(atr) for entry in ATRs) if atr else False
+                reason = cls.presence_cache.skip_reason(reader.name, present, slot[0], atr, thales_only, known_atr)
+                if( reason != None ):
+                    cls._report(reports, ReaderReport(reader.name, ReaderReport.SKIPPED, error = reason))
+                    continue
+
+            probe = _ReaderProbe(cls, reader, correlate, apdu_timeout, done, slot)
+            probe.start()
+            probes.append(probe)
+
+        deadline = None if timeout == None else time.monotonic() + timeout
+        pending  = len(probes)
+        expired  = False
+        try:
+            while( pending > 0 ):
+                try:
+                    probe = done.get(block = not expired, timeout = None if deadline == None else max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    if( expired ):
+                        break
+                    # Deadline reached: abandon the readers still busy, their device is closed when the probe ends
+                    expired = True
+                    for probe in probes:
+                        if( probe.abandon() ):
+                            pending -= 1
+                            health.record(probe.reader.name, time.monotonic() - probe.start_time, False, timeout = True)
+                            cls._report(reports, ReaderReport(probe.reader.name, ReaderReport.TIMEOUT, time.monotonic() - probe.start_time))
+                    continue
+                pending -= 1
+                if( probe.no_card ):
+                    # An empty reader is not a failing reader
+                    cls._report(reports, ReaderReport(probe.reader.name, ReaderReport.SKIPPED, probe.duration, "empty"))
+                    continue
+                health.record(probe.reader.name, probe.duration, probe.error is None)
+
+                dev = probe.device
+                if( dev is None ):
+                    cls._report(reports, ReaderReport(probe.reader.name, ReaderReport.ERROR, probe.duration, probe.error))
+                    continue
+
+                if( dev.twin is not None ):
+                    # Already listed through HID: expose this transport through the HID device
+                    dev.twin.attach_pcsc(dev)
+                    cls._report(reports, ReaderReport(probe.reader.name, ReaderReport.MERGED, probe.duration, serial_number = dev.serial_number))
+                    continue
+
+                status = ReaderReport.REJECTED
                 if(not thales_only) or (dev.is_thales_device and thales_only):
                     if(not serial_number) or (dev.serial_number == serial_number):
                         if(not fido_only) or (dev.has_fido_accessible):
-                            close = False
-                            yield dev
-                if( close ):
+                            status = ReaderReport.OK
+                cls._report(reports, ReaderReport(probe.reader.name, status, probe.duration, serial_number = dev.serial_number))
+
+                # Only the cards which are not Thales are skipped while they stay in their reader:
+                # the other filters (S/N, FIDO) change from one scan to the other
+                if( probe.slot != None ) and ( not dev.is_thales_device ):
+                    cls.presence_cache.rejected(probe.reader.name, probe.slot[0], probe.slot[1])
+                else:
+                    cls.presence_cache.accepted(probe.reader.name)
+
+                if( status == ReaderReport.OK ):
+                    yield dev
+                else:
                     dev.close()
-            except Exception as e:
-                pass
+        finally:
+            # The caller stopped iterating early (or the scan failed): close the
+            # devices not yielded, now or when their probe ends
+            for probe in probes:
+                probe.abandon()
+            while True:
+                try:
+                    probe = done.get_nowait()
+                except queue.Empty:
+                    break
+                if( probe.device is not None ):
+                    probe.device.close()
+
+    @staticmethod
+    def _report(reports, report: ReaderReport):
+        if( report.status in (ReaderReport.ERROR, ReaderReport.TIMEOUT) ):
+            logging.warning("PCSC reader %s: %s %s", report.reader, report.status, report.error or "")
+        if( reports != None ):
+            reports.append(report)
+
+
+class _ReaderProbe(threading.Thread):
+    """ Discovery of the device of one reader, in its own thread so a wedged reader cannot stall the scan """
+
+    def __init__(self, cls, reader, correlate, apdu_timeout, done: queue.Queue, slot = None):
+        super().__init__(name = f"probe-{reader.name}", daemon = True)
+        self.cls            = cls
+        self.reader         = reader
+        self.correlate      = correlate
+        self.apdu_timeout   = apdu_timeout
+        self.done           = done
+        self.slot           = slot
+        self.device         = None
+        self.error          = None
+        self.no_card        = False
+        self.duration       = 0.0
+        self.start_time     = time.monotonic()
+        self._lock          = threading.Lock()
+        self._finished      = False
+        self._abandoned     = False
+
+    def run(self):
+        conn = None
+        try:
+            conn = self.reader.createConnection()
+            self.device = self.cls(conn, self.reader.name, correlate = self.correlate, apdu_timeout = self.apdu_timeout)
+        except Exception as e:
+            self.error = repr(e)
+            self.no_card = isinstance(e, NoCardException)
+            if( conn is not None ):
+                try:
+                    conn.disconnect()
+                except Exception:
+                    pass
+        self.duration = time.monotonic() - self.start_time
+
+        with self._lock:
+            self._finished = True
+            if( self._abandoned ):
+                # Nobody waits for this device anymore
+                if( self.device is not None ):
+                    self.device.close()
+                return
+            self.done.put(self)
+
+    def abandon(self) -> bool:
+        """ Returns True if the probe was still running """
+        with self._lock:
+            if( self._finished ):
+                return False
+            self._abandoned = True
+            return True
 
 
 #******************************************************************************
@@ -0,0 +1,195 @@
+#Copyright 2025 Thales
+#
+# Redistribution and use in source and binary forms, with or 
+# without modification, are permitted provided that the following 
+# conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+# 
+# 3. Neither the name of the copyright holder nor the names of its 
+#    contributors may be used to endorse or promote products derived from 
+#    this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS 
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT 
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR 
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT 
+# HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, 
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED 
+# TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR 
+# PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF 
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING 
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS 
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.  
+
+import time
+import threading
+from collections import deque
+from typing import Dict, Optional
+
+
+class ReaderReport():
+    """ Outcome of the probing of one PCSC reader during a scan """
+
+    OK          = "ok"            # A device was returned
+    REJECTED    = "rejected"      # A card was found but filtered out (not Thales, no FIDO, S/N...)
+    MERGED      = "merged"        # Same token as a HID device (see scan_devices merge)
+    ERROR       = "error"         # The discovery raised an exception
+    TIMEOUT     = "timeout"       # The reader did not answer before the deadline
+    QUARANTINED = "quarantined"   # Skipped: the reader failed recently
+    SKIPPED     = "skipped"       # Skipped: empty reader, or unchanged card already rejected
+
+    def __init__(self, reader: str, status: str, duration: float = 0.0, error: Optional[str] = None, serial_number = None):
+        self.reader         = reader
+        self.status         = status
+        self.duration       = duration
+        self.error          = error
+        self.serial_number  = serial_number
+
+    def __repr__(self):
+        out = f"ReaderReport({self.reader!r}, {self.status}, {self.duration * 1000:.1f} ms"
+        if( self.error ):
+            out += f", {self.error}"
+        return out + ")"
+
+    def to_dict(self) -> dict:
+        return {
+            "reader":        self.reader,
+            "status":        self.status,
+            "duration":      self.duration,
+            "error":         self.error,
+            "serial_number": self.serial_number,
+        }
+
+
+class _ReaderState():
+    def __init__(self, window):
+        self.latency            = None
+        self.outcomes           = deque(maxlen=window)
+        self.quarantine_until   = 0.0
+        self.quarantine_count   = 0
+
+
+class ReaderHealth():
+    """ Tracks the latency & failure rate of each reader.
+
+        A reader which times out, or fails more than max_failure_rate of its
+        recent probes, is quarantined: it is skipped by the next scans during
+        quarantine_time seconds (doubled on each new quarantine, up to
+        max_quarantine_time). A successful probe clears the quarantine.
+    """
+
+    def __init__(self, window: int = 10, max_failure_rate: float = 0.5, quarantine_time: float = 30.0,
+                 max_quarantine_time: float = 600.0, smoothing: float = 0.3):
+        self.window                 = window
+        self.max_failure_rate       = max_failure_rate
+        self.quarantine_time        = quarantine_time
+        self.max_quarantine_time    = max_quarantine_time
+        self.smoothing              = smoothing
+        self._lock                  = threading.Lock()
+        self._readers: Dict[str, _ReaderState] = {}
+
+    def _state(self, reader) -> _ReaderState:
+        state = self._readers.get(reader)
+        if( state == None ):
+            state = self._readers[reader] = _ReaderState(self.window)
+        return state
+
+    def record(self, reader: str, duration: float, ok: bool, timeout: bool = False) -> None:
+        with self._lock:
+            state = self._state(reader)
+            state.outcomes.append(ok)
+            if( state.latency == None ):
+                state.latency = duration
+            else:
+                state.latency += self.smoothing * (duration - state.latency)
+
+            if( ok ):
+                state.quarantine_until = 0.0
+                state.quarantine_count = 0
+                return
+
+            failures = state.outcomes.count(False)
+            if( timeout ) or ( len(state.outcomes) >= 2 and failures / len(state.outcomes) > self.max_failure_rate ):
+                period = min(self.quarantine_time * (2 ** state.quarantine_count), self.max_quarantine_time)
+                state.quarantine_until = time.monotonic() + period
+                state.quarantine_count += 1
+
+    def is_quarantined(self, reader: str) -> bool:
+        with self._lock:
+            state = self._readers.get(reader)
+            return state != None and state.quarantine_until > time.monotonic()
+
+    def release(self, reader: str = None) -> None:
+        """ Clears the quarantine of one reader (or all) """
+        with self._lock:
+            for name, state in self._readers.items():
+                if( reader == None ) or ( name == reader ):
+                    state.quarantine_until = 0.0
+                    state.quarantine_count = 0
+
+    def order(self, readers, key = lambda reader: reader.name) -> list:
+        """ Sorts the readers: the reliable & fast ones first """
+        with self._lock:
+            def rank(reader):
+                state = self._readers.get(key(reader))
+                if( state == None ) or ( not state.outcomes ):
+                    return (0.0, 0.0)
+                return (state.outcomes.count(False) / len(state.outcomes), state.latency or 0.0)
+            return sorted(readers, key=rank)
+
+    def stats(self) -> dict:
+        with self._lock:
+            now = time.monotonic()
+            return {
+                name: {
+                    "latency":      state.latency,
+                    "failure_rate": state.outcomes.count(False) / len(state.outcomes) if state.outcomes else 0.0,
+                    "quarantined":  max(0.0, state.quarantine_until - now),
+                } for name, state in self._readers.items()
+            }
+
+
+# Health shared by all the scans of the process
+default_health = ReaderHealth()
+
+
+class CardPresenceCache():
+    """ Remembers the non Thales cards seen by the previous scans in each reader, so
+        the readers can be filtered on their state & ATR before connecting to them.
+        A rejection only holds while the same card stays in the same reader (the
+        reader event counter & ATR are unchanged): removing & inserting it again,
+        or the same model in another reader, is probed again.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._rejected_slots: Dict[str, tuple] = {}
+
+    def skip_reason(self, reader: str, present: bool, counter: int, atr: bytes, thales_only: bool = True, known_atr: bool = False) -> Optional[str]:
+        """ Returns why the reader does not need to be probed, None if it must be """
+        if( not present ):
+            return "empty"
+        if( not thales_only ) or ( known_atr ):
+            return None
+        with self._lock:
+            if( self._rejected_slots.get(reader) == (counter, atr) ):
+                return "unchanged card already rejected"
+        return None
+
+    def rejected(self, reader: str, counter: int, atr: bytes) -> None:
+        with self._lock:
+            self._rejected_slots[reader] = (counter, atr)
+
+    def accepted(self, reader: str) -> None:
+        with self._lock:
+            self._rejected_slots.pop(reader, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._rejected_slots.clear()
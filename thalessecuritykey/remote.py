@@ -0,0 +1,310 @@
+#Copyright 2025 Thales
+#
+# Redistribution and use in source and binary forms, with or 
+# without modification, are permitted provided that the following 
+# conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+# 
+# 3. Neither the name of the copyright holder nor the names of its 
+#    contributors may be used to endorse or promote products derived from 
+#    this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS 
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT 
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR 
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT 
+# HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, 
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED 
+# TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR 
+# PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF 
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING 
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS 
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.  
+
+import socket
+import socketserver
+import threading
+import time
+import logging
+from typing import Callable, Dict, List, Optional, Tuple
+
+from .wire import send_message, recv_message
+
+
+# APDU transport to a reader attached to another host.
+#
+# RemoteTransport has the interface of a pyscard CardConnection (connect,
+# disconnect, getATR, transmit), so it can be given to PcscThalesDevice.
+# transmit_batch() sends several APDUs in one round-trip: the server
+# executes them in order (inside a PCSC transaction when possible) and
+# returns all the responses. With first_success, the server stops at the
+# first APDU answering 9000 (e.g. a list of applets to try).
+#
+# The protocol is plaintext and unauthenticated: any client reaching the
+# server can send APDUs to its cards. ApduServer listens on the loopback by
+# default; to serve another host, go through a tunnel (SSH, TLS proxy) or a
+# trusted network only.
+
+
+class RemoteError(Exception):
+    """ Error returned by the APDU server """
+
+
+def _execute_batch(conn, apdus, protocol = None, first_success = False) -> list:
+    out = []
+    for apdu in apdus:
+        resp, sw1, sw2 = conn.transmit(list(apdu), protocol)
+        out.append((list(resp), sw1, sw2))
+        if( first_success ) and ( (sw1, sw2) == (0x90, 0x00) ):
+            break
+    return out
+
+
+def _begin_transaction(conn):
+    """ Runs the batch in an exclusive PCSC transaction when the connection supports it """
+    hcard = getattr(getattr(conn, "component", conn), "hcard", None)
+    if( not isinstance(hcard, int) ):
+        return None
+    try:
+        from smartcard.scard import SCardBeginTransaction, SCARD_S_SUCCESS
+    except ImportError:
+        return None
+    return hcard if SCardBeginTransaction(hcard) == SCARD_S_SUCCESS else None
+
+
+def _end_transaction(hcard):
+    from smartcard.scard import SCardEndTransaction, SCARD_LEAVE_CARD
+    SCardEndTransaction(hcard, SCARD_LEAVE_CARD)
+
+
+#******************************************************************************
+# Server side: exposes the local readers
+
+class ApduServer():
+    """ Serves the local readers to RemoteTransport clients over TCP.
+
+        host:    listening address, the loopback by default (no authentication, see above).
+        readers: {name: function returning a CardConnection}; by default the
+                 PCSC readers of the host.
+        latency: artificial delay added to each reply (seconds), to test over loopback.
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, readers: Dict[str, Callable] = None, latency: float = 0.0):
+        if( host not in ("127.0.0.1", "::1", "localhost") ):
+            logging.warning("APDU server listening on %s: unauthenticated access to the local readers", host)
+        self._readers   = readers
+        self.latency    = latency
+        self._server    = _ApduTcpServer((host, port), self)
+        self._thread    = None
+
+    @property
+    def address(self) -> Tuple[str, int]:
+        return self._server.server_address[:2]
+
+    def readers(self) -> Dict[str, Callable]:
+        if( self._readers != None ):
+            return self._readers
+        from fido2.pcsc import _list_readers
+        return {reader.name: reader.createConnection for reader in _list_readers()}
+
+    def start(self) -> "ApduServer":
+        self._thread = threading.Thread(target=self._server.serve_forever, name="apdu-server", daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self) -> None:
+        self._server.serve_forever()
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, typ, value, traceback):
+        self.stop()
+
+    def dispatch(self, session: dict, message: dict) -> dict:
+        op = message.get("op")
+        if( op == "readers" ):
+            return {"ok": True, "readers": list(self.readers())}
+
+        if( op == "open" ):
+            factory = self.readers().get(message.get("reader"))
+            if( factory == None ):
+                raise RemoteError(f"Unknown reader {message.get('reader')}")
+            session["conn"] = factory()
+            return {"ok": True}
+
+        conn = session.get("conn")
+        if( conn == None ):
+            raise RemoteError("No reader opened")
+
+        if( op == "connect" ):
+            conn.connect(message.get("protocol"))
+            return {"ok": True}
+        if( op == "disconnect" ):
+            conn.disconnect()
+            return {"ok": True}
+        if( op == "atr" ):
+            return {"ok": True, "atr": bytes(conn.getATR() or []).hex()}
+        if( op == "batch" ):
+            apdus = [bytes.fromhex(apdu) for apdu in message["apdus"]]
+            hcard = _begin_transaction(conn)
+            try:
+                out = _execute_batch(conn, apdus, message.get("protocol"), message.get("first_success", False))
+            finally:
+                if( hcard != None ):
+                    _end_transaction(hcard)
+            return {"ok": True, "responses": [[bytes(resp).hex(), sw1, sw2] for resp, sw1, sw2 in out]}
+
+        raise RemoteError(f"Unknown operation {op}")
+
+
+class _ApduHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        apdu_server = self.server.apdu_server
+        session = {}
+        try:
+            while (message := recv_message(self.rfile)) != None:
+                try:
+                    reply = apdu_server.dispatch(session, message)
+                except Exception as e:
+                    reply = {"ok": False, "error": str(e)}
+                if( apdu_server.latency ):
+                    time.sleep(apdu_server.latency)
+                send_message(self.wfile, reply)
+        finally:
+            if( session.get("conn") != None ):
+                try:
+                    session["conn"].disconnect()
+                except Exception:
+                    pass
+
+
+class _ApduTcpServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, apdu_server: ApduServer):
+        self.apdu_server = apdu_server
+        super().__init__(address, _ApduHandler)
+
+
+#******************************************************************************
+# Client side
+
+class RemoteTransport():
+    """ CardConnection-like access to a reader of an ApduServer.
+        The TCP session lives from connect() to disconnect(). """
+
+    def __init__(self, address: Tuple[str, int], reader: str, timeout: Optional[float] = None):
+        self.address        = address
+        self.reader         = reader
+        self.timeout        = timeout
+        self.round_trips    = 0
+        self._lock          = threading.Lock()
+        self._sock          = None
+        self._stream        = None
+
+    def __repr__(self):
+        return f"RemoteTransport({self.address}, {self.reader!r})"
+
+    @property
+    def component(self):
+        return self
+
+    @property
+    def hcard(self):
+        """ Not a PCSC handle: the server runs the batches in a transaction itself """
+        return self.reader if self._sock != None else None
+
+    def _request(self, op, **kwargs) -> dict:
+        with self._lock:
+            if( self._stream == None ):
+                raise ConnectionError("Remote reader not connected")
+            send_message(self._stream, dict(op=op, **kwargs))
+            reply = recv_message(self._stream)
+            self.round_trips += 1
+        if( reply == None ):
+            raise ConnectionError("APDU server closed the connection")
+        if( not reply.get("ok") ):
+            raise RemoteError(reply.get("error"))
+        return reply
+
+    def connect(self, protocol = None, mode = None, disposition = None) -> None:
+        if( self._sock == None ):
+            self._sock = socket.create_connection(self.address, self.timeout)
+            self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self._stream = self._sock.makefile("rwb")
+        try:
+            self._request("open", reader=self.reader)
+            self._request("connect", protocol=protocol)
+        except:
+            self.disconnect()
+            raise
+
+    def disconnect(self) -> None:
+        if( self._sock == None ):
+            return
+        try:
+            self._request("disconnect")
+        except Exception:
+            pass
+        self._stream.close()
+        self._sock.close()
+        self._stream = None
+        self._sock = None
+
+    close = disconnect
+
+    def getATR(self) -> List[int]:
+        return list(bytes.fromhex(self._request("atr")["atr"]))
+
+    def transmit(self, apdu, protocol = None) -> Tuple[List[int], int, int]:
+        return self.transmit_batch([apdu], protocol)[0]
+
+    def transmit_batch(self, apdus, protocol = None, first_success: bool = False) -> List[Tuple[List[int], int, int]]:
+        """ Sends all the APDUs in one round-trip. With first_success, stops at the first 9000 """
+        reply = self._request("batch", apdus=[bytes(apdu).hex() for apdu in apdus], protocol=protocol, first_success=first_success)
+        return [(list(bytes.fromhex(resp)), sw1, sw2) for resp, sw1, sw2 in reply["responses"]]
+
+
+def list_remote_readers(address: Tuple[str, int], timeout: Optional[float] = None) -> List[str]:
+    with socket.create_connection(address, timeout) as sock:
+        stream = sock.makefile("rwb")
+        send_message(stream, {"op": "readers"})
+        reply = recv_message(stream)
+    if( reply == None ) or ( not reply.get("ok") ):
+        raise RemoteError(reply.get("error") if reply else "APDU server closed the connection")
+    return reply["readers"]
+
+
+def list_remote_devices(address: Tuple[str, int], fido_only = False, thales_only = True, serial_number = None, timeout: Optional[float] = None):
+    """ PcscThalesDevice of each reader of an ApduServer """
+    from .pcsc import PcscThalesDevice
+
+    for reader in list_remote_readers(address, timeout):
+        try:
+            dev = PcscThalesDevice(RemoteTransport(address, reader, timeout), reader)
+        except Exception as e:
+            logging.debug("Remote reader %s: %r", reader, e)
+            continue
+        if( thales_only ) and ( not dev.is_thales_device ):
+            dev.close()
+            continue
+        if( serial_number ) and ( dev.serial_number != serial_number ):
+            dev.close()
+            continue
+        if( fido_only ) and ( not dev.has_fido_accessible ):
+            dev.close()
+            continue
+        yield dev
@@ -0,0 +1,144 @@
+#Copyright 2025 Thales
+#
+# Redistribution and use in source and binary forms, with or 
+# without modification, are permitted provided that the following 
+# conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+# 
+# 3. Neither the name of the copyright holder nor the names of its 
+#    contributors may be used to endorse or promote products derived from 
+#    this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS 
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT 
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR 
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT 
+# HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, 
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED 
+# TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR 
+# PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF 
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING 
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS 
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.  
+
+import heapq
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+from .const import Priority
+
+
+class DeviceScheduler():
+    """ Serializes the access to one device.
+
+        Only one thread at a time can talk to the device. Waiting requests are
+        served by priority class (INTERACTIVE before BACKGROUND), then in
+        arrival order. The lock is reentrant for the owning thread so a
+        discovery sequence can call the low level transmit methods.
+    """
+
+    def __init__(self, name = None):
+        self._name      = name
+        self._cond      = threading.Condition()
+        self._owner     = None
+        self._depth     = 0
+        self._waiting   = []
+        self._sequence  = itertools.count()
+
+        # Metrics
+        self._max_queue_depth = 0
+        self._acquired  = {p: 0 for p in Priority}
+        self._wait_total= {p: 0.0 for p in Priority}
+        self._wait_max  = {p: 0.0 for p in Priority}
+
+    def __repr__(self):
+        return f"DeviceScheduler({self._name}, depth={self.queue_depth})"
+
+    @property
+    def queue_depth(self) -> int:
+        """ Number of requests waiting for the device """
+        return len(self._waiting)
+
+    @property
+    def is_busy(self) -> bool:
+        return self._owner != None
+
+    def acquire(self, priority: Priority = Priority.INTERACTIVE, timeout: Optional[float] = None) -> bool:
+        """ Waits for the device, returns False if the timeout expired """
+        me = threading.get_ident()
+        with self._cond:
+            if( self._owner == me ):
+                self._depth += 1
+                return True
+
+            start   = time.monotonic()
+            ticket  = (priority.value, next(self._sequence), me)
+            heapq.heappush(self._waiting, ticket)
+            self._max_queue_depth = max(self._max_queue_depth, len(self._waiting))
+
+            deadline = None if timeout == None else start + timeout
+            while( self._owner != None ) or ( self._waiting[0] != ticket ):
+                remaining = None if deadline == None else deadline - time.monotonic()
+                if( remaining != None ) and ( remaining <= 0 ):
+                    self._waiting.remove(ticket)
+                    heapq.heapify(self._waiting)
+                    # The head of the queue may have changed
+                    self._cond.notify_all()
+                    return False
+                self._cond.wait(remaining)
+
+            heapq.heappop(self._waiting)
+            self._owner = me
+            self._depth = 1
+
+            waited = time.monotonic() - start
+            self._acquired[priority]   += 1
+            self._wait_total[priority] += waited
+            self._wait_max[priority]    = max(self._wait_max[priority], waited)
+            return True
+
+    def release(self) -> None:
+        with self._cond:
+            if( self._owner != threading.get_ident() ):
+                raise RuntimeError("Device scheduler released by a thread which does not own it")
+            self._depth -= 1
+            if( self._depth == 0 ):
+                self._owner = None
+                self._cond.notify_all()
+
+    @contextmanager
+    def session(self, priority: Priority = Priority.INTERACTIVE, timeout: Optional[float] = None):
+        """ Context manager holding the device for a sequence of commands """
+        if( not self.acquire(priority, timeout) ):
+            raise TimeoutError(f"Device {self._name} is busy")
+        try:
+            yield self
+        finally:
+            self.release()
+
+    def stats(self) -> dict:
+        """ Returns queue depth and wait time metrics, per priority class """
+        with self._cond:
+            out = {
+                "queue_depth":      len(self._waiting),
+                "max_queue_depth":  self._max_queue_depth,
+                "busy":             self._owner != None,
+            }
+            for p in Priority:
+                name = p.name.lower()
+                count = self._acquired[p]
+                out[name] = {
+                    "count":    count,
+                    "wait_avg": self._wait_total[p] / count if count else 0.0,
+                    "wait_max": self._wait_max[p],
+                }
+            return out
@@ -0,0 +1,107 @@
+#Copyright 2025 Thales
+#
+# Redistribution and use in source and binary forms, with or 
+# without modification, are permitted provided that the following 
+# conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+# 
+# 3. Neither the name of the copyright holder nor the names of its 
+#    contributors may be used to endorse or promote products derived from 
+#    this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS 
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT 
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR 
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT 
+# HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, 
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED 
+# TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR 
+# PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF 
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING 
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS 
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.  
+
+import time
+import threading
+import logging
+from typing import Callable, Dict
+
+
+class SettlePolicy():
+    """ Retry policy of the discovery steps which fail just after inserting a device
+        (e.g. the PIV admin SELECT when SAC is enabled).
+
+        Only the failed step is issued again. The first delay is learned per model
+        from the time the previous devices took to answer, then it doubles up to
+        max_delay, and it stops after max_wait seconds. A model whose step never
+        succeeds after max_failures devices is not retried during give_up_time
+        seconds; the next device after that is retried once more.
+    """
+
+    def __init__(self, first_delay: float = 0.1, max_delay: float = 1.0, max_wait: float = 3.0,
+                 max_failures: int = 3, smoothing: float = 0.5, give_up_time: float = 300.0):
+        self.first_delay    = first_delay
+        self.max_delay      = max_delay
+        self.max_wait       = max_wait
+        self.max_failures   = max_failures
+        self.smoothing      = smoothing
+        self.give_up_time   = give_up_time
+        self._lock          = threading.Lock()
+        self._learned: Dict[str, float] = {}
+        self._failures: Dict[str, int]  = {}
+        self._gave_up: Dict[str, float] = {}
+
+    def delay(self, model) -> float:
+        """ First delay to wait before retrying a step on this model """
+        with self._lock:
+            return self._learned.get(model, self.first_delay)
+
+    def gave_up(self, model) -> bool:
+        with self._lock:
+            return self._gave_up.get(model, 0.0) > time.monotonic()
+
+    def record(self, model, elapsed: float) -> None:
+        """ The step succeeded 'elapsed' seconds after the first failure """
+        with self._lock:
+            previous = self._learned.get(model)
+            if( previous == None ):
+                self._learned[model] = elapsed
+            else:
+                self._learned[model] = previous + self.smoothing * (elapsed - previous)
+            self._failures[model] = 0
+            self._gave_up.pop(model, None)
+
+    def retry(self, model, step: Callable[[], bool]) -> bool:
+        """ Calls step() until it returns True, returns False when the cap is reached """
+        if( self.gave_up(model) ):
+            return False
+
+        start = time.monotonic()
+        delay = min(self.delay(model), self.max_delay)
+        while( time.monotonic() - start + delay <= self.max_wait ):
+            time.sleep(delay)
+            if( step() ):
+                self.record(model, time.monotonic() - start)
+                return True
+            delay = min(delay * 2, self.max_delay)
+
+        logging.debug("Settle: step still failing after %.2fs on %s", time.monotonic() - start, model)
+        with self._lock:
+            self._failures[model] = self._failures.get(model, 0) + 1
+            if( self._failures[model] >= self.max_failures ):
+                self._gave_up[model] = time.monotonic() + self.give_up_time
+        return False
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"learned": dict(self._learned), "failures": dict(self._failures)}
+
+
+# Policy shared by all the devices, so the learned delays apply to the next insertions
+default_policy = SettlePolicy()
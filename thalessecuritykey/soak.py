@@ -0,0 +1,252 @@
+#Copyright 2025 Thales
+#
+# Redistribution and use in source and binary forms, with or 
+# without modification, are permitted provided that the following 
+# conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+# 
+# 3. Neither the name of the copyright holder nor the names of its 
+#    contributors may be used to endorse or promote products derived from 
+#    this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS 
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT 
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR 
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT 
+# HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, 
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED 
+# TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR 
+# PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF 
+# LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING 
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS 
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.  
+
+
+import gc
+import os
+import time
+import logging
+import tracemalloc
+from typing import Callable, List, Optional
+
+from . import handles
+
+
+# Endurance test of the scan loop.
+#
+# SoakHarness runs a cycle (insert, scan, close, remove) thousands of times
+# and samples, every 'sample_every' cycles, the latency percentiles of the
+# window, the RSS, the open file descriptors, the open device handles and the
+# memory traced by tracemalloc. The growth between the first sample after the
+# warmup and the last one is checked against the thresholds.
+
+
+class SoakFailure(AssertionError):
+    """ A resource grew more than its threshold during the soak test """
+
+
+def _rss() -> Optional[int]:
+    """ Resident set size of the process in bytes (Linux), None when unknown """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def _open_fds() -> Optional[int]:
+    for path in ("/proc/self/fd", "/dev/fd"):
+        try:
+            return len(os.listdir(path))
+        except OSError:
+            continue
+    return None
+
+
+def percentile(values: List[float], p: float) -> Optional[float]:
+    if( not values ):
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100.0 * (len(values) - 1))))]
+
+
+class SoakSample():
+    def __init__(self, cycle: int, latencies: List[float]):
+        self.cycle      = cycle
+        self.p50        = percentile(latencies, 50)
+        self.p95        = percentile(latencies, 95)
+        self.p99        = percentile(latencies, 99)
+        self.rss        = _rss()
+        self.fds        = _open_fds()
+        self.handles    = handles.registry.open
+        self.traced     = tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else None
+
+    def to_dict(self) -> dict:
+        return dict(self.__dict__)
+
+
+class SoakReport():
+    def __init__(self):
+        self.samples: List[SoakSample] = []
+        self.failures: List[str] = []
+        self.top_allocators: List[str] = []
+        self.errors     = 0
+        self.last_error = None
+        self.duration   = None
+
+    @property
+    def ok(self) -> bool:
+        return not self.failures
+
+    def check(self) -> "SoakReport":
+        """ Raises SoakFailure if a threshold was crossed """
+        if( self.failures ):
+            raise SoakFailure("; ".join(self.failures + self.top_allocators[:3]))
+        return self
+
+    def to_dict(self) -> dict:
+        return {"ok": self.ok, "failures": self.failures, "errors": self.errors, "last_error": self.last_error, "duration": self.duration,
+                "top_allocators": self.top_allocators, "samples": [s.to_dict() for s in self.samples]}
+
+
+class SoakHarness():
+    """ cycle: function run at each iteration (see hid_cycle, pcsc_cycle, scan_cycle).
+
+        Thresholds (None disables the check), growth from the first sample after the warmup:
+          max_memory_growth:  bytes traced by tracemalloc
+          max_rss_growth:     bytes of RSS
+          max_fd_growth:      open file descriptors
+          max_handle_growth:  open device handles (handles.registry)
+          max_latency_ratio:  p95 of the last window / p95 of the first window
+          max_errors:         cycles raising an exception (warmup included)
+    """
+
+    def __init__(self, cycle: Callable[[], None], cycles: int = 1000, sample_every: int = 100, warmup: int = 100,
+                 max_memory_growth: Optional[int] = 1 << 20, max_rss_growth: Optional[int] = 32 << 20,
+                 max_fd_growth: Optional[int] = 4, max_handle_growth: Optional[int] = 0,
+                 max_latency_ratio: Optional[float] = 3.0, max_errors: Optional[int] = 0, trace_frames: int = 10):
+        self.cycle              = cycle
+        self.cycles             = cycles
+        self.sample_every       = sample_every
+        self.warmup             = warmup
+        self.max_memory_growth  = max_memory_growth
+        self.max_rss_growth     = max_rss_growth
+        self.max_fd_growth      = max_fd_growth
+        self.max_handle_growth  = max_handle_growth
+        self.max_latency_ratio  = max_latency_ratio
+        self.max_errors         = max_errors
+        self.trace_frames       = trace_frames
+
+    def _run_cycles(self, count: int, report: SoakReport) -> List[float]:
+        latencies = []
+        for _ in range(count):
+            start = time.perf_counter()
+            try:
+                self.cycle()
+            except Exception as e:
+                report.errors += 1
+                report.last_error = repr(e)
+                logging.debug("Soak cycle failed %r", e)
+            latencies.append(time.perf_counter() - start)
+        return latencies
+
+    def _check(self, report: SoakReport, name: str, first, last, limit) -> None:
+        if( limit == None ) or ( first == None ) or ( last == None ):
+            return
+        if( last - first > limit ):
+            report.failures.append(f"{name} grew by {last - first} (limit {limit})")
+
+    def run(self) -> SoakReport:
+        report  = SoakReport()
+        started = not tracemalloc.is_tracing()
+        if( started ):
+            tracemalloc.start(self.trace_frames)
+        start = time.perf_counter()
+        try:
+            self._run_cycles(self.warmup, report)
+            gc.collect()
+            baseline = tracemalloc.take_snapshot()
+
+            done = 0
+            while( done < self.cycles ):
+                count = min(self.sample_every, self.cycles - done)
+                latencies = self._run_cycles(count, report)
+                done += count
+                gc.collect()
+                report.samples.append(SoakSample(self.warmup + done, latencies))
+
+            final = tracemalloc.take_snapshot()
+            filters = [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, __file__)]
+            stats = final.filter_traces(filters).compare_to(baseline.filter_traces(filters), "lineno")
+            report.top_allocators = [str(stat) for stat in stats[:10] if stat.size_diff > 0]
+        finally:
+            if( started ):
+                tracemalloc.stop()
+        report.duration = time.perf_counter() - start
+
+        if( self.max_errors != None ) and ( report.errors > self.max_errors ):
+            report.failures.append(f"{report.errors} cycles failed (limit {self.max_errors}), last {report.last_error}")
+
+        if( report.samples ):
+            first, last = report.samples[0], report.samples[-1]
+            self._check(report, "traced memory", first.traced, last.traced, self.max_memory_growth)
+            self._check(report, "RSS", first.rss, last.rss, self.max_rss_growth)
+            self._check(report, "open file descriptors", first.fds, last.fds, self.max_fd_growth)
+            self._check(report, "open device handles", first.handles, last.handles, self.max_handle_growth)
+            if( self.max_latency_ratio != None ) and ( first.p95 ) and ( last.p95 / first.p95 > self.max_latency_ratio ):
+                report.failures.append(f"p95 latency grew from {first.p95 * 1000:.3f}ms to {last.p95 * 1000:.3f}ms")
+        return report
+
+
+#******************************************************************************
+# Insert / scan / remove cycles on a simulated bus: the tokens are simulated
+# by the caller (e.g. example/simulation.py SimulatedBus), the library does
+# not ship them
+
+def hid_cycle(bus, tokens: int = 1) -> Callable[[], None]:
+    """ Inserts the tokens, lists them with CtapHidThalesDevice, closes & removes them """
+    from .hid import CtapHidThalesDevice
+
+    def cycle():
+        for _ in range(tokens):
+            bus.insert_hid()
+        with bus.install():
+            for dev in CtapHidThalesDevice.list_devices():
+                dev.close()
+        bus.remove_all()
+    return cycle
+
+
+def pcsc_cycle(bus, cards: int = 1) -> Callable[[], None]:
+    """ Inserts the cards, opens them with PcscThalesDevice, closes & removes them """
+    from .pcsc import PcscThalesDevice
+
+    def cycle():
+        for _ in range(cards):
+            bus.insert_card()
+        for reader in bus.list_readers():
+            PcscThalesDevice(reader.createConnection(), reader.name).close()
+        bus.remove_all()
+    return cycle
+
+
+def scan_cycle(bus, tokens: int = 1, cards: int = 1) -> Callable[[], None]:
+    """ Inserts tokens & cards, runs scan_devices, closes & removes them """
+    from . import helpers
+
+    def cycle():
+        for _ in range(tokens):
+            bus.insert_hid()
+        for _ in range(cards):
+            bus.insert_card()
+        with bus.install():
+            with helpers.scan_devices(wait=False):
+                pass
+        bus.remove_all()
+    return cycle